@@ -1,211 +1,838 @@
 #!/usr/bin/env python3
 from fastapi import FastAPI, HTTPException, BackgroundTasks, Request, Response
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 import asyncio
+import contextvars
 import time
 import os
 import subprocess
-from typing import Optional, Dict, Any, List
+import shutil
+import secrets
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor, BrokenExecutor
+import multiprocessing
+from typing import Optional, Dict, Any, List, Tuple, AsyncIterator, Awaitable, Callable
 import uvicorn
 import sys
-from contextlib import asynccontextmanager
+from contextlib import asynccontextmanager, contextmanager
 from datetime import datetime
+from email.utils import formatdate
 import aiohttp
 import aiofiles
 import httpx
 import cloudscraper
 import re
-from bs4 import BeautifulSoup
+import json
+import copy
+import functools
+import hashlib
+import heapq
+import itertools
+import unicodedata
+import zipfile
+from collections import OrderedDict
 import requests
-from urllib.parse import quote_plus
-import trafilatura
+from urllib.parse import quote_plus, urlparse
+import html_parsers
+import metrics
+import apk_metadata
+import coordination
+from bounded_state import ExpiringSet, KeyedLockTable
+from source_health import SourceHealth, SourceUnavailable
+from app_index import AppIndex
+import ranking
+import aria2p
+from pydantic import BaseModel, Field
 
-DOWNLOADS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'app_cache')
-os.makedirs(DOWNLOADS_DIR, exist_ok=True)
+# Created in lifespan; importing this module (as spawned parse workers do) touches no files
+DOWNLOADS_DIR = os.environ.get("APP_CACHE_DIR") or os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'app_cache')
 
-APKEEP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'apkeep')
+# Several uvicorn workers share DOWNLOADS_DIR; locks, the not-found cache and stats then go through files
+API_WORKERS = int(os.environ.get("API_WORKERS", "1"))
+MULTI_WORKER = API_WORKERS > 1
+LOCKS_DIR = os.path.join(DOWNLOADS_DIR, '.locks')
+COORDINATOR_DB = os.path.join(DOWNLOADS_DIR, '.coordinator.sqlite3')
+WORKER_STATS_INTERVAL = 5
+# Bookkeeping files the cache sweep and /cache clearing must leave alone
+STATE_FILE_PREFIXES = ('.cache_index', '.demand_index', '.not_found', '.coordinator', '.locks', '.prefetch.lock', '.aria2.lock', '.race', '.refresh', '.app_index')
 
-scraper = cloudscraper.create_scraper(
-    browser={
-        'browser': 'chrome',
-        'platform': 'android',
-        'mobile': True
-    }
+APKEEP_PATH = os.environ.get("APKEEP_PATH") or os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'apkeep')
+
+# Source hosts; overridable so the benchmark suite can point the server at local fixtures
+APKPURE_SEARCH_BASE = os.environ.get("APKPURE_SEARCH_BASE", "https://m.apkpure.com")
+APKPURE_DOWNLOAD_BASE = os.environ.get("APKPURE_DOWNLOAD_BASE", "https://d.apkpure.com")
+MODYOLO_BASE = os.environ.get("MODYOLO_BASE", "https://modyolo.com")
+AN1_BASE = os.environ.get("AN1_BASE", "https://an1.com")
+
+# Fixed timeouts are the ceiling; once a source has history its calls get a multiple of its p95 latency
+SCRAPE_TIMEOUT = 20
+FETCH_TIMEOUT = 20
+SOURCE_HEALTH_CONFIG = {
+    "window": float(os.environ.get("SOURCE_HEALTH_WINDOW", "300")),
+    "min_samples": int(os.environ.get("SOURCE_HEALTH_MIN_SAMPLES", "5")),
+    "failure_ratio": float(os.environ.get("SOURCE_BREAKER_FAILURE_RATIO", "0.5")),
+    "consecutive_failures": int(os.environ.get("SOURCE_BREAKER_CONSECUTIVE_FAILURES", "5")),
+    "cool_off": float(os.environ.get("SOURCE_BREAKER_COOL_OFF", "30")),
+    "max_cool_off": float(os.environ.get("SOURCE_BREAKER_MAX_COOL_OFF", "600")),
+    "timeout_multiplier": float(os.environ.get("SOURCE_TIMEOUT_MULTIPLIER", "3")),
+}
+source_health: Dict[str, SourceHealth] = {
+    name: SourceHealth(name, **SOURCE_HEALTH_CONFIG)
+    for name in ("apkpure", "apkpure_download", "apkeep", "modyolo", "an1")
+}
+# Matched by URL prefix: the fixture server serves every source from one host
+SOURCE_BASES = (
+    (APKPURE_SEARCH_BASE, "apkpure"),
+    (MODYOLO_BASE, "modyolo"),
+    (AN1_BASE, "an1"),
+)
+
+def health_for_url(url: str) -> Optional[SourceHealth]:
+    """Health tracker of the source serving url; arbitrary hosts (e.g. /extract) are not tracked"""
+    for base, name in SOURCE_BASES:
+        if url.startswith(base + "/") or url == base:
+            return source_health[name]
+    return None
+
+def source_health_status() -> Dict[str, Dict[str, Any]]:
+    # Page fetches use adaptive timeouts; transfers keep fixed ones since they scale with artifact size
+    defaults = {"apkpure": FETCH_TIMEOUT, "modyolo": SCRAPE_TIMEOUT, "an1": SCRAPE_TIMEOUT}
+    return {name: health.snapshot(defaults.get(name)) for name, health in source_health.items()}
+
+def source_unavailable(health: SourceHealth) -> SourceUnavailable:
+    return SourceUnavailable(f"{health.name} is unavailable (circuit open)", health.retry_after())
+
+scraper: Optional[cloudscraper.CloudScraper] = None
+
+def get_scraper() -> cloudscraper.CloudScraper:
+    global scraper
+    if scraper is None:
+        scraper = cloudscraper.create_scraper(
+            browser={
+                'browser': 'chrome',
+                'platform': 'android',
+                'mobile': True
+            }
+        )
+    return scraper
+
+STAGE_SECONDS = metrics.Histogram(
+    "apkapi_stage_duration_seconds",
+    "Time spent in each pipeline stage (fetch, scrape, parse, search, download, lock_wait, extract)",
+    ("stage", "source", "outcome")
 )
+STAGE_TOTAL = metrics.Counter(
+    "apkapi_stage_total",
+    "Pipeline stage completions by outcome",
+    ("stage", "source", "outcome")
+)
+HTTP_REQUEST_SECONDS = metrics.Histogram(
+    "apkapi_http_request_duration_seconds",
+    "API request latency by route",
+    ("method", "route", "status")
+)
+
+def observe_stage(stage: str, source: str, outcome: str, seconds: float):
+    STAGE_SECONDS.observe(seconds, stage=stage, source=source, outcome=outcome)
+    STAGE_TOTAL.inc(stage=stage, source=source, outcome=outcome)
+
+@contextmanager
+def track_stage(stage: str, source: str):
+    """Time a block as one stage run; set record["outcome"] to report something other than success"""
+    record = {"outcome": "success"}
+    start = time.perf_counter()
+    try:
+        yield record
+    except asyncio.CancelledError:
+        record["outcome"] = "cancelled"
+        raise
+    except Exception:
+        record["outcome"] = "error"
+        raise
+    finally:
+        observe_stage(stage, source, record["outcome"], time.perf_counter() - start)
+
+try:
+    import h2  # noqa: F401 - enables HTTP/2 in httpx
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
 
 httpx_client: Optional[httpx.AsyncClient] = None
 
+def create_httpx_client() -> httpx.AsyncClient:
+    """Shared keep-alive client; httpx keeps a connection pool per host and negotiates HTTP/2 via ALPN"""
+    return httpx.AsyncClient(
+        timeout=30.0,
+        follow_redirects=True,
+        http2=HTTP2_AVAILABLE,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=60.0),
+        headers={
+            'User-Agent': 'Mozilla/5.0 (Linux; Android 13; Pixel 7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Mobile Safari/537.36',
+            'Sec-CH-UA-Mobile': '?1',
+        }
+    )
+
 async def get_httpx_client() -> httpx.AsyncClient:
     global httpx_client
     if httpx_client is None:
-        httpx_client = httpx.AsyncClient(
-            timeout=30.0,
-            follow_redirects=True,
-            headers={
-                'User-Agent': 'Mozilla/5.0 (Linux; Android 13; Pixel 7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Mobile Safari/537.36',
-                'Sec-CH-UA-Mobile': '?1',
-            }
-        )
+        httpx_client = create_httpx_client()
     return httpx_client
 
-async def fetch_with_protection(url: str, use_cloudscraper: bool = True) -> Optional[str]:
-    """Fetch URL with anti-bot protection bypass using mobile headers"""
-    mobile_headers = {
-        'User-Agent': 'Mozilla/5.0 (Linux; Android 13; Pixel 7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Mobile Safari/537.36',
-        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-        'Accept-Language': 'en-US,en;q=0.9',
-        'Accept-Encoding': 'gzip, deflate, br',
-        'Connection': 'keep-alive',
-        'Sec-CH-UA': '"Chromium";v="120", "Google Chrome";v="120", "Not_A Brand";v="99"',
-        'Sec-CH-UA-Mobile': '?1',
-        'Sec-CH-UA-Platform': '"Android"',
-        'Sec-Fetch-Site': 'none',
-        'Sec-Fetch-Mode': 'navigate',
-        'Sec-Fetch-User': '?1',
-        'Sec-Fetch-Dest': 'document',
-        'Upgrade-Insecure-Requests': '1',
-    }
-    
-    if use_cloudscraper:
-        try:
-            loop = asyncio.get_event_loop()
-            response = await loop.run_in_executor(
-                None,
-                lambda: scraper.get(url, headers=mobile_headers, timeout=20)
-            )
-            if response.status_code == 200:
-                print(f"[CloudScraper] Success", file=sys.stderr)
-                return response.text
-        except Exception as e:
-            print(f"[CloudScraper] Failed: {e}", file=sys.stderr)
+requests_session = requests.Session()
+requests_session.mount('https://', requests.adapters.HTTPAdapter(pool_connections=20, pool_maxsize=20))
+requests_session.mount('http://', requests.adapters.HTTPAdapter(pool_connections=20, pool_maxsize=20))
+
+async def scrape_get(url: str, headers: Dict[str, str], timeout: float = SCRAPE_TIMEOUT) -> str:
+    """GET a page through the pooled httpx client and return its body text.
     
+    Raises SourceUnavailable without a request while the source's circuit is open.
+    """
+    health = health_for_url(url)
+    if health and not health.allow():
+        raise source_unavailable(health)
+    client = await get_httpx_client()
+    start = time.perf_counter()
+    ok = False
+    try:
+        with track_stage("scrape", urlparse(url).netloc) as stage:
+            response = await client.get(url, headers=headers, timeout=health.timeout(timeout) if health else timeout)
+            if response.status_code != 200:
+                stage["outcome"] = "failure"
+        # A 404 is an answer; only server errors and throttling count against the source
+        ok = response.status_code < 500 and response.status_code != 429
+        return response.text
+    except asyncio.CancelledError:
+        ok = None
+        raise
+    finally:
+        if health and ok is not None:
+            health.record(ok, time.perf_counter() - start)
+
+MOBILE_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Linux; Android 13; Pixel 7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Mobile Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.9',
+    'Accept-Encoding': 'gzip, deflate, br',
+    'Connection': 'keep-alive',
+    'Sec-CH-UA': '"Chromium";v="120", "Google Chrome";v="120", "Not_A Brand";v="99"',
+    'Sec-CH-UA-Mobile': '?1',
+    'Sec-CH-UA-Platform': '"Android"',
+    'Sec-Fetch-Site': 'none',
+    'Sec-Fetch-Mode': 'navigate',
+    'Sec-Fetch-User': '?1',
+    'Sec-Fetch-Dest': 'document',
+    'Upgrade-Insecure-Requests': '1',
+}
+
+FETCH_HEDGED = os.environ.get("FETCH_HEDGED", "true").lower() == "true"
+FETCH_HEDGE_DELAY = float(os.environ.get("FETCH_HEDGE_DELAY", "1.5"))
+
+# Set by callers that want the ETag/Last-Modified of whichever strategy wins
+fetch_validators: contextvars.ContextVar[Optional[Dict[str, str]]] = contextvars.ContextVar("fetch_validators", default=None)
+
+def _capture_validators(headers):
+    captured = fetch_validators.get()
+    if captured is None:
+        return
+    for name in ("ETag", "Last-Modified"):
+        if headers.get(name):
+            captured[name] = headers[name]
+
+async def _fetch_cloudscraper(url: str, headers: Dict[str, str], timeout: float) -> Optional[str]:
+    try:
+        loop = asyncio.get_event_loop()
+        session = get_scraper()
+        response = await loop.run_in_executor(
+            None,
+            lambda: session.get(url, headers=headers, timeout=timeout)
+        )
+        if response.status_code == 200:
+            print(f"[CloudScraper] Success", file=sys.stderr)
+            _capture_validators(response.headers)
+            return response.text
+        print(f"[CloudScraper] HTTP {response.status_code}", file=sys.stderr)
+    except Exception as e:
+        print(f"[CloudScraper] Failed: {e}", file=sys.stderr)
+    return None
+
+async def _fetch_httpx(url: str, headers: Dict[str, str], timeout: float) -> Optional[str]:
     try:
         client = await get_httpx_client()
-        response = await client.get(url, headers=mobile_headers)
+        response = await client.get(url, headers=headers, timeout=timeout)
         if response.status_code == 200:
             print(f"[httpx] Success", file=sys.stderr)
+            _capture_validators(response.headers)
             return response.text
+        print(f"[httpx] HTTP {response.status_code}", file=sys.stderr)
     except Exception as e:
         print(f"[httpx] Failed: {e}", file=sys.stderr)
-    
+    return None
+
+async def _fetch_requests(url: str, headers: Dict[str, str], timeout: float) -> Optional[str]:
     try:
         loop = asyncio.get_event_loop()
         response = await loop.run_in_executor(
             None,
-            lambda: requests.get(url, headers=mobile_headers, timeout=15)
+            lambda: requests_session.get(url, headers=headers, timeout=timeout)
         )
         if response.status_code == 200:
             print(f"[requests] Success", file=sys.stderr)
+            _capture_validators(response.headers)
             return response.text
+        print(f"[requests] HTTP {response.status_code}", file=sys.stderr)
     except Exception as e:
         print(f"[requests] Failed: {e}", file=sys.stderr)
-    
     return None
 
-async def download_with_aria2(url: str, output_path: str, filename: str) -> Optional[str]:
-    """Download file using aria2c with multiple connections for speed"""
+FETCH_STRATEGIES = {
+    "cloudscraper": _fetch_cloudscraper,
+    "httpx": _fetch_httpx,
+    "requests": _fetch_requests,
+}
+
+fetch_host_wins: Dict[str, Dict[str, int]] = {}
+
+async def run_fetch_strategy(name: str, url: str, timeout: float = FETCH_TIMEOUT) -> Optional[str]:
+    with track_stage("fetch", name) as stage:
+        html = await FETCH_STRATEGIES[name](url, MOBILE_HEADERS, timeout)
+        if html is None:
+            stage["outcome"] = "failure"
+        return html
+
+def ordered_fetch_strategies(host: str, use_cloudscraper: bool = True) -> List[str]:
+    """Default strategy order, with the strategies that won most often for this host first"""
+    names = [name for name in FETCH_STRATEGIES if use_cloudscraper or name != "cloudscraper"]
+    wins = fetch_host_wins.get(host, {})
+    return sorted(names, key=lambda name: -wins.get(name, 0))
+
+def record_fetch_win(host: str, strategy: str):
+    wins = fetch_host_wins.setdefault(host, {})
+    wins[strategy] = wins.get(strategy, 0) + 1
+
+async def _hedged_fetch(url: str, strategies: List[str], timeout: float = FETCH_TIMEOUT) -> Tuple[Optional[str], Optional[str]]:
+    """Start strategies one hedge delay apart (or as soon as one fails); first 200 wins, the rest are cancelled"""
+    remaining = list(strategies)
+    running: Dict[asyncio.Task, str] = {}
+    
+    def launch_next():
+        name = remaining.pop(0)
+        running[asyncio.create_task(run_fetch_strategy(name, url, timeout))] = name
+    
+    launch_next()
+    try:
+        while running:
+            done, _ = await asyncio.wait(
+                running.keys(),
+                timeout=FETCH_HEDGE_DELAY if remaining else None,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            if not done:
+                print(f"[Fetch] No answer after {FETCH_HEDGE_DELAY}s, hedging with {remaining[0]}", file=sys.stderr)
+                launch_next()
+                continue
+            
+            for task in done:
+                name = running.pop(task)
+                html = task.result()
+                if html is not None:
+                    return html, name
+            
+            if remaining:
+                launch_next()
+        return None, None
+    finally:
+        for task in running:
+            task.cancel()
+
+async def fetch_with_protection(url: str, use_cloudscraper: bool = True) -> Optional[str]:
+    """Fetch URL with anti-bot protection bypass using mobile headers.
+    
+    In hedged mode (FETCH_HEDGED) a backup strategy starts after
+    FETCH_HEDGE_DELAY seconds instead of waiting for the previous one to time
+    out. Strategies that win for a host are tried first on later fetches.
+    Returns None at once while the source's circuit is open.
+    """
+    health = health_for_url(url)
+    if health and not health.allow():
+        print(f"[Fetch] {health.name} circuit open, skipping {url}", file=sys.stderr)
+        return None
+    timeout = health.timeout(FETCH_TIMEOUT) if health else FETCH_TIMEOUT
+    host = urlparse(url).netloc
+    strategies = ordered_fetch_strategies(host, use_cloudscraper)
+    
+    start = time.perf_counter()
+    if FETCH_HEDGED:
+        html, winner = await _hedged_fetch(url, strategies, timeout)
+    else:
+        html, winner = None, None
+        for name in strategies:
+            html = await run_fetch_strategy(name, url, timeout)
+            if html is not None:
+                winner = name
+                break
+    if health:
+        health.record(html is not None, time.perf_counter() - start)
+    
+    if winner:
+        record_fetch_win(host, winner)
+    return html
+
+ARIA2_RPC_HOST = "http://127.0.0.1"
+ARIA2_RPC_PORT = int(os.environ.get("ARIA2_RPC_PORT", "6800"))
+ARIA2_RPC_SECRET = os.environ.get("ARIA2_RPC_SECRET") or secrets.token_hex(16)
+ARIA2_MAX_CONCURRENT = int(os.environ.get("ARIA2_MAX_CONCURRENT", "8"))
+ARIA2_POLL_INTERVAL = 0.5
+ARIA2_DOWNLOAD_TIMEOUT = 300
+ARIA2_ARGS = [
+    '-x', '16',
+    '-s', '16',
+    '-k', '1M',
+    '--max-connection-per-server=16',
+    '--min-split-size=1M',
+    '--file-allocation=none',
+    '--continue=true',
+    '--stream-piece-selector=inorder',
+    '--timeout=120',
+    '--connect-timeout=30',
+]
+
+aria2_daemon: Optional[asyncio.subprocess.Process] = None
+aria2_client: Optional[aria2p.Client] = None
+aria2_rpc_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="aria2-rpc")
+aria2_transfers: Dict[str, Dict[str, Any]] = {}
+aria2_local_procs: Dict[str, asyncio.subprocess.Process] = {}
+
+async def aria2_rpc(method: str, *args) -> Any:
+    """Call an aria2 RPC method without blocking the event loop"""
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(
+        aria2_rpc_executor,
+        lambda: getattr(aria2_client, method)(*args)
+    )
+
+async def start_aria2_daemon() -> bool:
+    """Start (or attach to) a long-lived aria2c RPC daemon; workers take turns so only one spawns it"""
+    if not MULTI_WORKER:
+        return await _start_aria2_daemon()
+    lock_path = os.path.join(DOWNLOADS_DIR, '.aria2.lock')
+    fd = await coordination.acquire_file_lock(lock_path)
+    try:
+        return await _start_aria2_daemon()
+    finally:
+        coordination.release_file_lock(lock_path, fd)
+
+async def _start_aria2_daemon() -> bool:
+    global aria2_daemon, aria2_client
+    
+    aria2_client = aria2p.Client(host=ARIA2_RPC_HOST, port=ARIA2_RPC_PORT, secret=ARIA2_RPC_SECRET, timeout=10)
+    try:
+        version = await aria2_rpc('get_version')
+        print(f"[aria2] Attached to running RPC daemon v{version.get('version')}", file=sys.stderr)
+        return True
+    except Exception:
+        pass
+    
+    if not shutil.which('aria2c'):
+        print(f"[aria2] aria2c not installed, RPC daemon disabled", file=sys.stderr)
+        aria2_client = None
+        return False
+    
+    try:
+        aria2_daemon = await asyncio.create_subprocess_exec(
+            'aria2c',
+            '--enable-rpc',
+            '--rpc-listen-all=false',
+            f'--rpc-listen-port={ARIA2_RPC_PORT}',
+            f'--rpc-secret={ARIA2_RPC_SECRET}',
+            f'--max-concurrent-downloads={ARIA2_MAX_CONCURRENT}',
+            '--auto-file-renaming=false',
+            '--allow-overwrite=true',
+            '--quiet=true',
+            *ARIA2_ARGS,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL
+        )
+    except Exception as e:
+        print(f"[aria2] Failed to start RPC daemon: {e}", file=sys.stderr)
+        aria2_client = None
+        return False
+    
+    for _ in range(50):
+        await asyncio.sleep(0.1)
+        if aria2_daemon.returncode is not None:
+            break
+        try:
+            version = await aria2_rpc('get_version')
+            print(f"[aria2] RPC daemon v{version.get('version')} listening on port {ARIA2_RPC_PORT}", file=sys.stderr)
+            return True
+        except Exception:
+            continue
+    
+    print(f"[aria2] RPC daemon did not come up, using one-shot aria2c", file=sys.stderr)
+    await stop_aria2_daemon()
+    return False
+
+async def stop_aria2_daemon():
+    global aria2_daemon, aria2_client
+    for transfer_id in list(aria2_transfers):
+        await cancel_aria2_transfer(transfer_id)
+    if aria2_daemon and aria2_daemon.returncode is None:
+        aria2_daemon.terminate()
+        try:
+            await asyncio.wait_for(aria2_daemon.wait(), timeout=5)
+        except asyncio.TimeoutError:
+            aria2_daemon.kill()
+    aria2_daemon = None
+    aria2_client = None
+
+def remove_partial_download(file_path: str):
+    for path in (file_path, file_path + '.aria2'):
+        try:
+            if os.path.exists(path):
+                os.remove(path)
+        except Exception as e:
+            print(f"[aria2] Failed to remove partial file {path}: {e}", file=sys.stderr)
+
+async def cancel_aria2_transfer(transfer_id: str) -> bool:
+    """Cancel an active transfer; its download_with_aria2 call returns None"""
+    transfer = aria2_transfers.get(transfer_id)
+    if not transfer:
+        return False
+    transfer["status"] = "cancelled"
+    
+    proc = aria2_local_procs.get(transfer_id)
+    if proc:
+        if proc.returncode is None:
+            proc.kill()
+        return True
+    
+    if aria2_client:
+        try:
+            await aria2_rpc('force_remove', transfer_id)
+        except Exception as e:
+            print(f"[aria2] Cancel {transfer_id} failed: {e}", file=sys.stderr)
+    return True
+
+def contiguous_from_bitfield(bitfield: str, piece_length: int, total: int) -> int:
+    """Bytes at the start of the file that aria2 has fully written"""
+    if not bitfield or not piece_length:
+        return 0
+    bits = bin(int(bitfield, 16))[2:].zfill(len(bitfield) * 4)
+    leading = len(bits) - len(bits.lstrip('1'))
+    return min(leading * piece_length, total)
+
+def get_aria2_transfers() -> List[Dict[str, Any]]:
+    now = time.time()
+    transfers = []
+    for transfer in aria2_transfers.values():
+        total = transfer["total"]
+        speed = transfer["speed"]
+        remaining = total - transfer["completed"]
+        transfers.append({
+            **transfer,
+            "elapsed": round(now - transfer["started_at"], 1),
+            "progress": round(transfer["completed"] * 100 / total, 1) if total else 0.0,
+            "eta": round(remaining / speed, 1) if speed and total else None
+        })
+    return transfers
+
+async def _aria2_rpc_download(url: str, file_path: str, transfer: Dict[str, Any], timeout: float) -> bool:
+    gid = await aria2_rpc('add_uri', [url], {
+        'dir': os.path.dirname(file_path),
+        'out': os.path.basename(file_path),
+    })
+    transfer["id"] = gid
+    aria2_transfers[gid] = transfer
+    deadline = time.time() + timeout
+    
+    try:
+        while True:
+            status = await aria2_rpc(
+                'tell_status', gid,
+                ['status', 'completedLength', 'totalLength', 'downloadSpeed', 'errorMessage', 'bitfield', 'pieceLength']
+            )
+            transfer["completed"] = int(status.get('completedLength', 0))
+            transfer["total"] = int(status.get('totalLength', 0))
+            transfer["speed"] = int(status.get('downloadSpeed', 0))
+            transfer["contiguous"] = contiguous_from_bitfield(
+                status.get('bitfield', ''), int(status.get('pieceLength', 0)), transfer["total"]
+            )
+            
+            state = status.get('status')
+            if state == 'complete':
+                transfer["status"] = "complete"
+                transfer["contiguous"] = transfer["total"]
+                return True
+            if state in ('error', 'removed'):
+                if transfer["status"] != "cancelled":
+                    transfer["status"] = "error"
+                    transfer["error"] = status.get('errorMessage', '')
+                print(f"[aria2] Failed: {transfer['error'] or transfer['status']}", file=sys.stderr)
+                return False
+            if time.time() > deadline:
+                print(f"[aria2] Timeout", file=sys.stderr)
+                transfer["status"] = "timeout"
+                await aria2_rpc('force_remove', gid)
+                return False
+            
+            await asyncio.sleep(ARIA2_POLL_INTERVAL)
+    except asyncio.CancelledError:
+        transfer["status"] = "cancelled"
+        try:
+            await aria2_rpc('force_remove', gid)
+        except Exception:
+            pass
+        raise
+    finally:
+        aria2_transfers.pop(gid, None)
+        try:
+            await aria2_rpc('remove_download_result', gid)
+        except Exception:
+            pass
+
+async def _aria2_local_download(url: str, file_path: str, transfer: Dict[str, Any], timeout: float) -> bool:
+    transfer_id = f"local-{secrets.token_hex(4)}"
+    transfer["id"] = transfer_id
+    aria2_transfers[transfer_id] = transfer
+    
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            'aria2c',
+            *ARIA2_ARGS,
+            '-d', os.path.dirname(file_path),
+            '-o', os.path.basename(file_path),
+            url,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        aria2_local_procs[transfer_id] = proc
+        communicate = asyncio.ensure_future(proc.communicate())
+        deadline = time.time() + timeout
+        try:
+            while True:
+                done, _ = await asyncio.wait({communicate}, timeout=ARIA2_POLL_INTERVAL)
+                if done:
+                    break
+                if os.path.exists(file_path):
+                    transfer["completed"] = os.path.getsize(file_path)
+                if time.time() > deadline:
+                    proc.kill()
+                    await communicate
+                    print(f"[aria2] Timeout", file=sys.stderr)
+                    transfer["status"] = "timeout"
+                    return False
+        except asyncio.CancelledError:
+            transfer["status"] = "cancelled"
+            if proc.returncode is None:
+                proc.kill()
+            # Reap the child and its pipe reader so neither outlives the cancelled transfer
+            try:
+                await communicate
+            except asyncio.CancelledError:
+                communicate.cancel()
+                raise
+            except Exception:
+                pass
+            raise
+        _, stderr = communicate.result()
+        
+        if proc.returncode == 0:
+            transfer["status"] = "complete"
+            if os.path.exists(file_path):
+                transfer["completed"] = transfer["total"] = transfer["contiguous"] = os.path.getsize(file_path)
+            return True
+        if transfer["status"] != "cancelled":
+            transfer["status"] = "error"
+            transfer["error"] = stderr.decode(errors='replace')[-500:]
+        print(f"[aria2] Failed: {transfer['error'] or transfer['status']}", file=sys.stderr)
+        return False
+    finally:
+        aria2_transfers.pop(transfer_id, None)
+        aria2_local_procs.pop(transfer_id, None)
+
+async def download_with_aria2(url: str, output_path: str, filename: str, timeout: float = ARIA2_DOWNLOAD_TIMEOUT,
+                             transfer: Optional[Dict[str, Any]] = None) -> Optional[str]:
+    """Download file using aria2 with multiple connections for speed.
+    
+    Transfers go through the shared RPC daemon when it is running so the event
+    loop only awaits progress polls; otherwise a one-shot aria2c subprocess is
+    awaited asynchronously. Cancelling the calling task cancels the transfer.
+    A caller-owned ``transfer`` dict is updated in place with progress, and its
+    ``attempt`` counter is bumped every time a new file is started.
+    """
+    file_path = os.path.join(output_path, filename)
+    if transfer is None:
+        transfer = {}
+    transfer.update({
+        "id": None,
+        "url": url,
+        "filename": filename,
+        "path": file_path,
+        "attempt": transfer.get("attempt", 0) + 1,
+        "status": "active",
+        "completed": 0,
+        "contiguous": 0,
+        "total": 0,
+        "speed": 0,
+        "error": "",
+        "started_at": time.time()
+    })
+    
     try:
         print(f"[aria2] Downloading with 16 connections...", file=sys.stderr)
         start_time = time.time()
         
-        result = subprocess.run(
-            [
-                'aria2c',
-                '-x', '16',
-                '-s', '16', 
-                '-k', '1M',
-                '--max-connection-per-server=16',
-                '--min-split-size=1M',
-                '--file-allocation=none',
-                '--continue=true',
-                '-d', output_path,
-                '-o', filename,
-                '--timeout=120',
-                '--connect-timeout=30',
-                url
-            ],
-            capture_output=True,
-            text=True,
-            timeout=300
-        )
+        if aria2_client:
+            ok = await _aria2_rpc_download(url, file_path, transfer, timeout)
+        elif shutil.which('aria2c'):
+            ok = await _aria2_local_download(url, file_path, transfer, timeout)
+        else:
+            print(f"[aria2] aria2c not installed", file=sys.stderr)
+            return None
         
         elapsed = time.time() - start_time
-        file_path = os.path.join(output_path, filename)
         
-        if os.path.exists(file_path) and os.path.getsize(file_path) > 100000:
+        if ok and os.path.exists(file_path) and os.path.getsize(file_path) > 100000:
             size_mb = os.path.getsize(file_path) / (1024 * 1024)
             print(f"[aria2] Downloaded: {size_mb:.1f} MB in {elapsed:.1f}s", file=sys.stderr)
             return file_path
         
-        print(f"[aria2] Failed: {result.stderr}", file=sys.stderr)
+        remove_partial_download(file_path)
         return None
         
-    except subprocess.TimeoutExpired:
-        print(f"[aria2] Timeout", file=sys.stderr)
-        return None
+    except asyncio.CancelledError:
+        remove_partial_download(file_path)
+        raise
     except Exception as e:
         print(f"[aria2] Error: {e}", file=sys.stderr)
+        remove_partial_download(file_path)
         return None
 
-import zipfile
-import io
+def aria2_reported_missing(transfer: Dict[str, Any]) -> bool:
+    """Whether a failed transfer ended in an HTTP 404 rather than a timeout or server error"""
+    error = (transfer.get("error") or "").lower()
+    return transfer.get("status") == "error" and ("404" in error or "not found" in error)
 
-def detect_real_file_type(file_path: str) -> str:
-    """Detect actual file type by inspecting ZIP contents"""
-    try:
-        with zipfile.ZipFile(file_path, 'r') as zf:
-            names = zf.namelist()
-            names_lower = [n.lower() for n in names]
-            
-            if 'manifest.json' in names_lower:
-                print(f"[Type Detect] Found manifest.json - this is XAPK", file=sys.stderr)
-                return 'xapk'
-            
-            has_apk = any(n.endswith('.apk') for n in names_lower)
-            has_obb = any('.obb' in n for n in names_lower)
-            
-            if has_apk or has_obb:
-                print(f"[Type Detect] Found APK/OBB inside - this is XAPK", file=sys.stderr)
-                return 'xapk'
-            
-            if 'androidmanifest.xml' in names_lower:
-                print(f"[Type Detect] Found AndroidManifest.xml at root - this is APK", file=sys.stderr)
-                return 'apk'
-            
-            if 'classes.dex' in names_lower or 'resources.arsc' in names_lower:
-                print(f"[Type Detect] Found APK structure - this is APK", file=sys.stderr)
-                return 'apk'
-            
-            print(f"[Type Detect] Unknown structure, files: {names[:5]}", file=sys.stderr)
-            return 'apk'
-            
-    except zipfile.BadZipFile:
-        print(f"[Type Detect] Not a valid ZIP file", file=sys.stderr)
-        return 'apk'
-    except Exception as e:
-        print(f"[Type Detect] Error: {e}", file=sys.stderr)
-        return 'apk'
+APKPURE_PROBE = os.environ.get("APKPURE_PROBE", "true").lower() == "true"
+APKPURE_PROBE_TIMEOUT = float(os.environ.get("APKPURE_PROBE_TIMEOUT", "10"))
+APKPURE_KINDS = ("XAPK", "APK")
+ZIP_MAGIC = b'PK\x03\x04'
+
+def apkpure_download_url(package_name: str, kind: str) -> str:
+    return f"{APKPURE_DOWNLOAD_BASE}/b/{kind}/{package_name}?version=latest"
+
+async def probe_apkpure_endpoint(package_name: str, kind: str) -> Dict[str, Any]:
+    """Ask one APKPure endpoint for its first bytes.
+    
+    ``verdict`` is "valid" (a ZIP is served), "missing" (404), or
+    "unknown" (timeout, server error or an unexpected body) when only a
+    real transfer can tell.
+    """
+    url = apkpure_download_url(package_name, kind)
+    probe = {"kind": kind, "url": url, "status": None, "size": None, "verdict": "unknown"}
+    client = await get_httpx_client()
+    with track_stage("probe", f"apkpure-{kind.lower()}") as stage:
+        try:
+            async with client.stream("GET", url, headers={"Range": f"bytes=0-{len(ZIP_MAGIC) - 1}"},
+                                     timeout=APKPURE_PROBE_TIMEOUT) as response:
+                probe["status"] = response.status_code
+                if response.status_code == 404:
+                    probe["verdict"] = "missing"
+                    return probe
+                if response.status_code not in (200, 206):
+                    stage["outcome"] = "failure"
+                    return probe
+                # Servers that ignore Range send the whole file; stop after the first chunk
+                head = b''
+                async for chunk in response.aiter_raw():
+                    head += chunk
+                    if len(head) >= len(ZIP_MAGIC):
+                        break
+                content_range = response.headers.get("content-range", "")
+                if "/" in content_range and content_range.rsplit("/", 1)[1].isdigit():
+                    probe["size"] = int(content_range.rsplit("/", 1)[1])
+                elif response.status_code == 200 and response.headers.get("content-length", "").isdigit():
+                    probe["size"] = int(response.headers["content-length"])
+                if head.startswith(ZIP_MAGIC):
+                    probe["verdict"] = "valid"
+                    # Hand aria2 the CDN URL APKPure redirected to and skip the redirect
+                    probe["url"] = str(response.url)
+                else:
+                    stage["outcome"] = "failure"
+        except httpx.HTTPError as e:
+            stage["outcome"] = "failure"
+            probe["error"] = str(e) or type(e).__name__
+    return probe
+
+async def resolve_apkpure_download(package_name: str) -> Tuple[List[Dict[str, Any]], bool]:
+    """Probe the XAPK and APK endpoints at once.
+    
+    Returns the candidates worth a transfer (valid ones first, XAPK before
+    APK, then inconclusive ones) and whether every endpoint answered 404.
+    """
+    probes = await asyncio.gather(*(probe_apkpure_endpoint(package_name, kind) for kind in APKPURE_KINDS))
+    valid = [probe for probe in probes if probe["verdict"] == "valid"]
+    unknown = [probe for probe in probes if probe["verdict"] == "unknown"]
+    print(f"[APKPure] Probed {package_name}: " + ", ".join(
+        f"{probe['kind']}={probe['verdict']}" for probe in probes
+    ), file=sys.stderr)
+    return valid + unknown, not valid and not unknown
 
-async def download_from_apkpure(package_name: str, output_dir: str) -> Optional[str]:
-    """Download from APKPure and detect real file type from content"""
+async def download_from_apkpure(package_name: str, output_dir: str, transfer: Optional[Dict[str, Any]] = None) -> Optional[str]:
+    """Download from APKPure and detect real file type from content.
+    
+    Both endpoints are probed concurrently (APKPURE_PROBE) and a single
+    aria2 transfer is started on the one serving a ZIP, so a miss costs two
+    small requests instead of two failed transfers. Endpoints whose probe is
+    inconclusive are still tried in turn.
+    
+    The parsed artifact metadata is left in ``transfer["metadata"]`` so the
+    ZIP is only read once per download. The outcome is reported to the
+    apkpure_download health tracker; a 404 from both endpoints is a healthy miss.
+    """
+    if transfer is None:
+        transfer = {}
+    health = source_health["apkpure_download"]
+    start = time.perf_counter()
     try:
         temp_filename = f"{package_name}.tmp"
-        download_url = f"https://d.apkpure.com/b/XAPK/{package_name}?version=latest"
-        
         print(f"[APKPure] Downloading {package_name}...", file=sys.stderr)
-        result = await download_with_aria2(download_url, output_dir, temp_filename)
         
-        if not result or not os.path.exists(result) or os.path.getsize(result) < 100000:
-            download_url = f"https://d.apkpure.com/b/APK/{package_name}?version=latest"
-            print(f"[APKPure] XAPK failed, trying APK endpoint...", file=sys.stderr)
-            result = await download_with_aria2(download_url, output_dir, temp_filename)
+        if APKPURE_PROBE:
+            candidates, missing = await resolve_apkpure_download(package_name)
+            if missing:
+                transfer.update({"status": "error", "error": "HTTP 404 from every APKPure endpoint"})
+        else:
+            candidates = [{"kind": kind, "url": apkpure_download_url(package_name, kind)} for kind in APKPURE_KINDS]
+        
+        result = None
+        for i, candidate in enumerate(candidates):
+            if i:
+                print(f"[APKPure] {candidates[i - 1]['kind']} failed, trying {candidate['kind']} endpoint...", file=sys.stderr)
+            # The probe may have swapped in a CDN URL, so the kind is recorded rather than read from it
+            transfer["kind"] = candidate["kind"].lower()
+            transfer["source"] = "aria2+apkpure"
+            # Tee clients only attach once no other endpoint's file can replace this one mid-stream
+            transfer["settled"] = candidate.get("verdict") == "valid" or i == len(candidates) - 1
+            with track_stage("download", f"aria2-{candidate['kind'].lower()}") as stage:
+                result = await download_with_aria2(candidate["url"], output_dir, temp_filename, transfer=transfer)
+                if not result:
+                    stage["outcome"] = "failure"
+            if result:
+                break
         
-        if not result or not os.path.exists(result) or os.path.getsize(result) < 100000:
+        if not result or not os.path.exists(result):
             print(f"[APKPure] Download failed for {package_name}", file=sys.stderr)
+            if transfer.get("status") != "cancelled":
+                health.record(aria2_reported_missing(transfer), time.perf_counter() - start)
             return None
         
-        real_type = detect_real_file_type(result)
+        health.record(True, time.perf_counter() - start)
+        metadata = await asyncio.get_event_loop().run_in_executor(None, apk_metadata.read_artifact_metadata, result)
+        transfer["metadata"] = metadata
+        real_type = metadata["file_type"]
+        print(f"[Type Detect] {package_name} is {real_type.upper()}", file=sys.stderr)
         final_filename = f"{package_name}.{real_type}"
         final_path = os.path.join(output_dir, final_filename)
         
@@ -219,134 +846,234 @@ async def download_from_apkpure(package_name: str, output_dir: str) -> Optional[
         print(f"[APKPure] Error: {e}", file=sys.stderr)
         return None
 
-not_found_cache: Dict[str, float] = {}
 NOT_FOUND_CACHE_TTL = 3600
+NOT_FOUND_CACHE_MAX_ENTRIES = int(os.environ.get("NOT_FOUND_CACHE_MAX_ENTRIES", "20000"))
+NOT_FOUND_CACHE_DB = os.environ.get("NOT_FOUND_CACHE_DB", os.path.join(DOWNLOADS_DIR, '.not_found.sqlite3'))
+
+# Known-missing packages; expired via a heap, capped, and persisted (from lifespan) unless NOT_FOUND_CACHE_DB is empty
+not_found_cache = ExpiringSet(NOT_FOUND_CACHE_TTL, NOT_FOUND_CACHE_MAX_ENTRIES)
+
+SCRAPE_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Linux; Android 13; Pixel 7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Mobile Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.9',
+}
+
+PARSE_EXECUTOR = os.environ.get("PARSE_EXECUTOR", "process").lower()
+PARSE_WORKERS = int(os.environ.get("PARSE_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+parse_executor: Executor = ThreadPoolExecutor(max_workers=PARSE_WORKERS, thread_name_prefix="parse")
+parse_pool_lock = asyncio.Lock()
+
+def new_parse_process_pool() -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(max_workers=PARSE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+
+async def start_parse_pool():
+    """Move HTML parsing to worker processes so it scales across cores (PARSE_EXECUTOR=thread keeps threads)"""
+    global parse_executor
+    if PARSE_EXECUTOR != "process":
+        return
+    pool = None
+    try:
+        pool = new_parse_process_pool()
+        warm_up = pool.submit(html_parsers.parse_apkpure_search, "", 0)
+        await asyncio.wait_for(asyncio.wrap_future(warm_up), timeout=30)
+    except Exception as e:
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+        print(f"[Parse] Process pool unavailable, parsing in threads: {e}", file=sys.stderr)
+        return
+    thread_pool, parse_executor = parse_executor, pool
+    thread_pool.shutdown(wait=False)
+    print(f"[Parse] {PARSE_WORKERS} parse worker processes started", file=sys.stderr)
+
+def stop_parse_pool():
+    parse_executor.shutdown(wait=False, cancel_futures=True)
+
+async def replace_broken_parse_pool(broken: Executor):
+    """Swap a crashed process pool for a fresh one; concurrent callers replace it only once"""
+    global parse_executor
+    async with parse_pool_lock:
+        if parse_executor is not broken:
+            return
+        broken.shutdown(wait=False, cancel_futures=True)
+        try:
+            # Workers are spawned on first submit, so this does not block the loop
+            parse_executor = new_parse_process_pool()
+            print(f"[Parse] Worker pool broken, started a new one", file=sys.stderr)
+        except Exception as e:
+            parse_executor = ThreadPoolExecutor(max_workers=PARSE_WORKERS, thread_name_prefix="parse")
+            print(f"[Parse] Worker pool broken, parsing in threads: {e}", file=sys.stderr)
+
+async def run_parser(fn, *args) -> Any:
+    """Run an html_parsers function off the event loop"""
+    loop = asyncio.get_event_loop()
+    executor = parse_executor
+    with track_stage("parse", fn.__name__):
+        try:
+            return await loop.run_in_executor(executor, fn, *args)
+        except BrokenExecutor:
+            await replace_broken_parse_pool(executor)
+            # The input may be what crashed the worker, so it is retried in a thread, not the new pool
+            return await loop.run_in_executor(None, fn, *args)
+
+inflight_calls: Dict[Tuple[Any, ...], asyncio.Task] = {}
+single_flight_stats = {
+    "leaders": 0,
+    "followers": 0
+}
+
+def single_flight(name: str, key_fn=None):
+    """Share one underlying call between concurrent identical requests.
+    
+    The first caller for a key starts the call as a task; callers arriving
+    while it runs await the same task. A cancelled caller does not cancel the
+    shared call. Every caller gets its own copy of the result.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            key = (name, key_fn(*args, **kwargs) if key_fn else (args, tuple(sorted(kwargs.items()))))
+            task = inflight_calls.get(key)
+            if task is None:
+                single_flight_stats["leaders"] += 1
+                task = asyncio.create_task(fn(*args, **kwargs))
+                inflight_calls[key] = task
+                task.add_done_callback(lambda _, key=key: inflight_calls.pop(key, None))
+            else:
+                single_flight_stats["followers"] += 1
+                print(f"[SingleFlight] Joining in-flight {name} call", file=sys.stderr)
+            return copy.deepcopy(await asyncio.shield(task))
+        return wrapper
+    return decorator
+
+def search_flight_key(query: str, num_results: int = 10) -> Tuple[str, int]:
+    return normalize_query(query), num_results
+
+SEARCH_CACHE_TTL = int(os.environ.get("SEARCH_CACHE_TTL", "600"))
+SEARCH_CACHE_STALE_TTL = int(os.environ.get("SEARCH_CACHE_STALE_TTL", "3600"))
+SEARCH_CACHE_MAX_ENTRIES = int(os.environ.get("SEARCH_CACHE_MAX_ENTRIES", "1000"))
+
+# Every search result ever scraped, for instant local answers and for outages
+APP_INDEX_ENABLED = os.environ.get("APP_INDEX_ENABLED", "1") == "1"
+APP_INDEX_DB = os.environ.get("APP_INDEX_DB", os.path.join(DOWNLOADS_DIR, '.app_index.sqlite3'))
+APP_INDEX_MAX_ENTRIES = int(os.environ.get("APP_INDEX_MAX_ENTRIES", "200000"))
+
+# Opened in lifespan when APP_INDEX_ENABLED
+app_index: Optional[AppIndex] = None
+# One thread owns the index connection, so its SQLite writes and busy waits never block the loop
+app_index_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="app-index")
+app_index_refreshing: Dict[str, asyncio.Task] = {}
+app_index_stats = {
+    "local_answers": 0,
+    "fallbacks": 0,
+    "refreshes": 0
+}
+
+search_cache: "OrderedDict[Tuple[str, str, int], Dict[str, Any]]" = OrderedDict()
+search_cache_refreshing: Dict[Tuple[str, str, int], asyncio.Task] = {}
+search_cache_stats = {
+    "hits": 0,
+    "stale_hits": 0,
+    "misses": 0,
+    "refreshes": 0
+}
+
+async def app_index_call(fn, *args, **kwargs) -> Any:
+    """Run an AppIndex method on the index thread"""
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(app_index_executor, functools.partial(fn, *args, **kwargs))
+
+def normalize_query(query: str) -> str:
+    return ' '.join(unicodedata.normalize('NFKC', query).casefold().split())
+
+def _store_search_result(key: Tuple[str, str, int], results: List[Dict[str, Any]]):
+    if not results:
+        return
+    if app_index is not None:
+        app_index_executor.submit(app_index.record, key[0], results)
+    search_cache[key] = {"results": results, "created_at": time.time()}
+    search_cache.move_to_end(key)
+    while len(search_cache) > SEARCH_CACHE_MAX_ENTRIES:
+        search_cache.popitem(last=False)
 
+async def _refresh_search_result(key: Tuple[str, str, int], fn, query: str, num_results: int):
+    try:
+        search_cache_stats["refreshes"] += 1
+        _store_search_result(key, await fn(query, num_results))
+    except Exception as e:
+        print(f"[SearchCache] Refresh failed for {key}: {e}", file=sys.stderr)
+    finally:
+        search_cache_refreshing.pop(key, None)
+
+def cached_search(source: str):
+    """Cache a search scraper's results per normalized query with stale-while-revalidate.
+    
+    Fresh entries (younger than SEARCH_CACHE_TTL) are served directly. Entries
+    up to SEARCH_CACHE_STALE_TTL older than that are served immediately while a
+    background task refreshes them. Empty results are never cached so a failed
+    scrape does not stick. Callers get copies, so mutating results is safe.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(query: str, num_results: int = 10) -> List[Dict[str, Any]]:
+            start = time.perf_counter()
+            key = (source, normalize_query(query), num_results)
+            entry = search_cache.get(key)
+            if entry:
+                age = time.time() - entry["created_at"]
+                if age < SEARCH_CACHE_TTL:
+                    search_cache_stats["hits"] += 1
+                    search_cache.move_to_end(key)
+                    observe_stage("search", source, "hit", time.perf_counter() - start)
+                    return copy.deepcopy(entry["results"])
+                if age < SEARCH_CACHE_TTL + SEARCH_CACHE_STALE_TTL:
+                    search_cache_stats["stale_hits"] += 1
+                    if key not in search_cache_refreshing:
+                        search_cache_refreshing[key] = asyncio.create_task(
+                            _refresh_search_result(key, fn, query, num_results)
+                        )
+                    observe_stage("search", source, "stale", time.perf_counter() - start)
+                    return copy.deepcopy(entry["results"])
+                search_cache.pop(key, None)
+            
+            search_cache_stats["misses"] += 1
+            with track_stage("search", source) as stage:
+                results = await fn(query, num_results)
+                stage["outcome"] = "miss" if results else "empty"
+            _store_search_result(key, results)
+            return copy.deepcopy(results)
+        return wrapper
+    return decorator
+
+@cached_search("MODYOLO")
+@single_flight("search_modyolo", search_flight_key)
 async def search_modyolo(query: str, num_results: int = 10) -> List[Dict[str, Any]]:
     """Search MODYOLO for modded APKs - reliable mod source"""
     try:
         print(f"[MODYOLO] Searching: {query}", file=sys.stderr)
-        query_lower = query.lower()
         
         all_apps = []
-        seen_urls = set()
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Linux; Android 13; Pixel 7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Mobile Safari/537.36',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-            'Accept-Language': 'en-US,en;q=0.9',
-        }
-        
-        loop = asyncio.get_event_loop()
-        
-        search_url = f"https://modyolo.com/?s={quote_plus(query)}"
+        search_url = f"{MODYOLO_BASE}/?s={quote_plus(query)}"
         print(f"[MODYOLO] Searching: {search_url}", file=sys.stderr)
         
         try:
-            html = await loop.run_in_executor(
-                None,
-                lambda: requests.get(search_url, headers=headers, timeout=20).text
-            )
+            html = await scrape_get(search_url, SCRAPE_HEADERS)
             
             if html:
-                soup = BeautifulSoup(html, 'html.parser')
-                
-                app_links = soup.find_all('a', href=re.compile(r'modyolo\.com/[^/]+\.html'))
-                
-                for a in app_links:
-                    href = str(a.get('href', '') or '')
-                    if not href or href in seen_urls:
-                        continue
-                    if '/download/' in href or '/?s=' in href:
-                        continue
-                    seen_urls.add(href)
-                    
-                    title = str(a.get_text(strip=True) or '')
-                    if not title or len(title) < 2:
-                        continue
-                    
-                    parent = a.find_parent(['div', 'li', 'article'])
-                    img = a.find('img') or (parent.find('img') if parent else None)
-                    icon = ''
-                    if img:
-                        icon = str(img.get('src') or img.get('data-src') or '')
-                    
-                    version = ''
-                    size = ''
-                    mod_info = ''
-                    if parent:
-                        text = parent.get_text()
-                        version_match = re.search(r'(\d+\.\d+(?:\.\d+)*)', text)
-                        if version_match:
-                            version = version_match.group(1)
-                        size_match = re.search(r'(\d+(?:\.\d+)?\s*(?:MB|GB|M|G))', text, re.IGNORECASE)
-                        if size_match:
-                            size = size_match.group(1)
-                        mod_match = re.search(r'(Unlimited|Premium|Unlocked|Mega Menu|VIP|Pro|Full|Mod|Menu)[^\n]*', text, re.IGNORECASE)
-                        if mod_match:
-                            mod_info = mod_match.group(0).strip()
-                    
-                    clean_title = re.sub(r'\s*v?\d+\.\d+[^\s]*', '', title)
-                    clean_title = re.sub(r'\s*\+\s*\d+.*$', '', clean_title)
-                    clean_title = re.sub(r'\s+', ' ', clean_title).strip()
-                    
-                    all_apps.append({
-                        "title": clean_title,
-                        "url": href,
-                        "icon": icon,
-                        "source": "MODYOLO",
-                        "isMod": True,
-                        "version": version,
-                        "size": size,
-                        "modInfo": mod_info,
-                        "originalTitle": title,
-                        "title_lower": clean_title.lower()
-                    })
-                
+                all_apps = await run_parser(html_parsers.parse_modyolo_search, html)
                 print(f"[MODYOLO] Found {len(all_apps)} apps from search", file=sys.stderr)
         except Exception as search_error:
             print(f"[MODYOLO] Search error: {search_error}", file=sys.stderr)
         
-        query_words = query_lower.split()
-        matching = []
-        
-        def is_similar(word1, word2, threshold=0.7):
-            if word1 in word2 or word2 in word1:
-                return True
-            if len(word1) < 3 or len(word2) < 3:
-                return word1 == word2
-            common = sum(1 for c in word1 if c in word2)
-            ratio = common / max(len(word1), len(word2))
-            return ratio >= threshold
-        
-        for app in all_apps:
-            title_lower = app["title_lower"]
-            if all(word in title_lower for word in query_words):
-                matching.append(app)
-        
-        if not matching:
-            for app in all_apps:
-                title_lower = app["title_lower"]
-                if any(word in title_lower for word in query_words):
-                    matching.append(app)
-        
-        if not matching:
-            for app in all_apps:
-                title_lower = app["title_lower"]
-                title_words = title_lower.split()
-                for qword in query_words:
-                    for tword in title_words:
-                        if is_similar(qword, tword):
-                            matching.append(app)
-                            break
-                    if app in matching:
-                        break
+        matching = ranking.rank(query, all_apps, key=lambda app: app["title_lower"], limit=num_results)
         
         if not matching:
             print(f"[MODYOLO] No matching results found for '{query}'", file=sys.stderr)
             return []
         
         results = []
-        for app in matching[:num_results]:
+        for _, app in matching:
             if "title_lower" in app:
                 del app["title_lower"]
             app["title"] = app["title"] + " (مهكرة)"
@@ -361,67 +1088,34 @@ async def search_modyolo(query: str, num_results: int = 10) -> List[Dict[str, An
         traceback.print_exc()
         return []
 
+@single_flight("get_modyolo_download_link")
 async def get_modyolo_download_link(page_url: str) -> Optional[Dict[str, Any]]:
     """Extract download link from MODYOLO page"""
     try:
-        loop = asyncio.get_event_loop()
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Linux; Android 13; Pixel 7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Mobile Safari/537.36',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-            'Accept-Language': 'en-US,en;q=0.9',
-        }
-        
         print(f"[MODYOLO] Fetching app page: {page_url}", file=sys.stderr)
         
-        html = await loop.run_in_executor(
-            None,
-            lambda: requests.get(page_url, headers=headers, timeout=20).text
-        )
+        html = await scrape_get(page_url, SCRAPE_HEADERS)
         
         if not html:
             print(f"[MODYOLO] Failed to fetch page", file=sys.stderr)
             return None
         
-        soup = BeautifulSoup(html, 'html.parser')
-        
-        download_link = None
-        download_links = soup.find_all('a', href=re.compile(r'/download/[^/]+-\d+'))
-        
-        for link in download_links:
-            href = str(link.get('href', '') or '')
-            if href:
-                if not href.startswith('http'):
-                    href = 'https://modyolo.com' + href
-                download_link = href
-                break
+        download_link = await run_parser(html_parsers.parse_modyolo_app_page, html)
         
         if download_link:
             print(f"[MODYOLO] Found download page: {download_link}", file=sys.stderr)
             
-            dl_html = await loop.run_in_executor(
-                None,
-                lambda url=download_link: requests.get(url, headers=headers, timeout=20).text
-            )
+            dl_html = await scrape_get(download_link, SCRAPE_HEADERS)
             
             if dl_html:
-                dl_soup = BeautifulSoup(dl_html, 'html.parser')
-                
-                final_links = dl_soup.find_all('a', href=re.compile(r'/download/[^/]+-\d+/\d+'))
+                final_link = await run_parser(html_parsers.parse_modyolo_download_page, dl_html)
                 
-                if final_links:
-                    first_link = str(final_links[0].get('href', '') or '')
-                    if first_link and not first_link.startswith('http'):
-                        first_link = 'https://modyolo.com' + first_link
-                    
-                    size_text = str(final_links[0].get_text() or '')
-                    size_match = re.search(r'(\d+(?:\.\d+)?\s*(?:MB|GB|M|G))', size_text, re.IGNORECASE)
-                    size = size_match.group(1) if size_match else ''
-                    
+                if final_link:
                     return {
-                        "download_url": first_link,
+                        "download_url": final_link["download_url"],
                         "source": "MODYOLO",
                         "page_url": page_url,
-                        "size": size,
+                        "size": final_link["size"],
                         "note": "Click download link to get APK"
                     }
         
@@ -435,92 +1129,24 @@ async def get_modyolo_download_link(page_url: str) -> Optional[Dict[str, Any]]:
         return None
 
 MOD_SOURCES = [
-    {"name": "AN1", "search_url": "https://an1.com/?do=search&subaction=search&story={query}", "base_url": "https://an1.com"},
+    {"name": "AN1", "search_url": AN1_BASE + "/?do=search&subaction=search&story={query}", "base_url": AN1_BASE},
 ]
 
+@cached_search("AN1")
+@single_flight("search_an1", search_flight_key)
 async def search_an1(query: str, num_results: int = 10) -> List[Dict[str, Any]]:
     """Search AN1.com for modded APKs"""
     try:
         print(f"[AN1] Searching: {query}", file=sys.stderr)
-        search_url = f"https://an1.com/?do=search&subaction=search&story={quote_plus(query)}"
+        search_url = f"{AN1_BASE}/?do=search&subaction=search&story={quote_plus(query)}"
         
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Linux; Android 13; Pixel 7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Mobile Safari/537.36',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-            'Accept-Language': 'en-US,en;q=0.9',
-        }
-        
-        loop = asyncio.get_event_loop()
-        html = await loop.run_in_executor(
-            None,
-            lambda: requests.get(search_url, headers=headers, timeout=20).text
-        )
+        html = await scrape_get(search_url, SCRAPE_HEADERS)
         
         if not html:
             print(f"[AN1] Failed to fetch search page", file=sys.stderr)
             return []
         
-        soup = BeautifulSoup(html, 'html.parser')
-        results = []
-        seen_urls = set()
-        
-        game_links = soup.find_all('a', href=re.compile(r'an1\.com/\d+-[^/]+\.html'))
-        
-        for a in game_links:
-            if len(results) >= num_results:
-                break
-                
-            href = a.get('href', '')
-            if not href or href in seen_urls:
-                continue
-            seen_urls.add(href)
-            
-            title = a.get('title') or a.get_text(strip=True)
-            if not title or len(title) < 3:
-                continue
-            
-            id_match = re.search(r'/(\d+)-([^/]+)\.html', href)
-            if not id_match:
-                continue
-            
-            app_id = id_match.group(1)
-            
-            parent = a.find_parent(['div', 'li', 'article'])
-            img = a.find('img') or (parent.find('img') if parent else None)
-            icon = ''
-            if img:
-                icon = img.get('src') or img.get('data-src') or ''
-            
-            developer = ''
-            if parent:
-                dev_el = parent.find(text=re.compile(r'^[A-Z][\w\s]+$'))
-                if dev_el:
-                    developer = str(dev_el).strip()
-            
-            rating = 0.0
-            if parent:
-                rating_el = parent.find(class_=re.compile(r'rating|score'))
-                if rating_el:
-                    try:
-                        rating = float(re.search(r'[\d.]+', rating_el.get_text()).group())
-                    except:
-                        pass
-            
-            size_match = re.search(r'([\d.]+)\s*(?:Mb|MB|Gb|GB)', str(parent) if parent else '')
-            size = size_match.group(0) if size_match else ''
-            
-            results.append({
-                "title": title + " (مهكرة)",
-                "originalTitle": title,
-                "url": href if href.startswith('http') else f"https://an1.com{href}",
-                "appId": app_id,
-                "icon": icon,
-                "developer": developer,
-                "rating": rating,
-                "size": size,
-                "source": "AN1",
-                "isMod": True
-            })
+        results = await run_parser(html_parsers.parse_an1_search, html, num_results)
         
         print(f"[AN1] Found {len(results)} results", file=sys.stderr)
         return results
@@ -531,71 +1157,36 @@ async def search_an1(query: str, num_results: int = 10) -> List[Dict[str, Any]]:
         traceback.print_exc()
         return []
 
+@single_flight("get_an1_download_link")
 async def get_an1_download_link(page_url: str) -> Optional[Dict[str, Any]]:
     """Extract direct download link from AN1.com page"""
     try:
         print(f"[AN1] Getting download link from: {page_url}", file=sys.stderr)
         
-        id_match = re.search(r'/(\d+)-([^/]+)\.html', page_url)
+        id_match = html_parsers.AN1_APP_ID_RE.search(page_url)
         if not id_match:
             print(f"[AN1] Could not extract app ID from URL", file=sys.stderr)
             return None
         
         app_id = id_match.group(1)
-        download_page_url = f"https://an1.com/file_{app_id}-dw.html"
+        download_page_url = f"{AN1_BASE}/file_{app_id}-dw.html"
         
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Linux; Android 13; Pixel 7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Mobile Safari/537.36',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-            'Accept-Language': 'en-US,en;q=0.9',
-            'Referer': page_url,
-        }
-        
-        loop = asyncio.get_event_loop()
-        html = await loop.run_in_executor(
-            None,
-            lambda: requests.get(download_page_url, headers=headers, timeout=20).text
-        )
+        html = await scrape_get(download_page_url, {**SCRAPE_HEADERS, 'Referer': page_url})
         
         if not html:
             print(f"[AN1] Failed to fetch download page", file=sys.stderr)
             return None
         
-        all_links = re.findall(r'(https://files\.an1\.(?:co|net)/[^"\'<>\s]+\.apk)', html)
-        download_url = None
-        for link in all_links:
-            if 'an1store' not in link.lower():
-                download_url = link
-                break
+        link = await run_parser(html_parsers.parse_an1_download_page, html)
         
-        if download_url:
-            print(f"[AN1] Found download: {download_url}", file=sys.stderr)
-            
-            size_match = re.search(r'([\d.]+)\s*(?:Mb|MB|Gb|GB)', html)
-            size = size_match.group(0) if size_match else ''
-            
-            version_match = re.search(r'[\d.]+(?=\.apk|[_-]an1)', download_url)
-            version = version_match.group(0) if version_match else ''
-            
+        if link:
+            print(f"[AN1] Found download: {link['download_url']}", file=sys.stderr)
             return {
-                "download_url": download_url,
+                **link,
                 "source": "AN1",
-                "page_url": page_url,
-                "size": size,
-                "version": version
+                "page_url": page_url
             }
         
-        dl_match = re.search(r'href=["\']([^"\']*files\.an1\.co[^"\']+\.apk)["\']', html)
-        if dl_match:
-            download_url = dl_match.group(1)
-            if 'an1store' not in download_url.lower():
-                print(f"[AN1] Found download link: {download_url}", file=sys.stderr)
-                return {
-                    "download_url": download_url,
-                    "source": "AN1",
-                    "page_url": page_url
-                }
-        
         print(f"[AN1] No download link found", file=sys.stderr)
         return None
         
@@ -618,79 +1209,10 @@ async def search_mod_apk(query: str, num_results: int = 10) -> List[Dict[str, An
             
             if not html:
                 continue
-                
-            soup = BeautifulSoup(html, 'html.parser')
-            
-            if source["name"] == "APKMody":
-                items = soup.select('article.post, .search-result-item, .game-item')[:num_results]
-                for item in items:
-                    title_el = item.select_one('h2 a, h3 a, .title a, a.title')
-                    if title_el:
-                        title = title_el.get_text(strip=True)
-                        link = title_el.get('href', '')
-                        if link and not link.startswith('http'):
-                            link = source["base_url"] + link
-                        
-                        img_el = item.select_one('img')
-                        icon = img_el.get('src', '') if img_el else ''
-                        
-                        desc_el = item.select_one('.excerpt, .description, p')
-                        desc = desc_el.get_text(strip=True)[:100] if desc_el else ''
-                        
-                        results.append({
-                            "title": title,
-                            "source": source["name"],
-                            "url": link,
-                            "icon": icon,
-                            "description": desc,
-                            "isMod": True
-                        })
             
-            elif source["name"] == "MODDED1":
-                items = soup.select('article.post, .post-item, .game-card')[:num_results]
-                for item in items:
-                    title_el = item.select_one('h2 a, h3 a, .entry-title a, a.title')
-                    if title_el:
-                        title = title_el.get_text(strip=True)
-                        link = title_el.get('href', '')
-                        if link and not link.startswith('http'):
-                            link = source["base_url"] + link
-                        
-                        img_el = item.select_one('img')
-                        icon = img_el.get('data-src', '') or img_el.get('src', '') if img_el else ''
-                        
-                        if 'mod' in title.lower() or 'apk' in title.lower():
-                            results.append({
-                                "title": title,
-                                "source": source["name"],
-                                "url": link,
-                                "icon": icon,
-                                "description": "",
-                                "isMod": True
-                            })
-            
-            elif source["name"] == "HAPPYMOD":
-                items = soup.select('.pdt-app-box, .app-item, .search-item')[:num_results]
-                for item in items:
-                    title_el = item.select_one('h3, .app-name, .title, a')
-                    if title_el:
-                        title = title_el.get_text(strip=True)
-                        link_el = item.select_one('a[href]')
-                        link = link_el.get('href', '') if link_el else ''
-                        if link and not link.startswith('http'):
-                            link = source["base_url"] + link
-                        
-                        img_el = item.select_one('img')
-                        icon = img_el.get('data-src', '') or img_el.get('src', '') if img_el else ''
-                        
-                        results.append({
-                            "title": title,
-                            "source": source["name"],
-                            "url": link,
-                            "icon": icon,
-                            "description": "",
-                            "isMod": True
-                        })
+            results.extend(await run_parser(
+                html_parsers.parse_mod_source_search, html, source["name"], source["base_url"], num_results
+            ))
             
             if len(results) >= num_results:
                 break
@@ -708,49 +1230,25 @@ async def get_mod_download_link(page_url: str, source_name: str) -> Optional[Dic
         if not html:
             return None
         
-        soup = BeautifulSoup(html, 'html.parser')
-        
-        download_link = None
-        file_info = {}
-        
-        download_buttons = soup.select('a[href*="download"], a.download-btn, .download-link a, a[class*="download"]')
-        for btn in download_buttons:
-            href = btn.get('href', '')
-            if href and ('.apk' in href.lower() or 'download' in href.lower()):
-                download_link = href
-                break
-        
-        if not download_link:
-            download_containers = soup.select('.download-box, .download-area, #download')
-            for container in download_containers:
-                link = container.select_one('a[href]')
-                if link:
-                    download_link = link.get('href')
-                    break
-        
-        size_el = soup.select_one('.file-size, .size, [class*="size"]')
-        if size_el:
-            file_info['size'] = size_el.get_text(strip=True)
-        
-        version_el = soup.select_one('.version, [class*="version"]')
-        if version_el:
-            file_info['version'] = version_el.get_text(strip=True)
+        info = await run_parser(html_parsers.parse_mod_download_page, html)
         
         return {
-            "download_url": download_link,
+            "download_url": info["download_url"],
             "source": source_name,
             "page_url": page_url,
-            "file_info": file_info
+            "file_info": info["file_info"]
         }
         
     except Exception as e:
         print(f"[ModDownload] Error: {e}", file=sys.stderr)
         return None
 
+@cached_search("APKPure")
+@single_flight("search_apkpure", search_flight_key)
 async def search_apkpure(query: str, num_results: int = 10) -> List[Dict[str, Any]]:
     """Search APKPure for apps matching the query using mobile site"""
     try:
-        search_url = f"https://m.apkpure.com/search?q={quote_plus(query)}"
+        search_url = f"{APKPURE_SEARCH_BASE}/search?q={quote_plus(query)}"
         
         print(f"[APKPure Search] Searching (mobile): {query}", file=sys.stderr)
         
@@ -760,106 +1258,9 @@ async def search_apkpure(query: str, num_results: int = 10) -> List[Dict[str, An
             print(f"[APKPure Search] Failed to fetch search page", file=sys.stderr)
             return []
         
-        soup = BeautifulSoup(html_content, 'lxml')
-        apps = []
-        seen_ids = set()
-        
-        def extract_app_id(href):
-            if href.startswith('https://apkpure.com/'):
-                href = href.replace('https://apkpure.com', '')
-            elif href.startswith('https://m.apkpure.com/'):
-                href = href.replace('https://m.apkpure.com', '')
-            if not href.startswith('/'):
-                return None
-            parts = [p for p in href.strip('/').split('/') if p]
-            if len(parts) >= 2:
-                potential_id = parts[-1]
-                if 'download' in potential_id.lower():
-                    return None
-                if '.' in potential_id and potential_id.count('.') >= 1:
-                    return potential_id
-            return None
-        
-        first_app = soup.find('div', class_='first')
-        if first_app:
-            link = first_app.find('a', href=True)
-            if link:
-                href = link.get('href', '')
-                app_id = extract_app_id(href)
-                if app_id and app_id not in seen_ids:
-                    seen_ids.add(app_id)
-                    p1 = first_app.find('p', class_='p1')
-                    p2 = first_app.find('p', class_='p2')
-                    app_name = p1.get_text(strip=True) if p1 else None
-                    developer = p2.get_text(strip=True) if p2 else ''
-                    
-                    if not app_name:
-                        parts = [p for p in href.strip('/').split('/') if p]
-                        app_slug = parts[0] if parts else ''
-                        app_name = app_slug.replace('-', ' ').title()
-                    
-                    img = first_app.find('img')
-                    icon = img.get('src') or img.get('data-src') if img else None
-                    
-                    apps.append({
-                        'title': app_name,
-                        'appId': app_id,
-                        'developer': developer,
-                        'score': 0.0,
-                        'icon': icon
-                    })
-                    print(f"[APKPure Search] Found (featured): {app_name} ({app_id})", file=sys.stderr)
-        
-        search_container = soup.find('ul', class_='search-res')
-        
-        if search_container:
-            for li in search_container.find_all('li'):
-                if len(apps) >= num_results:
-                    break
-                
-                link = li.find('a', href=True)
-                if not link:
-                    continue
-                
-                href = link.get('href', '')
-                app_id = extract_app_id(href)
-                
-                if not app_id or app_id in seen_ids:
-                    continue
-                seen_ids.add(app_id)
-                
-                p1 = li.find('p', class_='p1')
-                p2 = li.find('p', class_='p2')
-                
-                app_name = p1.get_text(strip=True) if p1 else None
-                developer = p2.get_text(strip=True) if p2 else ''
-                
-                if not app_name:
-                    parts = [p for p in href.strip('/').split('/') if p]
-                    app_slug = parts[0] if parts else ''
-                    app_name = app_slug.replace('-', ' ').title()
-                
-                img = li.find('img')
-                icon = None
-                if img:
-                    icon = img.get('src') or img.get('data-src') or img.get('data-original')
-                
-                score = 0.0
-                score_elem = li.find(class_='star')
-                if score_elem:
-                    try:
-                        score = float(score_elem.get_text(strip=True))
-                    except:
-                        pass
-                
-                apps.append({
-                    'title': app_name,
-                    'appId': app_id,
-                    'developer': developer,
-                    'score': score,
-                    'icon': icon
-                })
-                print(f"[APKPure Search] Found: {app_name} ({app_id})", file=sys.stderr)
+        apps = await run_parser(html_parsers.parse_apkpure_search, html_content, num_results)
+        for app in apps:
+            print(f"[APKPure Search] Found: {app['title']} ({app['appId']})", file=sys.stderr)
         
         print(f"[APKPure Search] Total found: {len(apps)} apps", file=sys.stderr)
         return apps[:num_results]
@@ -870,20 +1271,107 @@ async def search_apkpure(query: str, num_results: int = 10) -> List[Dict[str, An
         traceback.print_exc()
         return []
 
-async def extract_content_with_trafilatura(url: str) -> Optional[str]:
-    """Extract main content from a URL using trafilatura"""
+EXTRACT_CACHE_TTL = int(os.environ.get("EXTRACT_CACHE_TTL", "3600"))
+EXTRACT_CACHE_MAX_ENTRIES = int(os.environ.get("EXTRACT_CACHE_MAX_ENTRIES", "500"))
+EXTRACT_MAX_CHARS = int(os.environ.get("EXTRACT_MAX_CHARS", "100000"))
+EXTRACT_REVALIDATE_TIMEOUT = 10
+
+# url -> extracted content plus the validators it was fetched with
+extract_cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+extract_stats = {
+    "hits": 0,
+    "revalidated": 0,
+    "misses": 0,
+    "stale_served": 0,
+    "failures": 0
+}
+
+def _store_extracted(url: str, content: str, validators: Dict[str, str]):
+    now = time.time()
+    extract_cache[url] = {
+        "content": content,
+        "etag": validators.get("ETag"),
+        "last_modified": validators.get("Last-Modified"),
+        "fetched_at": now,
+        "validated_at": now
+    }
+    extract_cache.move_to_end(url)
+    while len(extract_cache) > EXTRACT_CACHE_MAX_ENTRIES:
+        extract_cache.popitem(last=False)
+
+async def _revalidate_extracted(url: str, entry: Dict[str, Any]) -> Tuple[Optional[bool], Optional[str], Dict[str, str]]:
+    """Conditional GET for a cached page: (unchanged, new html, new validators); unchanged is None on failure"""
+    headers = dict(MOBILE_HEADERS)
+    if entry["etag"]:
+        headers["If-None-Match"] = entry["etag"]
+    if entry["last_modified"]:
+        headers["If-Modified-Since"] = entry["last_modified"]
     try:
-        html = await fetch_with_protection(url, use_cloudscraper=True)
+        client = await get_httpx_client()
+        with track_stage("fetch", "revalidate") as stage:
+            response = await client.get(url, headers=headers, timeout=EXTRACT_REVALIDATE_TIMEOUT)
+            stage["outcome"] = str(response.status_code)
+    except Exception as e:
+        print(f"[Extract] Revalidation failed for {url}: {e}", file=sys.stderr)
+        return None, None, {}
+    if response.status_code == 304:
+        return True, None, {}
+    if response.status_code == 200:
+        validators = {name: response.headers[name] for name in ("ETag", "Last-Modified") if response.headers.get(name)}
+        return False, response.text, validators
+    return None, None, {}
+
+@single_flight("extract_content_with_trafilatura")
+async def extract_content_with_trafilatura(url: str) -> Optional[Dict[str, Any]]:
+    """Main content of a URL via trafilatura, cached per URL.
+    
+    Entries younger than EXTRACT_CACHE_TTL are served as-is. Older ones are
+    revalidated with If-None-Match/If-Modified-Since when the page sent
+    validators, so an unchanged page costs a 304 and no extraction. If the
+    page cannot be fetched at all, the last extracted content is served.
+    Extraction runs in the parse worker pool. Returns {"content", "cache"}.
+    """
+    entry = extract_cache.get(url)
+    if entry:
+        extract_cache.move_to_end(url)
+        if time.time() - entry["validated_at"] < EXTRACT_CACHE_TTL:
+            extract_stats["hits"] += 1
+            return {"content": entry["content"], "cache": "hit"}
+    
+    html, validators = None, {}
+    try:
+        if entry and (entry["etag"] or entry["last_modified"]):
+            unchanged, html, validators = await _revalidate_extracted(url, entry)
+            if unchanged:
+                extract_stats["revalidated"] += 1
+                entry["validated_at"] = time.time()
+                return {"content": entry["content"], "cache": "revalidated"}
+        if html is None:
+            captured: Dict[str, str] = {}
+            token = fetch_validators.set(captured)
+            try:
+                html = await fetch_with_protection(url, use_cloudscraper=True)
+            finally:
+                fetch_validators.reset(token)
+            validators = captured
         if html:
-            extracted = trafilatura.extract(html)
-            return extracted
+            with track_stage("extract", "trafilatura"):
+                extracted = await run_parser(html_parsers.extract_main_text, html)
+            if extracted:
+                extract_stats["misses"] += 1
+                _store_extracted(url, extracted, validators)
+                return {"content": extracted, "cache": "miss"}
     except Exception as e:
         print(f"[Trafilatura] Error: {e}", file=sys.stderr)
+    
+    if entry:
+        extract_stats["stale_served"] += 1
+        return {"content": entry["content"], "cache": "stale"}
+    extract_stats["failures"] += 1
     return None
 
-file_cache: Dict[str, Dict[str, Any]] = {}
-download_locks: Dict[str, asyncio.Lock] = {}
-pending_deletions: Dict[str, asyncio.Task] = {}
+# With several workers each package lock is also a file lock, so only one process downloads it
+download_locks = KeyedLockTable(LOCKS_DIR if MULTI_WORKER else None)
 
 stats = {
     "total_requests": 0,
@@ -892,105 +1380,1669 @@ stats = {
     "cache_hits": 0
 }
 
-def get_download_lock(package_name: str) -> asyncio.Lock:
-    if package_name not in download_locks:
-        download_locks[package_name] = asyncio.Lock()
-    return download_locks[package_name]
+def retry_later(detail: str, retry_after: float) -> HTTPException:
+    return HTTPException(status_code=503, detail=detail, headers={"Retry-After": str(max(1, int(retry_after + 0.999)))})
+
+def get_download_lock(package_name: str):
+    """Async context manager serialising downloads of one package"""
+    return download_locks(package_name)
+
+ARTIFACT_CACHE_MAX_BYTES = int(float(os.environ.get("ARTIFACT_CACHE_MAX_GB", "5")) * 1024 ** 3)
+ARTIFACT_CACHE_TTL = int(os.environ.get("ARTIFACT_CACHE_TTL", str(24 * 3600)))
+ARTIFACT_CACHE_POLICY = os.environ.get("ARTIFACT_CACHE_POLICY", "lru").lower()
+ARTIFACT_CACHE_PINNED = [p.strip() for p in os.environ.get("ARTIFACT_CACHE_PINNED", "ru.zdevs.zarchiver").split(',') if p.strip()]
+ARTIFACT_INDEX_PATH = os.path.join(DOWNLOADS_DIR, '.cache_index.json')
+STALE_PARTIAL_MAX_AGE = 600
+
+artifact_cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+artifact_cache_stats = {
+    "hits": 0,
+    "misses": 0,
+    "evictions": 0,
+    "expirations": 0
+}
+
+ARTIFACT_INDEX_LOCK = os.path.join(DOWNLOADS_DIR, '.cache_index.lock')
+# Index rewrites, their file lock and evictions run here, one at a time and off the event loop
+artifact_index_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="artifact-index")
+
+def read_artifact_index() -> List[Dict[str, Any]]:
+    with open(ARTIFACT_INDEX_PATH) as f:
+        return json.load(f)
+
+def artifact_intact(entry: Dict[str, Any]) -> bool:
+    try:
+        return os.path.getsize(entry["path"]) == entry.get("size")
+    except (OSError, KeyError):
+        return False
+
+def shared_index_entries() -> List[Dict[str, Any]]:
+    """Entries other workers wrote to the index whose files are still intact"""
+    try:
+        entries = read_artifact_index()
+    except (OSError, ValueError):
+        return []
+    return [entry for entry in entries if artifact_intact(entry)]
+
+def select_evictions(entries: List[Dict[str, Any]], needed_bytes: int = 0,
+                     keep: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Unpinned entries (LRU or LFU) to drop so the rest fit the cache's byte budget"""
+    budget = ARTIFACT_CACHE_MAX_BYTES - needed_bytes
+    used = sum(entry["size"] for entry in entries)
+    if used <= budget:
+        return []
+    
+    candidates = [entry for entry in entries if not entry["pinned"] and entry["package"] != keep]
+    if ARTIFACT_CACHE_POLICY == "lfu":
+        candidates.sort(key=lambda e: (e["hits"], e["last_access"]))
+    else:
+        candidates.sort(key=lambda e: e["last_access"])
+    
+    victims = []
+    for entry in candidates:
+        if used <= budget:
+            break
+        used -= entry["size"]
+        victims.append(entry)
+    
+    if used > budget:
+        print(f"[ArtifactCache] Over budget by {(used - budget)/(1024*1024):.1f} MB (pinned artifacts)", file=sys.stderr)
+    return victims
+
+def write_artifact_index(entries: List[Dict[str, Any]],
+                         keep: Optional[str] = None) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Merge this worker's entries into the index on disk, evict down to budget and rewrite it; blocking.
+    
+    Every worker's entries count against ARTIFACT_CACHE_MAX_BYTES, so N
+    workers share one budget. Returns (evicted, stale): entries whose files
+    were deleted for space, and entries of this worker whose files are gone
+    or were replaced. Multi-worker callers hold ARTIFACT_INDEX_LOCK.
+    """
+    merged: Dict[str, Dict[str, Any]] = {}
+    if MULTI_WORKER:
+        merged = {entry["package"]: entry for entry in shared_index_entries()}
+    stale = []
+    for entry in entries:
+        if artifact_intact(entry):
+            merged[entry["package"]] = entry
+        else:
+            stale.append(entry)
+    
+    evicted = select_evictions(list(merged.values()), keep=keep)
+    for entry in evicted:
+        del merged[entry["package"]]
+        try:
+            os.remove(entry["path"])
+            print(f"[Cleanup] Evicted: {os.path.basename(entry['path'])}", file=sys.stderr)
+        except OSError as e:
+            print(f"[Cleanup Error] {entry['path']}: {e}", file=sys.stderr)
+    
+    tmp_path = f"{ARTIFACT_INDEX_PATH}.{os.getpid()}.part"
+    with open(tmp_path, 'w') as f:
+        json.dump(list(merged.values()), f)
+    os.replace(tmp_path, ARTIFACT_INDEX_PATH)
+    return evicted, stale
+
+def locked_write_artifact_index(entries: List[Dict[str, Any]], keep: Optional[str] = None):
+    if MULTI_WORKER:
+        with coordination.locked_file(ARTIFACT_INDEX_LOCK):
+            return write_artifact_index(entries, keep)
+    return write_artifact_index(entries, keep)
+
+def _apply_artifact_index_write(future: "asyncio.Future"):
+    if future.cancelled():
+        return
+    try:
+        evicted, stale = future.result()
+    except Exception as e:
+        print(f"[ArtifactCache] Failed to save index: {e}", file=sys.stderr)
+        return
+    for entry in evicted + stale:
+        current = artifact_cache.get(entry["package"])
+        # Leave it alone if the package was stored again after the snapshot
+        if current and current["path"] == entry["path"] and current["created_at"] == entry["created_at"]:
+            del artifact_cache[entry["package"]]
+    artifact_cache_stats["evictions"] += len(evicted)
+
+def save_artifact_index(keep: Optional[str] = None) -> "asyncio.Future":
+    """Queue a merge, eviction and rewrite of the shared index; await the result to wait for it.
+    
+    ``keep`` is never evicted by this write (the artifact just stored).
+    """
+    entries = [dict(entry) for entry in artifact_cache.values()]
+    future = asyncio.get_event_loop().run_in_executor(
+        artifact_index_executor, locked_write_artifact_index, entries, keep
+    )
+    future.add_done_callback(_apply_artifact_index_write)
+    return future
+
+def adopt_shared_artifact(package_name: str) -> Optional[Dict[str, Any]]:
+    """On a local miss, pick up an artifact another worker downloaded and indexed"""
+    if not MULTI_WORKER:
+        return None
+    for entry in shared_index_entries():
+        if entry["package"] == package_name and not artifact_expired(entry):
+            artifact_cache[package_name] = entry
+            return entry
+    return None
+
+def load_artifact_index():
+    """Rebuild the artifact index from disk, adopting files the index does not know about"""
+    artifact_cache.clear()
+    entries = []
+    try:
+        entries = read_artifact_index()
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"[ArtifactCache] Index unreadable, rebuilding: {e}", file=sys.stderr)
+    
+    for entry in sorted(entries, key=lambda e: e.get("last_access", 0)):
+        path = entry.get("path", "")
+        if os.path.exists(path) and os.path.getsize(path) == entry.get("size"):
+            artifact_cache[entry["package"]] = entry
+    
+    indexed = {entry["path"] for entry in artifact_cache.values()}
+    for filename in os.listdir(DOWNLOADS_DIR):
+        package_name, ext = os.path.splitext(filename)
+        file_path = os.path.join(DOWNLOADS_DIR, filename)
+        if ext in ('.xapk', '.apk', '.apks') and file_path not in indexed and package_name not in artifact_cache:
+            if os.path.getsize(file_path) > 100000:
+                cache_store_artifact(package_name, file_path, save=False)
+    
+    for package_name in ARTIFACT_CACHE_PINNED:
+        if package_name in artifact_cache:
+            artifact_cache[package_name]["pinned"] = True
+    
+    save_artifact_index()
+    print(f"[ArtifactCache] Loaded {len(artifact_cache)} artifacts ({artifact_cache_bytes()/(1024*1024):.1f} MB)", file=sys.stderr)
+
+def artifact_cache_bytes() -> int:
+    return sum(entry["size"] for entry in artifact_cache.values())
+
+def remove_artifact(package_name: str, save: bool = True):
+    entry = artifact_cache.pop(package_name, None)
+    if not entry:
+        return
+    try:
+        if os.path.exists(entry["path"]):
+            os.remove(entry["path"])
+            print(f"[Cleanup] Deleted: {os.path.basename(entry['path'])}", file=sys.stderr)
+    except Exception as e:
+        print(f"[Cleanup Error] {entry['path']}: {e}", file=sys.stderr)
+    if save:
+        save_artifact_index()
+
+def artifact_expired(entry: Dict[str, Any], now: Optional[float] = None) -> bool:
+    return (now or time.time()) - entry["created_at"] > entry["ttl"]
+
+def cache_lookup_artifact(package_name: str) -> Optional[str]:
+    """Return the cached artifact path for a package, counting the hit or miss"""
+    entry = artifact_cache.get(package_name) or adopt_shared_artifact(package_name)
+    if entry and artifact_expired(entry):
+        remove_artifact(package_name)
+        artifact_cache_stats["expirations"] += 1
+        entry = None
+    if entry and not os.path.exists(entry["path"]):
+        artifact_cache.pop(package_name, None)
+        entry = None
+    
+    if not entry:
+        artifact_cache_stats["misses"] += 1
+        return None
+    
+    entry["hits"] += 1
+    entry["last_access"] = time.time()
+    artifact_cache.move_to_end(package_name)
+    artifact_cache_stats["hits"] += 1
+    return entry["path"]
+
+def cache_store_artifact(package_name: str, file_path: str, ttl: Optional[int] = None, save: bool = True,
+                         metadata: Optional[Dict[str, Any]] = None):
+    """Add a downloaded artifact to the cache; the index write evicts others to stay within budget.
+    
+    ``metadata`` comes from index_artifact(); its sha256 becomes the ETag.
+    """
+    previous = artifact_cache.get(package_name)
+    if previous and previous["path"] != file_path:
+        remove_artifact(package_name, save=False)
+    
+    st = os.stat(file_path)
+    now = time.time()
+    metadata = dict(metadata) if metadata else {}
+    sha256 = metadata.pop("sha256", None)
+    artifact_cache[package_name] = {
+        "package": package_name,
+        "path": file_path,
+        "size": st.st_size,
+        "mtime_ns": st.st_mtime_ns,
+        "created_at": now,
+        "last_access": now,
+        "hits": previous["hits"] if previous else 0,
+        "ttl": ttl or (previous["ttl"] if previous else ARTIFACT_CACHE_TTL),
+        "pinned": package_name in ARTIFACT_CACHE_PINNED or bool(previous and previous["pinned"]),
+        "sha256": sha256,
+        "meta": metadata or None
+    }
+    artifact_cache.move_to_end(package_name)
+    if save:
+        save_artifact_index(keep=package_name)
+
+def sweep_stale_files(expired: List[str], keep: set, now: float):
+    """Delete expired artifacts, abandoned staging dirs and old partial downloads; blocking.
+    
+    Files of a package that is being downloaded again are left for the next sweep.
+    """
+    for file_path in expired:
+        if download_locks.locked(os.path.splitext(os.path.basename(file_path))[0]):
+            continue
+        try:
+            os.remove(file_path)
+            print(f"[Cleanup] Deleted: {os.path.basename(file_path)}", file=sys.stderr)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"[Cleanup Error] {file_path}: {e}", file=sys.stderr)
+    
+    for staging_root in (RACE_STAGING_DIR, REFRESH_STAGING_DIR):
+        if not os.path.isdir(staging_root):
+            continue
+        for name in os.listdir(staging_root):
+            staging_dir = os.path.join(staging_root, name)
+            if now - os.path.getmtime(staging_dir) > APKEEP_TIMEOUT + STALE_PARTIAL_MAX_AGE:
+                shutil.rmtree(staging_dir, ignore_errors=True)
+    
+    for filename in os.listdir(DOWNLOADS_DIR):
+        file_path = os.path.join(DOWNLOADS_DIR, filename)
+        if filename.startswith(STATE_FILE_PREFIXES) or file_path in keep:
+            continue
+        if not os.path.isfile(file_path) or now - os.path.getmtime(file_path) < STALE_PARTIAL_MAX_AGE:
+            continue
+        package_name = os.path.splitext(filename)[0]
+        if download_locks.locked(package_name):
+            continue
+        try:
+            os.remove(file_path)
+            print(f"[Cleanup] Removed stale file: {filename}", file=sys.stderr)
+        except Exception as e:
+            print(f"[Cleanup] Failed to remove {filename}: {e}", file=sys.stderr)
+
+async def sweep_artifact_cache():
+    """Expire artifacts past their TTL and remove abandoned partial downloads; file work runs in a thread"""
+    now = time.time()
+    expired = []
+    for package_name, entry in list(artifact_cache.items()):
+        if artifact_expired(entry, now):
+            expired.append(artifact_cache.pop(package_name)["path"])
+            artifact_cache_stats["expirations"] += 1
+    index_saved = save_artifact_index()
+    
+    keep = {entry["path"] for entry in artifact_cache.values()}
+    keep.update(transfer.get("path") for transfer in aria2_transfers.values())
+    await asyncio.get_event_loop().run_in_executor(None, sweep_stale_files, expired, keep, now)
+    await index_saved
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+def hash_file(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def describe_artifact_file(file_path: str, metadata: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Parsed APK/XAPK metadata plus the content hash; blocking"""
+    metadata = dict(metadata) if metadata else apk_metadata.read_artifact_metadata(file_path)
+    metadata["sha256"] = hash_file(file_path)
+    return metadata
+
+async def index_artifact(file_path: str, metadata: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    """Build the metadata index record for an artifact, reusing already parsed metadata"""
+    with track_stage("index", "artifact") as stage:
+        try:
+            return await asyncio.get_event_loop().run_in_executor(None, describe_artifact_file, file_path, metadata)
+        except OSError as e:
+            stage["outcome"] = "failure"
+            print(f"[ArtifactCache] Failed to index {os.path.basename(file_path)}: {e}", file=sys.stderr)
+            return None
+
+async def index_unindexed_artifacts():
+    """Fill in hash and metadata for artifacts adopted from disk or indexed by an older version"""
+    for package_name, entry in list(artifact_cache.items()):
+        if (entry.get("sha256") and entry.get("meta")) or not os.path.exists(entry["path"]):
+            continue
+        metadata = await index_artifact(entry["path"])
+        if metadata and artifact_cache.get(package_name) is entry:
+            entry["sha256"] = metadata.pop("sha256")
+            entry["meta"] = metadata
+            entry["mtime_ns"] = os.stat(entry["path"]).st_mtime_ns
+    save_artifact_index()
+
+def indexed_artifact(package_name: str) -> Optional[Dict[str, Any]]:
+    """Index entry of a live cached artifact, answered from memory without touching the file"""
+    entry = artifact_cache.get(package_name) or adopt_shared_artifact(package_name)
+    if entry and not artifact_expired(entry):
+        return entry
+    return None
+
+worker_board: Optional[coordination.WorkerStatsBoard] = None
+worker_totals: Dict[str, Dict[str, float]] = {}
+
+def stats_snapshot() -> Dict[str, Dict[str, Any]]:
+    """This worker's event counters, grouped as in apkapi_events_total"""
+    return {
+        "server": stats,
+        "artifact_cache": artifact_cache_stats,
+        "search_cache": search_cache_stats,
+        "single_flight": single_flight_stats,
+        "apkeep": {name: value for name, value in apkeep_stats.items() if name != "wait_seconds_total"},
+        "jobs": job_stats,
+        "prefetch": prefetch_stats,
+        "race": race_stats,
+        "batch": batch_stats,
+        "extract": extract_stats,
+        "app_index": {**app_index_stats, **(app_index.stats if app_index is not None else {})},
+        "not_found_cache": not_found_cache.stats,
+    }
+
+def collect_worker_stats() -> Dict[int, Dict[str, Dict[str, Any]]]:
+    """Latest snapshot from every live worker, this one included"""
+    global worker_totals
+    worker_board.publish(stats_snapshot())
+    snapshots = worker_board.collect(WORKER_STATS_INTERVAL * 3)
+    worker_totals = coordination.WorkerStatsBoard.aggregate(list(snapshots.values()))
+    return snapshots
+
+async def publish_worker_stats():
+    while True:
+        await asyncio.sleep(WORKER_STATS_INTERVAL)
+        try:
+            collect_worker_stats()
+        except Exception as e:
+            print(f"[Workers] Stats publish failed: {e}", file=sys.stderr)
+
+async def periodic_cleanup():
+    while True:
+        await asyncio.sleep(60)
+        try:
+            await sweep_artifact_cache()
+            prune_download_jobs()
+            not_found_cache.purge()
+            if app_index is not None:
+                await app_index_call(app_index.prune)
+        except Exception as e:
+            print(f"[Cleanup Error] {e}", file=sys.stderr)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global httpx_client, app_index
+    print("[Server] Starting with enhanced protection (cloudscraper, curl-cffi, httpx)...", file=sys.stderr)
+    os.makedirs(LOCKS_DIR if MULTI_WORKER else DOWNLOADS_DIR, exist_ok=True)
+    if NOT_FOUND_CACHE_DB:
+        not_found_cache.open(NOT_FOUND_CACHE_DB, shared=MULTI_WORKER)
+    if APP_INDEX_ENABLED:
+        app_index = await asyncio.get_event_loop().run_in_executor(
+            app_index_executor, AppIndex, APP_INDEX_DB, APP_INDEX_MAX_ENTRIES
+        )
+    httpx_client = create_httpx_client()
+    get_scraper()
+    load_artifact_index()
+    load_demand_index()
+    await start_parse_pool()
+    await start_aria2_daemon()
+    asyncio.create_task(periodic_cleanup())
+    asyncio.create_task(index_unindexed_artifacts())
+    prefetch_leader = None
+    if MULTI_WORKER:
+        global worker_board
+        worker_board = coordination.WorkerStatsBoard(COORDINATOR_DB)
+        collect_worker_stats()
+        asyncio.create_task(publish_worker_stats())
+        # One prefetcher per deployment; the lock is released when the leader exits
+        prefetch_leader = coordination.claim_leadership(os.path.join(DOWNLOADS_DIR, '.prefetch.lock'))
+        print(f"[Workers] Worker {os.getpid()} of {API_WORKERS} started"
+              f"{' (prefetch leader)' if prefetch_leader is not None else ''}", file=sys.stderr)
+    if PREFETCH_ENABLED and (not MULTI_WORKER or prefetch_leader is not None):
+        asyncio.create_task(prefetch_loop())
+    yield
+    save_demand_index()
+    not_found_cache.close()
+    if app_index is not None:
+        await app_index_call(app_index.close)
+    if worker_board:
+        worker_board.retire()
+    await stop_aria2_daemon()
+    stop_parse_pool()
+    if httpx_client:
+        await httpx_client.aclose()
+    print("[Server] Shutting down...", file=sys.stderr)
+
+app = FastAPI(title="APK Download API (Enhanced)", lifespan=lifespan)
+
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+APKEEP_MAX_CONCURRENT = int(os.environ.get("APKEEP_MAX_CONCURRENT", "2"))
+APKEEP_QUEUE_MAX = int(os.environ.get("APKEEP_QUEUE_MAX", "32"))
+APKEEP_TIMEOUT = int(os.environ.get("APKEEP_TIMEOUT", "300"))
+APKEEP_POLL_INTERVAL = 0.5
+APKEEP_PRIORITY_INTERACTIVE = 0
+APKEEP_PRIORITY_BACKGROUND = 10
+APKEEP_EXTENSIONS = ('.xapk', '.apk', '.apks')
+APKEEP_PERCENT_RE = re.compile(r'(\d{1,3}(?:\.\d+)?)\s*%')
+
+class ApkeepQueueFull(Exception):
+    pass
+
+# Waiters are (priority, sequence, future); lower priority values run first, FIFO within a priority
+apkeep_queue: List[Tuple[int, int, asyncio.Future]] = []
+apkeep_sequence = itertools.count()
+apkeep_active = 0
+apkeep_transfers: Dict[str, Dict[str, Any]] = {}
+apkeep_stats = {
+    "started": 0,
+    "succeeded": 0,
+    "not_found": 0,
+    "failed": 0,
+    "timeouts": 0,
+    "cancelled": 0,
+    "rejected": 0,
+    "wait_seconds_total": 0.0
+}
+
+async def acquire_apkeep_slot(priority: int = APKEEP_PRIORITY_INTERACTIVE):
+    """Wait for one of APKEEP_MAX_CONCURRENT slots; raises ApkeepQueueFull when the queue is full"""
+    global apkeep_active
+    if apkeep_active < APKEEP_MAX_CONCURRENT and not apkeep_queue:
+        apkeep_active += 1
+        return
+    if len(apkeep_queue) >= APKEEP_QUEUE_MAX:
+        apkeep_stats["rejected"] += 1
+        raise ApkeepQueueFull(f"apkeep queue is full ({len(apkeep_queue)} waiting)")
+    
+    item = (priority, next(apkeep_sequence), asyncio.get_event_loop().create_future())
+    heapq.heappush(apkeep_queue, item)
+    try:
+        await item[2]
+    except asyncio.CancelledError:
+        if item[2].done() and not item[2].cancelled():
+            release_apkeep_slot()
+        elif item in apkeep_queue:
+            apkeep_queue.remove(item)
+            heapq.heapify(apkeep_queue)
+        raise
+
+def release_apkeep_slot():
+    """Hand the slot straight to the next waiter, or free it"""
+    global apkeep_active
+    while apkeep_queue:
+        _, _, waiter = heapq.heappop(apkeep_queue)
+        if not waiter.done():
+            waiter.set_result(None)
+            return
+    apkeep_active -= 1
+
+def apkeep_output_candidates(package_name: str, output_dir: str) -> List[str]:
+    return [os.path.join(output_dir, f"{package_name}{ext}") for ext in APKEEP_EXTENSIONS]
+
+def _apkeep_snapshot(paths: List[str]) -> Dict[str, int]:
+    return {path: os.stat(path).st_mtime_ns for path in paths if os.path.exists(path)}
+
+def _apkeep_written_file(paths: List[str], before: Dict[str, int]) -> Optional[str]:
+    """The non-empty .apk/.xapk/.apks this run created or rewrote, if any"""
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            continue
+        if st.st_size > 0 and before.get(path) != st.st_mtime_ns:
+            return path
+    return None
+
+def _discard_apkeep_output(package_name: str, before: Dict[str, int], paths: List[str]):
+    """Remove files apkeep created or overwrote during an unsuccessful run"""
+    for path in paths:
+        if not os.path.exists(path) or before.get(path) == os.stat(path).st_mtime_ns:
+            continue
+        entry = artifact_cache.get(package_name)
+        if entry and entry["path"] == path:
+            remove_artifact(package_name)
+        else:
+            remove_partial_download(path)
+
+def _parse_apkeep_output(line: str, transfer: Dict[str, Any]):
+    lowered = line.lower()
+    transfer["last_line"] = line[-200:]
+    if lowered.startswith("downloading"):
+        transfer["status"] = "downloading"
+    elif "downloaded successfully" in lowered:
+        transfer["status"] = "complete"
+    elif "could not get download url" in lowered or "skipping" in lowered:
+        transfer["status"] = "not_found"
+    match = APKEEP_PERCENT_RE.search(line)
+    if match:
+        transfer["percent"] = min(100.0, float(match.group(1)))
+
+async def download_with_apkeep(package_name: str, output_dir: str, transfer: Dict[str, Any]) -> Optional[str]:
+    """Run apkeep as an asyncio subprocess, parsing its output and polling the file size.
+    
+    Cancelling the caller kills apkeep and removes what it wrote.
+    """
+    paths = apkeep_output_candidates(package_name, output_dir)
+    before = _apkeep_snapshot(paths)
+    start_time = time.time()
+    print(f"[apkeep] Downloading {package_name}...", file=sys.stderr)
+    
+    proc = await asyncio.create_subprocess_exec(
+        APKEEP_PATH, "-a", package_name, output_dir,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT
+    )
+    transfer["pid"] = proc.pid
+    
+    async def read_output():
+        pending = b''
+        while chunk := await proc.stdout.read(4096):
+            *lines, pending = re.split(rb'[\r\n]', pending + chunk)
+            for line in lines:
+                if line.strip():
+                    _parse_apkeep_output(line.decode(errors='replace').strip(), transfer)
+        if pending.strip():
+            _parse_apkeep_output(pending.decode(errors='replace').strip(), transfer)
+        await proc.wait()
+    
+    reader = asyncio.ensure_future(read_output())
+    deadline = start_time + APKEEP_TIMEOUT
+    try:
+        while True:
+            done, _ = await asyncio.wait({reader}, timeout=APKEEP_POLL_INTERVAL)
+            if done:
+                reader.result()
+                break
+            for path in paths:
+                if path not in before and os.path.exists(path):
+                    transfer["path"] = path
+                    transfer["completed"] = os.path.getsize(path)
+            if time.time() > deadline:
+                proc.kill()
+                await reader
+                print(f"[apkeep] Timeout for {package_name}", file=sys.stderr)
+                transfer["status"] = "timeout"
+                apkeep_stats["timeouts"] += 1
+                _discard_apkeep_output(package_name, before, paths)
+                return None
+    except asyncio.CancelledError:
+        if proc.returncode is None:
+            proc.kill()
+        await asyncio.shield(proc.wait())
+        reader.cancel()
+        transfer["status"] = "cancelled"
+        apkeep_stats["cancelled"] += 1
+        _discard_apkeep_output(package_name, before, paths)
+        raise
+    
+    elapsed = time.time() - start_time
+    if transfer["status"] == "complete":
+        path = _apkeep_written_file(paths, before)
+        if path:
+            transfer["path"] = path
+            transfer["completed"] = transfer["total"] = os.path.getsize(path)
+            apkeep_stats["succeeded"] += 1
+            print(f"[apkeep] Downloaded {package_name}: {transfer['total']/(1024*1024):.1f} MB in {elapsed:.1f}s", file=sys.stderr)
+            return path
+        print(f"[apkeep] Reported success for {package_name} but wrote no file to {output_dir}", file=sys.stderr)
+        transfer["status"] = "error"
+    
+    if transfer["status"] == "not_found":
+        apkeep_stats["not_found"] += 1
+        print(f"[apkeep] App not found: {package_name}", file=sys.stderr)
+    else:
+        transfer["status"] = "error"
+        apkeep_stats["failed"] += 1
+        print(f"[apkeep] Failed (exit {proc.returncode}): {transfer.get('last_line', '')}", file=sys.stderr)
+    _discard_apkeep_output(package_name, before, paths)
+    return None
+
+async def run_apkeep(package_name: str, priority: int = APKEEP_PRIORITY_INTERACTIVE,
+                     transfer: Optional[Dict[str, Any]] = None, output_dir: str = DOWNLOADS_DIR) -> Optional[str]:
+    """Queue an apkeep download behind the global concurrency limit"""
+    if transfer is None:
+        transfer = {}
+    transfer.update({
+        "package": package_name,
+        "source": "apkeep",
+        "status": "queued",
+        "priority": priority,
+        "queued_at": time.time(),
+        "completed": 0,
+        "total": 0
+    })
+    transfer_id = f"apkeep-{secrets.token_hex(4)}"
+    transfer["id"] = transfer_id
+    apkeep_transfers[transfer_id] = transfer
+    
+    try:
+        wait_start = time.perf_counter()
+        try:
+            await acquire_apkeep_slot(priority)
+        except asyncio.CancelledError:
+            observe_stage("queue_wait", "apkeep", "cancelled", time.perf_counter() - wait_start)
+            transfer["status"] = "cancelled"
+            raise
+        waited = time.perf_counter() - wait_start
+        observe_stage("queue_wait", "apkeep", "success", waited)
+        apkeep_stats["wait_seconds_total"] += waited
+        
+        try:
+            apkeep_stats["started"] += 1
+            transfer["status"] = "starting"
+            transfer["started_at"] = time.time()
+            with track_stage("download", "apkeep") as stage:
+                file_path = await download_with_apkeep(package_name, output_dir, transfer)
+                if not file_path:
+                    stage["outcome"] = "failure"
+                return file_path
+        except OSError as e:
+            transfer["status"] = "error"
+            apkeep_stats["failed"] += 1
+            print(f"[apkeep] Error: {e}", file=sys.stderr)
+            return None
+        finally:
+            release_apkeep_slot()
+            if transfer["status"] != "cancelled":
+                source_health["apkeep"].record(
+                    transfer["status"] in ("complete", "not_found"), time.time() - transfer["started_at"]
+                )
+    finally:
+        apkeep_transfers.pop(transfer_id, None)
+
+def get_apkeep_transfers() -> List[Dict[str, Any]]:
+    now = time.time()
+    transfers = []
+    for transfer in apkeep_transfers.values():
+        started_at = transfer.get("started_at")
+        transfers.append({
+            **transfer,
+            "waited": round((started_at or now) - transfer["queued_at"], 1),
+            "elapsed": round(now - started_at, 1) if started_at else 0.0,
+            "progress": transfer.get("percent", 100.0 if transfer["status"] == "complete" else 0.0)
+        })
+    return transfers
+
+def apkeep_queue_status() -> Dict[str, Any]:
+    return {
+        **apkeep_stats,
+        "wait_seconds_total": round(apkeep_stats["wait_seconds_total"], 3),
+        "avg_wait_seconds": round(apkeep_stats["wait_seconds_total"] / apkeep_stats["started"], 3) if apkeep_stats["started"] else 0.0,
+        "queued": len(apkeep_queue),
+        "running": apkeep_active,
+        "max_concurrent": APKEEP_MAX_CONCURRENT,
+        "queue_max": APKEEP_QUEUE_MAX
+    }
+
+def find_cached_artifact(package_name: str) -> Optional[str]:
+    """Cached artifact path without touching LRU state or hit counters"""
+    entry = artifact_cache.get(package_name) or adopt_shared_artifact(package_name)
+    if entry and not artifact_expired(entry) and os.path.exists(entry["path"]):
+        return entry["path"]
+    return None
+
+async def acquire_package(package_name: str, use_apkeep_only: bool = False,
+                          transfer: Optional[Dict[str, Any]] = None,
+                          apkeep_transfer: Optional[Dict[str, Any]] = None,
+                          priority: int = APKEEP_PRIORITY_INTERACTIVE,
+                          record_not_found: bool = True,
+                          race: Optional[bool] = None,
+                          staged: bool = False) -> Tuple[Optional[str], Optional[str]]:
+    """Fetch a package into DOWNLOADS_DIR (APKPure+aria2, then apkeep) and record the outcome.
+    
+    With ``race`` (default DOWNLOAD_RACE) both sources run concurrently, see
+    race_package_sources(). ``transfer`` and ``apkeep_transfer`` receive
+    aria2 and apkeep progress. With ``staged`` (refreshes of a cached package)
+    the download goes to a private directory and only replaces the cached
+    file once it succeeded, so clients reading the old copy are unaffected
+    and a failed refresh leaves it in place.
+    Raises SourceUnavailable when every source it would try has an open
+    circuit. Callers must hold the package's download lock.
+    """
+    if transfer is None:
+        transfer = {}
+    if apkeep_transfer is None:
+        apkeep_transfer = {}
+    transfer.pop("metadata", None)
+    
+    output_dir = DOWNLOADS_DIR
+    if staged:
+        output_dir = os.path.join(REFRESH_STAGING_DIR, f"{package_name}-{secrets.token_hex(4)}")
+        os.makedirs(output_dir, exist_ok=True)
+    try:
+        if (DOWNLOAD_RACE_DEFAULT if race is None else race) and not use_apkeep_only:
+            file_path, source, skipped = await race_package_sources(
+                package_name, transfer, apkeep_transfer, priority, output_dir
+            )
+        else:
+            file_path, source, skipped = await fetch_package_sequential(
+                package_name, use_apkeep_only, transfer, apkeep_transfer, priority, output_dir
+            )
+        if staged and file_path and os.path.exists(file_path):
+            final_path = os.path.join(DOWNLOADS_DIR, os.path.basename(file_path))
+            os.replace(file_path, final_path)
+            file_path = final_path
+    finally:
+        if staged:
+            shutil.rmtree(output_dir, ignore_errors=True)
+    
+    if skipped and not file_path:
+        tried = 1 if use_apkeep_only else 2
+        if len(skipped) == tried:
+            raise SourceUnavailable(
+                f"no download source available for {package_name}",
+                min(health.retry_after() for health in skipped)
+            )
+        return None, None
+    
+    if not file_path or not os.path.exists(file_path):
+        # A timeout or server error says nothing about the package; only cache clean 404s
+        answered = apkeep_transfer.get("status") == "not_found" and (
+            use_apkeep_only or aria2_reported_missing(transfer)
+        )
+        if record_not_found and answered:
+            not_found_cache.add(package_name)
+            stats["not_found"] += 1
+            print(f"[Not Found] {package_name} added to cache for 1 hour", file=sys.stderr)
+        return None, None
+    
+    file_size = os.path.getsize(file_path)
+    stats["downloads"] += 1
+    metadata = await index_artifact(file_path, transfer.get("metadata") if source == "aria2+apkpure" else None)
+    if metadata and metadata.get("package") and metadata["package"] != package_name:
+        print(f"[Warning] {package_name} artifact declares package {metadata['package']}", file=sys.stderr)
+    cache_store_artifact(package_name, file_path, metadata=metadata)
+    
+    print(f"[Success] {package_name} downloaded via {source}: {file_size/(1024*1024):.1f} MB", file=sys.stderr)
+    return file_path, source
+
+async def fetch_package_sequential(package_name: str, use_apkeep_only: bool, transfer: Dict[str, Any],
+                                   apkeep_transfer: Dict[str, Any], priority: int,
+                                   output_dir: str = DOWNLOADS_DIR) -> Tuple[Optional[str], Optional[str], List[SourceHealth]]:
+    """APKPure+aria2, then apkeep; returns the file, its source and the sources skipped by their breakers"""
+    file_path = None
+    source = None
+    # Sources with an open circuit are skipped; a miss is only cached when every source answered
+    skipped: List[SourceHealth] = []
+    
+    if not use_apkeep_only:
+        if source_health["apkpure_download"].allow():
+            print(f"[Download] Trying APKPure+aria2 for {package_name}...", file=sys.stderr)
+            file_path = await download_from_apkpure(package_name, output_dir, transfer=transfer)
+            if file_path:
+                source = "aria2+apkpure"
+        else:
+            print(f"[Download] APKPure circuit open, skipping for {package_name}", file=sys.stderr)
+            skipped.append(source_health["apkpure_download"])
+    
+    if not file_path:
+        if source_health["apkeep"].allow():
+            print(f"[Download] {'Force using' if use_apkeep_only else 'Falling back to'} apkeep for {package_name}...", file=sys.stderr)
+            file_path = await run_apkeep(package_name, priority, apkeep_transfer, output_dir=output_dir)
+            if file_path:
+                source = "apkeep"
+        else:
+            print(f"[Download] apkeep circuit open, skipping for {package_name}", file=sys.stderr)
+            skipped.append(source_health["apkeep"])
+    
+    return file_path, source, skipped
+
+DOWNLOAD_RACE_DEFAULT = os.environ.get("DOWNLOAD_RACE", "false").lower() == "true"
+DOWNLOAD_RACE_HEDGE_DELAY = float(os.environ.get("DOWNLOAD_RACE_HEDGE_DELAY", "3"))
+# Aggregate download rate above which no second racing leg is started (0 = no limit)
+DOWNLOAD_BANDWIDTH_BUDGET = int(float(os.environ.get("DOWNLOAD_BANDWIDTH_BUDGET_MBPS", "0")) * 1024 * 1024)
+RACE_STAGING_DIR = os.path.join(DOWNLOADS_DIR, '.race')
+REFRESH_STAGING_DIR = os.path.join(DOWNLOADS_DIR, '.refresh')
+
+race_stats = {
+    "races": 0,
+    "hedged": 0,
+    "budget_deferred": 0,
+    "apkpure_wins": 0,
+    "apkeep_wins": 0,
+    "losers_cancelled": 0,
+    "invalid_artifacts": 0
+}
+
+def download_bandwidth_in_use() -> int:
+    """Bytes/s currently being pulled by aria2 and apkeep transfers"""
+    now = time.time()
+    used = 0.0
+    for transfer in itertools.chain(aria2_transfers.values(), apkeep_transfers.values()):
+        started_at = transfer.get("started_at")
+        if transfer.get("speed"):
+            used += transfer["speed"]
+        elif started_at and now > started_at:
+            # One-shot aria2c and apkeep only report bytes on disk; use their average rate
+            used += transfer.get("completed", 0) / (now - started_at)
+    return int(used)
+
+def race_within_budget() -> bool:
+    return not DOWNLOAD_BANDWIDTH_BUDGET or download_bandwidth_in_use() < DOWNLOAD_BANDWIDTH_BUDGET
+
+async def _race_apkeep_leg(package_name: str, priority: int, apkeep_transfer: Dict[str, Any]) -> Optional[str]:
+    """apkeep into a private staging directory so it cannot clobber the APKPure leg's file.
+    
+    Any failure, including a full apkeep queue, only loses this leg; the
+    APKPure leg keeps downloading.
+    """
+    staging_dir = os.path.join(RACE_STAGING_DIR, f"{package_name}-{secrets.token_hex(4)}")
+    os.makedirs(staging_dir, exist_ok=True)
+    file_path = None
+    try:
+        file_path = await run_apkeep(package_name, priority, apkeep_transfer, output_dir=staging_dir)
+        return file_path
+    except ApkeepQueueFull as e:
+        apkeep_transfer["status"] = "rejected"
+        print(f"[Race] apkeep not raced for {package_name}: {e}", file=sys.stderr)
+        return None
+    except Exception as e:
+        apkeep_transfer["status"] = "error"
+        print(f"[Race] apkeep leg failed for {package_name}: {e}", file=sys.stderr)
+        return None
+    finally:
+        if not file_path:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+def _discard_race_result(source: str, file_path: str):
+    if source == "apkeep":
+        shutil.rmtree(os.path.dirname(file_path), ignore_errors=True)
+    else:
+        remove_partial_download(file_path)
+
+async def race_package_sources(package_name: str, transfer: Dict[str, Any], apkeep_transfer: Dict[str, Any],
+                               priority: int, output_dir: str = DOWNLOADS_DIR) -> Tuple[Optional[str], Optional[str], List[SourceHealth]]:
+    """Race APKPure+aria2 against apkeep and keep the first valid artifact.
+    
+    apkeep joins DOWNLOAD_RACE_HEDGE_DELAY seconds after APKPure, or as soon
+    as APKPure fails, and only while the aggregate download rate is under
+    DOWNLOAD_BANDWIDTH_BUDGET. The losing leg is cancelled and its partial
+    file removed.
+    """
+    race_stats["races"] += 1
+    skipped: List[SourceHealth] = []
+    legs: Dict[asyncio.Task, str] = {}
+    apkeep_considered = False
+    winner: Optional[Tuple[str, str]] = None
+    
+    def start_apkeep():
+        nonlocal apkeep_considered
+        apkeep_considered = True
+        if source_health["apkeep"].allow():
+            legs[asyncio.create_task(_race_apkeep_leg(package_name, priority, apkeep_transfer))] = "apkeep"
+        else:
+            print(f"[Race] apkeep circuit open, not racing {package_name}", file=sys.stderr)
+            skipped.append(source_health["apkeep"])
+    
+    if source_health["apkpure_download"].allow():
+        print(f"[Race] Starting APKPure+aria2 for {package_name}", file=sys.stderr)
+        legs[asyncio.create_task(download_from_apkpure(package_name, output_dir, transfer=transfer))] = "aria2+apkpure"
+    else:
+        skipped.append(source_health["apkpure_download"])
+        start_apkeep()
+    
+    try:
+        while legs:
+            done, _ = await asyncio.wait(
+                legs.keys(),
+                timeout=None if apkeep_considered else DOWNLOAD_RACE_HEDGE_DELAY,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            if not done:
+                if race_within_budget():
+                    race_stats["hedged"] += 1
+                    print(f"[Race] APKPure still running after {DOWNLOAD_RACE_HEDGE_DELAY}s, racing apkeep for {package_name}", file=sys.stderr)
+                    start_apkeep()
+                else:
+                    race_stats["budget_deferred"] += 1
+                continue
+            
+            for task in done:
+                source = legs.pop(task)
+                file_path = task.result()
+                if not file_path or winner:
+                    if file_path:
+                        _discard_race_result(source, file_path)
+                    continue
+                if await asyncio.get_event_loop().run_in_executor(None, zipfile.is_zipfile, file_path):
+                    winner = (file_path, source)
+                else:
+                    race_stats["invalid_artifacts"] += 1
+                    print(f"[Race] {source} produced an invalid archive for {package_name}", file=sys.stderr)
+                    _discard_race_result(source, file_path)
+            if winner:
+                break
+            if not apkeep_considered:
+                start_apkeep()
+    finally:
+        for task in legs:
+            task.cancel()
+        for (task, source), result in zip(legs.items(), await asyncio.gather(*legs, return_exceptions=True)):
+            if winner:
+                race_stats["losers_cancelled"] += 1
+                print(f"[Race] Cancelled losing {source} leg for {package_name}", file=sys.stderr)
+            if isinstance(result, str):
+                _discard_race_result(source, result)
+        if legs and winner and winner[1] == "apkeep":
+            # APKPure may have been cancelled between finishing aria2 and renaming its file
+            remove_partial_download(os.path.join(output_dir, f"{package_name}.tmp"))
+    
+    if not winner:
+        if apkeep_transfer.get("status") == "rejected":
+            # apkeep never answered, so report a busy queue as the sequential path does
+            raise ApkeepQueueFull(f"apkeep queue is full, {package_name} not fetched")
+        return None, None, skipped
+    file_path, source = winner
+    race_stats["apkpure_wins" if source == "aria2+apkpure" else "apkeep_wins"] += 1
+    if source == "apkeep":
+        final_path = os.path.join(output_dir, os.path.basename(file_path))
+        os.replace(file_path, final_path)
+        shutil.rmtree(os.path.dirname(file_path), ignore_errors=True)
+        file_path = final_path
+    print(f"[Race] {source} won for {package_name}", file=sys.stderr)
+    return file_path, source, skipped
+
+DOWNLOAD_TEE_DEFAULT = os.environ.get("DOWNLOAD_TEE", "false").lower() == "true"
+TEE_CHUNK_SIZE = 256 * 1024
+TEE_POLL_INTERVAL = 0.2
+TEE_SNIFF_BYTES = 4096
+
+inflight_downloads: Dict[str, Dict[str, Any]] = {}
+
+def sniff_file_type(head: bytes) -> Optional[str]:
+    """Guess apk/xapk from the first ZIP local file header of a partial download"""
+    if len(head) < 30 or head[:4] != b'PK\x03\x04':
+        return None
+    name_length = int.from_bytes(head[26:28], 'little')
+    if len(head) < 30 + name_length:
+        return None
+    name = head[30:30 + name_length].decode('utf-8', errors='replace').lower()
+    if name.endswith('.apk') or name in ('manifest.json', 'icon.png') or name.startswith('android/obb/'):
+        return 'xapk'
+    return 'apk'
+
+async def _run_inflight_download(package_name: str, entry: Dict[str, Any]):
+    try:
+        wait_start = time.perf_counter()
+        async with get_download_lock(package_name):
+            observe_stage("lock_wait", "tee", "success", time.perf_counter() - wait_start)
+            entry["final_path"] = find_cached_artifact(package_name)
+            # The previous holder, possibly another worker, may have just recorded a miss
+            if not entry["final_path"] and package_name not in not_found_cache:
+                # Streaming follows the aria2 transfer, so tee downloads never race
+                entry["final_path"], entry["source"] = await acquire_package(
+                    package_name, transfer=entry["transfer"], race=False
+                )
+    except ApkeepQueueFull as e:
+        entry["busy"] = ("Download queue is full, retry later", 30)
+        print(f"[Tee] {package_name} not started: {e}", file=sys.stderr)
+    except SourceUnavailable as e:
+        entry["busy"] = ("Download sources are unavailable, retry later", e.retry_after)
+        print(f"[Tee] {package_name} not started: {e}", file=sys.stderr)
+    except Exception as e:
+        print(f"[Tee] {package_name} failed: {e}", file=sys.stderr)
+    finally:
+        entry["done"].set()
+        inflight_downloads.pop(package_name, None)
+
+def start_inflight_download(package_name: str) -> Dict[str, Any]:
+    """Start fetching a package in the background so clients can read it while it downloads"""
+    entry = {
+        "transfer": {},
+        "source": None,
+        "final_path": None,
+        "done": asyncio.Event()
+    }
+    inflight_downloads[package_name] = entry
+    entry["task"] = asyncio.create_task(_run_inflight_download(package_name, entry))
+    return entry
+
+async def _read_inflight_file(entry: Dict[str, Any], f, attempt: int) -> AsyncIterator[bytes]:
+    transfer = entry["transfer"]
+    sent = 0
+    try:
+        while True:
+            if entry["done"].is_set():
+                final_path = entry["final_path"]
+                if not final_path or os.fstat(f.fileno()).st_ino != os.stat(final_path).st_ino:
+                    raise RuntimeError("in-flight download was replaced before completion")
+                while True:
+                    chunk = await f.read(TEE_CHUNK_SIZE)
+                    if not chunk:
+                        return
+                    yield chunk
+            
+            if transfer.get("attempt") != attempt:
+                raise RuntimeError("in-flight download restarted after streaming began")
+            
+            available = transfer.get("contiguous", 0) - sent
+            if available <= 0:
+                await asyncio.sleep(TEE_POLL_INTERVAL)
+                continue
+            
+            chunk = await f.read(min(available, TEE_CHUNK_SIZE))
+            if not chunk:
+                await asyncio.sleep(TEE_POLL_INTERVAL)
+                continue
+            sent += len(chunk)
+            yield chunk
+    finally:
+        await f.close()
+
+async def stream_inflight_download(package_name: str, entry: Dict[str, Any]) -> Optional[StreamingResponse]:
+    """Stream a package while it is still downloading.
+    
+    Waits until the transfer knows its total size, the first bytes are on
+    disk and the transfer is settled: its endpoint was probed as serving a
+    ZIP, or it is the last candidate. A response is therefore never started
+    on a file that the XAPK->APK fallback is about to replace. If a settled
+    transfer still fails, the stream aborts before Content-Length bytes are
+    sent, so the client sees a broken transfer rather than a complete file.
+    Returns None once the download has already finished, in which case the
+    caller serves the completed file (or a 404) itself. Only the aria2 RPC
+    daemon reports contiguous progress, so download_apk tees only through it.
+    """
+    transfer = entry["transfer"]
+    
+    while not entry["done"].is_set():
+        total = transfer.get("total", 0)
+        if total and transfer.get("settled") and transfer.get("contiguous", 0) >= min(TEE_SNIFF_BYTES, total):
+            attempt = transfer["attempt"]
+            try:
+                f = await aiofiles.open(transfer["path"], 'rb')
+            except FileNotFoundError:
+                await asyncio.sleep(TEE_POLL_INTERVAL)
+                continue
+            head = await f.read(TEE_SNIFF_BYTES)
+            await f.seek(0)
+            file_type = sniff_file_type(head) or 'apk'
+            
+            print(f"[Tee] Streaming {package_name} while downloading ({total/(1024*1024):.1f} MB)", file=sys.stderr)
+            return StreamingResponse(
+                _read_inflight_file(entry, f, attempt),
+                media_type="application/octet-stream",
+                headers={
+                    "Content-Length": str(total),
+                    "Content-Disposition": f'attachment; filename="{package_name}.{file_type}"',
+                    "X-Source": transfer.get("source", "aria2+apkpure"),
+                    "X-File-Type": file_type,
+                    "X-File-Size": str(total),
+                    "X-Streamed": "true",
+                    "Cache-Control": "no-cache"
+                }
+            )
+        await asyncio.sleep(TEE_POLL_INTERVAL)
+    
+    return None
+
+JOB_RETENTION = int(os.environ.get("JOB_RETENTION", "3600"))
+JOB_MAX_FINISHED = 500
+
+download_jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+active_jobs: Dict[str, str] = {}
+job_stats = {
+    "created": 0,
+    "deduplicated": 0,
+    "completed": 0,
+    "failed": 0,
+    "cancelled": 0
+}
+
+async def _run_download_job(job: Dict[str, Any]):
+    package_name = job["package"]
+    try:
+        wait_start = time.perf_counter()
+        async with get_download_lock(package_name):
+            observe_stage("lock_wait", "job", "success", time.perf_counter() - wait_start)
+            job["status"] = "running"
+            file_path = None if job["force_apkeep"] or job["refresh"] else find_cached_artifact(package_name)
+            source = "cache"
+            if not file_path:
+                file_path, source = await acquire_package(
+                    package_name, job["force_apkeep"],
+                    transfer=job["transfer"],
+                    apkeep_transfer=job["apkeep_transfer"],
+                    priority=job["priority"],
+                    record_not_found=not job["refresh"],
+                    staged=job["refresh"]
+                )
+        
+        if file_path:
+            job.update({
+                "status": "complete",
+                "source": source,
+                "file_type": os.path.splitext(file_path)[1][1:],
+                "size": os.path.getsize(file_path)
+            })
+            job_stats["completed"] += 1
+        else:
+            job.update({"status": "failed", "error": f"App {package_name} not found"})
+            job_stats["failed"] += 1
+    except asyncio.CancelledError:
+        job["status"] = "cancelled"
+        job_stats["cancelled"] += 1
+        raise
+    except (ApkeepQueueFull, SourceUnavailable) as e:
+        job.update({"status": "failed", "error": str(e), "retryable": True})
+        job_stats["failed"] += 1
+    except Exception as e:
+        print(f"[Job] {job['id']} ({package_name}) failed: {e}", file=sys.stderr)
+        job.update({"status": "failed", "error": str(e)})
+        job_stats["failed"] += 1
+    finally:
+        job["finished_at"] = time.time()
+        if active_jobs.get(package_name) == job["id"]:
+            del active_jobs[package_name]
+
+def start_download_job(package_name: str, force_apkeep: bool = False,
+                       priority: int = APKEEP_PRIORITY_INTERACTIVE, refresh: bool = False) -> Dict[str, Any]:
+    """Start (or join) a background acquisition of a package, independent of any client connection.
+    
+    ``refresh`` downloads again even if the package is cached, keeping the
+    cached copy (and not caching a miss) if the new download fails.
+    """
+    job_id = active_jobs.get(package_name)
+    if job_id and job_id in download_jobs:
+        job_stats["deduplicated"] += 1
+        return download_jobs[job_id]
+    
+    job = {
+        "id": secrets.token_hex(8),
+        "package": package_name,
+        "force_apkeep": force_apkeep,
+        "refresh": refresh,
+        "priority": priority,
+        "status": "queued",
+        "created_at": time.time(),
+        "finished_at": None,
+        "transfer": {},
+        "apkeep_transfer": {}
+    }
+    download_jobs[job["id"]] = job
+    active_jobs[package_name] = job["id"]
+    job_stats["created"] += 1
+    job["task"] = asyncio.create_task(_run_download_job(job))
+    prune_download_jobs()
+    return job
+
+def prune_download_jobs():
+    """Forget finished jobs past JOB_RETENTION, and the oldest ones beyond JOB_MAX_FINISHED"""
+    now = time.time()
+    finished = [job for job in download_jobs.values() if job["finished_at"]]
+    excess = len(finished) - JOB_MAX_FINISHED
+    for job in finished:
+        if excess > 0 or now - job["finished_at"] > JOB_RETENTION:
+            download_jobs.pop(job["id"], None)
+            excess -= 1
+
+def describe_job(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Public view of a job: stage, byte progress and ETA of whichever transfer is active"""
+    now = time.time()
+    transfer = job["transfer"]
+    apkeep_transfer = job["apkeep_transfer"]
+    
+    if job["status"] in ("complete", "failed", "cancelled"):
+        size = job.get("size", 0)
+        stage, current = job["status"], {"completed": size, "total": size}
+    elif apkeep_transfer.get("status"):
+        stage = "apkeep-queued" if apkeep_transfer["status"] == "queued" else "apkeep"
+        current = apkeep_transfer
+    elif transfer.get("status"):
+        stage = "aria2-xapk" if transfer.get("kind") == "xapk" else "aria2-apk"
+        current = transfer
+    else:
+        stage, current = "waiting", {}
+    
+    completed = current.get("completed", 0)
+    total = current.get("total", 0)
+    speed = current.get("speed", 0)
+    started_at = current.get("started_at")
+    if not speed and completed and started_at and now > started_at:
+        speed = completed / (now - started_at)
+    
+    view = {
+        "id": job["id"],
+        "package": job["package"],
+        "status": job["status"],
+        "stage": stage,
+        "bytes_completed": completed,
+        "bytes_total": total,
+        "progress": round(completed * 100 / total, 1) if total else current.get("percent"),
+        "speed": int(speed),
+        "eta": round((total - completed) / speed, 1) if speed and total else None,
+        "elapsed": round((job["finished_at"] or now) - job["created_at"], 1)
+    }
+    if job["status"] == "complete":
+        view.update({
+            "source": job["source"],
+            "file_type": job["file_type"],
+            "size": job["size"],
+            "download_url": f"/download/{job['package']}"
+        })
+    if job.get("error"):
+        view["error"] = job["error"]
+        view["retryable"] = job.get("retryable", False)
+    return view
+
+PREFETCH_ENABLED = os.environ.get("PREFETCH_ENABLED", "true").lower() == "true"
+PREFETCH_TOP_N = int(os.environ.get("PREFETCH_TOP_N", "10"))
+PREFETCH_INTERVAL = int(os.environ.get("PREFETCH_INTERVAL", "900"))
+PREFETCH_REFRESH_AGE = int(os.environ.get("PREFETCH_REFRESH_AGE", str(12 * 3600)))
+PREFETCH_MIN_SCORE = float(os.environ.get("PREFETCH_MIN_SCORE", "2"))
+PREFETCH_HALF_LIFE = int(os.environ.get("PREFETCH_HALF_LIFE", str(24 * 3600)))
+PREFETCH_CONCURRENCY = int(os.environ.get("PREFETCH_CONCURRENCY", "1"))
+PREFETCH_MAX_BYTES = int(float(os.environ.get("PREFETCH_MAX_GB_PER_CYCLE", "2")) * 1024 ** 3)
+PREFETCH_STARTUP_DELAY = 60
+DEMAND_INDEX_PATH = os.path.join(DOWNLOADS_DIR, '.demand_index.json')
+DEMAND_MAX_ENTRIES = 5000
+
+package_demand: Dict[str, Dict[str, Any]] = {}
+prefetch_stats = {
+    "cycles": 0,
+    "prefetched": 0,
+    "refreshed": 0,
+    "unchanged": 0,
+    "failed": 0,
+    "skipped_budget": 0,
+    "bytes": 0
+}
+prefetch_state: Dict[str, Any] = {"running": False, "last_cycle": None, "last_targets": []}
+
+def demand_score(entry: Dict[str, Any], now: float) -> float:
+    """Request count decayed with a half-life of PREFETCH_HALF_LIFE"""
+    return entry["score"] * 0.5 ** ((now - entry["updated_at"]) / PREFETCH_HALF_LIFE)
+
+def record_package_demand(package_name: str):
+    now = time.time()
+    entry = package_demand.get(package_name)
+    if entry is None:
+        entry = package_demand[package_name] = {"score": 0.0, "updated_at": now, "requests": 0}
+    entry["score"] = demand_score(entry, now) + 1
+    entry["updated_at"] = now
+    entry["requests"] += 1
+    
+    if len(package_demand) > DEMAND_MAX_ENTRIES:
+        ranked = sorted(package_demand, key=lambda p: demand_score(package_demand[p], now))
+        for name in ranked[:len(package_demand) - int(DEMAND_MAX_ENTRIES * 0.9)]:
+            del package_demand[name]
 
-async def schedule_file_deletion(file_path: str, delay: int = 60):
-    await asyncio.sleep(delay)
+def save_demand_index():
     try:
-        if os.path.exists(file_path):
-            os.remove(file_path)
-            print(f"[Cleanup] Deleted: {os.path.basename(file_path)}", file=sys.stderr)
+        tmp_path = DEMAND_INDEX_PATH + '.part'
+        with open(tmp_path, 'w') as f:
+            json.dump(package_demand, f)
+        os.replace(tmp_path, DEMAND_INDEX_PATH)
     except Exception as e:
-        print(f"[Cleanup Error] {file_path}: {e}", file=sys.stderr)
+        print(f"[Prefetch] Failed to save demand index: {e}", file=sys.stderr)
 
-async def cleanup_old_files_async():
-    """Async version of cleanup using aiofiles"""
+def load_demand_index():
     try:
-        now = time.time()
-        max_age = 300
-        for filename in os.listdir(DOWNLOADS_DIR):
-            file_path = os.path.join(DOWNLOADS_DIR, filename)
-            if os.path.isfile(file_path):
-                file_age = now - os.path.getmtime(file_path)
-                if file_age > max_age:
-                    try:
-                        os.remove(file_path)
-                        print(f"[Cleanup] Removed old file: {filename}", file=sys.stderr)
-                    except Exception as e:
-                        print(f"[Cleanup] Failed to remove {filename}: {e}", file=sys.stderr)
+        with open(DEMAND_INDEX_PATH) as f:
+            package_demand.update(json.load(f))
+    except FileNotFoundError:
+        pass
     except Exception as e:
-        print(f"[Cleanup Error] {e}", file=sys.stderr)
+        print(f"[Prefetch] Demand index unreadable, starting empty: {e}", file=sys.stderr)
 
-async def periodic_cleanup():
+def hot_packages(now: Optional[float] = None) -> List[Tuple[str, float]]:
+    """Top PREFETCH_TOP_N packages by decayed demand, skipping known misses"""
+    now = now or time.time()
+    ranked = sorted(
+        ((name, demand_score(entry, now)) for name, entry in package_demand.items()),
+        key=lambda item: item[1],
+        reverse=True
+    )
+    hot = []
+    for name, score in ranked:
+        if score < PREFETCH_MIN_SCORE or len(hot) >= PREFETCH_TOP_N:
+            break
+        if name in not_found_cache:
+            continue
+        hot.append((name, score))
+    return hot
+
+def prefetch_targets(now: Optional[float] = None) -> List[Dict[str, Any]]:
+    """Pinned and hot packages that are missing from the cache or due for a refresh.
+    
+    Decided from the artifact index alone, without touching the files.
+    """
+    now = now or time.time()
+    scores = dict(hot_packages(now))
+    targets = []
+    for name in list(dict.fromkeys(ARTIFACT_CACHE_PINNED + list(scores))):
+        entry = indexed_artifact(name)
+        meta = (entry or {}).get("meta") or {}
+        if entry:
+            age = now - entry["created_at"]
+            expires_in = entry["created_at"] + entry["ttl"] - now
+            if age < PREFETCH_REFRESH_AGE and expires_in > 2 * PREFETCH_INTERVAL:
+                continue
+        targets.append({
+            "package": name,
+            "score": round(scores.get(name, 0.0), 2),
+            "refresh": entry is not None,
+            "version_code": meta.get("version_code"),
+            "expected_bytes": entry["size"] if entry else 0
+        })
+    return targets
+
+async def run_prefetch_cycle():
+    """Warm or refresh prefetch targets within the per-cycle byte and concurrency budget"""
+    if prefetch_state["running"]:
+        return
+    prefetch_state["running"] = True
+    try:
+        targets = prefetch_targets()
+        prefetch_state["last_targets"] = targets
+        spent = 0
+        semaphore = asyncio.Semaphore(PREFETCH_CONCURRENCY)
+        
+        async def prefetch(target: Dict[str, Any]):
+            nonlocal spent
+            async with semaphore:
+                if spent and spent + target["expected_bytes"] > PREFETCH_MAX_BYTES:
+                    prefetch_stats["skipped_budget"] += 1
+                    return
+                job = start_download_job(target["package"], priority=APKEEP_PRIORITY_BACKGROUND,
+                                         refresh=target["refresh"])
+                await asyncio.wait({job["task"]})
+                if job["status"] == "complete" and job["source"] != "cache":
+                    spent += job["size"]
+                    prefetch_stats["bytes"] += job["size"]
+                    prefetch_stats["refreshed" if target["refresh"] else "prefetched"] += 1
+                    new_meta = (indexed_artifact(target["package"]) or {}).get("meta") or {}
+                    if target["refresh"] and target["version_code"] is not None and new_meta.get("version_code") == target["version_code"]:
+                        prefetch_stats["unchanged"] += 1
+                elif job["status"] != "complete":
+                    prefetch_stats["failed"] += 1
+        
+        if targets:
+            print(f"[Prefetch] Warming {len(targets)} packages: {', '.join(t['package'] for t in targets)}", file=sys.stderr)
+        with track_stage("prefetch", "cycle"):
+            await asyncio.gather(*(prefetch(target) for target in targets))
+        prefetch_stats["cycles"] += 1
+        prefetch_state["last_cycle"] = time.time()
+        save_demand_index()
+    finally:
+        prefetch_state["running"] = False
+
+async def prefetch_loop():
+    await asyncio.sleep(PREFETCH_STARTUP_DELAY)
     while True:
-        await asyncio.sleep(60)
-        await cleanup_old_files_async()
+        try:
+            await run_prefetch_cycle()
+        except Exception as e:
+            print(f"[Prefetch Error] {e}", file=sys.stderr)
+        await asyncio.sleep(PREFETCH_INTERVAL)
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    global httpx_client
-    print("[Server] Starting with enhanced protection (cloudscraper, curl-cffi, httpx)...", file=sys.stderr)
-    httpx_client = httpx.AsyncClient(
-        timeout=30.0,
-        follow_redirects=True,
-        headers={
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-        }
-    )
-    asyncio.create_task(periodic_cleanup())
-    yield
-    if httpx_client:
-        await httpx_client.aclose()
-    print("[Server] Shutting down...", file=sys.stderr)
+RANGE_HEADER_RE = re.compile(r'^\s*bytes\s*=\s*(.+)$', re.IGNORECASE)
 
-app = FastAPI(title="APK Download API (Enhanced)", lifespan=lifespan)
+def artifact_etag(package_name: str, file_path: str, size: int, mtime_ns: int) -> str:
+    """Strong ETag from the content hash, or from size and mtime until the hash is known"""
+    entry = artifact_cache.get(package_name)
+    if entry and entry.get("sha256") and entry["path"] == file_path and entry["size"] == size:
+        return f'"{entry["sha256"][:40]}"'
+    return f'"{size:x}-{mtime_ns:x}"'
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+def etag_matches(header: str, etag: str) -> bool:
+    """Weak comparison as used by If-None-Match"""
+    if header.strip() == '*':
+        return True
+    return any(tag.strip().removeprefix('W/') == etag for tag in header.split(','))
+
+def if_range_matches(header: Optional[str], etag: str, last_modified: str) -> bool:
+    """Strong comparison as used by If-Range; an absent header always matches"""
+    if header is None:
+        return True
+    header = header.strip()
+    if header.startswith('W/'):
+        return False
+    if header.startswith('"'):
+        return header == etag
+    return header == last_modified
+
+def parse_byte_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Parse a Range header into one inclusive (start, end) span.
+    
+    Multiple ranges are coalesced into the span covering all of them. Returns
+    None for headers that should be ignored and (size, size) when nothing in
+    the header overlaps the file.
+    """
+    match = RANGE_HEADER_RE.match(header)
+    if not match:
+        return None
+    
+    spans = []
+    for part in match.group(1).split(','):
+        first, sep, last = part.strip().partition('-')
+        if not sep:
+            return None
+        try:
+            if first:
+                start = int(first)
+                end = int(last) if last else max(start, size - 1)
+            elif last:
+                suffix = int(last)
+                if suffix == 0:
+                    continue
+                start, end = max(0, size - suffix), size - 1
+            else:
+                return None
+        except ValueError:
+            return None
+        if start < 0 or end < start:
+            return None
+        if start < size:
+            spans.append((start, min(end, size - 1)))
+    
+    if not spans:
+        return size, size
+    return min(start for start, _ in spans), max(end for _, end in spans)
 
-def download_with_apkeep(package_name: str, output_dir: str) -> Optional[str]:
+async def read_open_file(f, start: int, end: int) -> AsyncIterator[bytes]:
+    """Stream bytes start..end (inclusive) of an opened file, then close it.
+    
+    Reading the handle rather than the path keeps serving the inode that was
+    stat'ed even if a refresh replaces the file mid-response.
+    """
+    loop = asyncio.get_event_loop()
     try:
-        print(f"[apkeep] Downloading {package_name}...", file=sys.stderr)
-        start_time = time.time()
-        
-        result = subprocess.run(
-            [APKEEP_PATH, "-a", package_name, output_dir],
-            capture_output=True,
-            text=True,
-            timeout=300
-        )
-        
-        elapsed = time.time() - start_time
+        offset = start
+        while offset <= end:
+            chunk = await loop.run_in_executor(None, os.pread, f.fileno(), min(TEE_CHUNK_SIZE, end - offset + 1), offset)
+            if not chunk:
+                return
+            offset += len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+def metadata_headers(entry: Optional[Dict[str, Any]]) -> Dict[str, str]:
+    """X-* headers describing an indexed artifact's contents"""
+    meta = (entry or {}).get("meta")
+    if not meta:
+        return {}
+    headers = {
+        "X-Package": meta.get("package"),
+        "X-Version-Name": meta.get("version_name"),
+        "X-Version-Code": meta.get("version_code"),
+        "X-Split-Count": len(meta.get("splits") or []) or None,
+        "X-OBB-Size": sum(obb["size"] for obb in meta.get("obb") or []) or None,
+        "X-ABIs": ','.join(meta.get("abis") or []) or None
+    }
+    return {name: str(value) for name, value in headers.items() if value is not None}
+
+def artifact_response(request: Optional[Request], package_name: str, file_path: str,
+                      headers: Dict[str, str], head: bool = False) -> Response:
+    """Serve a finished artifact honouring If-None-Match, Range and If-Range.
+    
+    Ranges are resolved here rather than left to FileResponse so behaviour does
+    not depend on the installed Starlette version. Bodies are read from the
+    handle whose fstat gave Content-Length and the validators, so a file
+    replaced by a prefetch refresh cannot mix old headers with new bytes.
+    """
+    entry = artifact_cache.get(package_name)
+    if entry and entry["path"] != file_path:
+        entry = None
+    f = None
+    if head and entry and entry.get("mtime_ns"):
+        size, mtime_ns = entry["size"], entry["mtime_ns"]
+    elif head:
+        st = os.stat(file_path)
+        size, mtime_ns = st.st_size, st.st_mtime_ns
+    else:
+        f = open(file_path, 'rb')
+        st = os.fstat(f.fileno())
+        size, mtime_ns = st.st_size, st.st_mtime_ns
+    filename = os.path.basename(file_path)
+    etag = artifact_etag(package_name, file_path, size, mtime_ns)
+    last_modified = formatdate(mtime_ns / 1e9, usegmt=True)
+    validators = {"ETag": etag, "Last-Modified": last_modified, "Cache-Control": "no-cache"}
+    headers = {
+        **headers,
+        **metadata_headers(entry),
+        **validators,
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": f'attachment; filename="{filename}"'
+    }
+    request_headers = request.headers if request else {}
+    
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match and etag_matches(if_none_match, etag):
+        if f:
+            f.close()
+        return Response(status_code=304, headers=validators)
+    
+    range_header = request_headers.get("range")
+    byte_range = None
+    if range_header and if_range_matches(request_headers.get("if-range"), etag, last_modified):
+        byte_range = parse_byte_range(range_header, size)
+    
+    if byte_range and byte_range[0] >= size:
+        if f:
+            f.close()
+        return Response(status_code=416, headers={**validators, "Content-Range": f"bytes */{size}"})
+    
+    if byte_range:
+        start, end = byte_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        headers["Content-Length"] = str(end - start + 1)
+        if head:
+            return Response(content=b"", status_code=206, headers=headers)
+        return StreamingResponse(read_open_file(f, start, end), status_code=206,
+                                 media_type="application/octet-stream", headers=headers)
+    
+    headers["Content-Length"] = str(size)
+    if head:
+        return Response(content=b"", headers=headers)
+    return StreamingResponse(read_open_file(f, 0, size - 1),
+                             media_type="application/octet-stream", headers=headers)
+
+class RequestLatencyMiddleware:
+    """Pure ASGI middleware so file and streaming bodies are not re-wrapped per chunk"""
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
         
-        if "downloaded successfully" in result.stdout.lower():
-            for ext in ['.xapk', '.apk', '.apks']:
-                file_path = os.path.join(output_dir, f"{package_name}{ext}")
-                if os.path.exists(file_path):
-                    size_mb = os.path.getsize(file_path) / (1024 * 1024)
-                    print(f"[apkeep] Downloaded {package_name}: {size_mb:.1f} MB in {elapsed:.1f}s", file=sys.stderr)
-                    return file_path
+        start = time.perf_counter()
+        status = {"code": 500}
         
-        if "could not get download url" in result.stdout.lower() or "skipping" in result.stdout.lower():
-            print(f"[apkeep] App not found: {package_name}", file=sys.stderr)
-            return None
-            
-        print(f"[apkeep] Failed: {result.stdout} {result.stderr}", file=sys.stderr)
-        return None
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
         
-    except subprocess.TimeoutExpired:
-        print(f"[apkeep] Timeout for {package_name}", file=sys.stderr)
-        return None
-    except Exception as e:
-        print(f"[apkeep] Error: {e}", file=sys.stderr)
-        return None
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - start,
+                method=scope["method"],
+                route=getattr(route, "path", "unmatched"),
+                status=str(status["code"])
+            )
+
+app.add_middleware(RequestLatencyMiddleware)
+
+metrics.CallbackCounter(
+    "apkapi_events_total",
+    "Server event counters (requests, downloads, cache hits and misses)",
+    ("group", "event"),
+    # Summed over all workers when several share the port, so any one of them can be scraped
+    lambda: {
+        (group, name): value
+        for group, values in (worker_totals if worker_board else stats_snapshot()).items()
+        for name, value in values.items()
+    }
+)
+metrics.Gauge(
+    "apkapi_cache_entries",
+    "Entries currently held per cache",
+    ("cache",),
+    lambda: {
+        ("artifact",): len(artifact_cache),
+        ("search",): len(search_cache),
+        ("not_found",): len(not_found_cache),
+        ("download_locks",): len(download_locks),
+    }
+)
+metrics.Gauge(
+    "apkapi_source_circuit_open",
+    "1 while a source's circuit breaker rejects calls (open or half-open)",
+    ("source",),
+    lambda: {(name,): int(health.state != "closed") for name, health in source_health.items()}
+)
+metrics.CallbackCounter(
+    "apkapi_source_calls_total",
+    "Calls to each upstream source by outcome, including calls rejected by its breaker",
+    ("source", "outcome"),
+    lambda: {
+        (name, outcome): value
+        for name, health in source_health.items()
+        for outcome, value in health.stats.items()
+    }
+)
+metrics.Gauge(
+    "apkapi_artifact_cache_bytes",
+    "Bytes used by cached artifacts",
+    (),
+    lambda: {(): artifact_cache_bytes()}
+)
+metrics.Gauge(
+    "apkapi_in_flight",
+    "Work currently in progress",
+    ("kind",),
+    lambda: {
+        ("aria2_transfers",): len(aria2_transfers),
+        ("tee_downloads",): len(inflight_downloads),
+        ("single_flight_calls",): len(inflight_calls),
+        ("locked_downloads",): download_locks.locked_count(),
+        ("apkeep_running",): apkeep_active,
+        ("apkeep_queued",): len(apkeep_queue),
+        ("download_jobs",): len(active_jobs),
+    }
+)
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus text exposition of stage latencies and counters"""
+    return PlainTextResponse(metrics.render_metrics(), media_type="text/plain; version=0.0.4")
 
 @app.get("/")
 async def root():
@@ -1008,27 +3060,50 @@ async def root():
         "stats": stats
     }
 
+@app.get("/transfers")
+async def list_transfers():
+    """Active aria2 transfers and queued or running apkeep downloads with progress"""
+    transfers = get_aria2_transfers() + get_apkeep_transfers()
+    return {
+        "rpc_daemon": aria2_client is not None,
+        "apkeep_queue": apkeep_queue_status(),
+        "count": len(transfers),
+        "transfers": transfers
+    }
+
+@app.get("/transfers/{transfer_id}")
+async def get_transfer(transfer_id: str):
+    for transfer in get_aria2_transfers() + get_apkeep_transfers():
+        if transfer["id"] == transfer_id:
+            return transfer
+    raise HTTPException(status_code=404, detail=f"Transfer {transfer_id} not found")
+
+@app.delete("/transfers/{transfer_id}")
+async def cancel_transfer(transfer_id: str):
+    if await cancel_aria2_transfer(transfer_id):
+        return {"status": "cancelled", "transfer": transfer_id}
+    raise HTTPException(status_code=404, detail=f"Transfer {transfer_id} not found")
+
 @app.head("/download/{package_name}")
-async def head_download_apk(package_name: str):
-    """Return file size without downloading - for size check before download"""
-    for ext in ['.xapk', '.apk', '.apks']:
-        cached_path = os.path.join(DOWNLOADS_DIR, f"{package_name}{ext}")
-        if os.path.exists(cached_path):
-            file_size = os.path.getsize(cached_path)
-            if file_size > 100000:
-                return Response(
-                    content=b"",
-                    headers={
-                        "Content-Length": str(file_size),
-                        "X-File-Type": ext[1:],
-                        "X-Cached": "true"
-                    }
-                )
+async def head_download_apk(package_name: str, request: Request):
+    """Return file size, validators and app metadata from the artifact index without touching the file"""
+    entry = indexed_artifact(package_name)
+    if entry:
+        return artifact_response(
+            request, package_name, entry["path"],
+            {
+                "X-File-Type": os.path.splitext(entry["path"])[1][1:],
+                "X-Cached": "true"
+            },
+            head=True
+        )
     return Response(content=b"", headers={"Content-Length": "0", "X-Cached": "false"})
 
 @app.get("/download/{package_name}")
-async def download_apk(package_name: str, background_tasks: BackgroundTasks, force_apkeep: bool = False, request: Request = None):
+async def download_apk(package_name: str, background_tasks: BackgroundTasks, force_apkeep: bool = False,
+                       tee: Optional[bool] = None, race: Optional[bool] = None, request: Request = None):
     stats["total_requests"] += 1
+    record_package_demand(package_name)
     now = time.time()
     
     force_apkeep_header = False
@@ -1036,104 +3111,165 @@ async def download_apk(package_name: str, background_tasks: BackgroundTasks, for
         force_apkeep_header = True
     
     use_apkeep_only = force_apkeep or force_apkeep_header
+    use_tee = DOWNLOAD_TEE_DEFAULT if tee is None else tee
     
     if package_name in not_found_cache:
-        if now - not_found_cache[package_name] < NOT_FOUND_CACHE_TTL:
-            print(f"[Cache] {package_name} is cached as not found", file=sys.stderr)
-            stats["cache_hits"] += 1
-            raise HTTPException(status_code=404, detail=f"App {package_name} not found (cached)")
-        else:
-            del not_found_cache[package_name]
+        print(f"[Cache] {package_name} is cached as not found", file=sys.stderr)
+        stats["cache_hits"] += 1
+        raise HTTPException(status_code=404, detail=f"App {package_name} not found (cached)")
+    
+    # One-shot aria2c reports no contiguous progress until it exits, so a tee could only serve afterwards
+    if use_tee and not aria2_client:
+        print(f"[Tee] Not streaming {package_name}: aria2 RPC is unavailable, serving after the one-shot download completes", file=sys.stderr)
+        use_tee = False
+    
+    # Range requests resume a finished artifact, so they wait for the download instead of teeing
+    if use_tee and not use_apkeep_only and not (request and request.headers.get("range")):
+        entry = inflight_downloads.get(package_name)
+        if entry is None and not find_cached_artifact(package_name):
+            entry = start_inflight_download(package_name)
+        if entry:
+            response = await stream_inflight_download(package_name, entry)
+            if response:
+                return response
+            if entry.get("busy"):
+                raise retry_later(*entry["busy"])
+            if not entry["final_path"]:
+                raise HTTPException(status_code=404, detail=f"App {package_name} not found")
     
     lock = get_download_lock(package_name)
+    wait_start = time.perf_counter()
     
     async with lock:
+        observe_stage("lock_wait", "download", "success", time.perf_counter() - wait_start)
         if not use_apkeep_only:
-            for ext in ['.xapk', '.apk', '.apks']:
-                cached_path = os.path.join(DOWNLOADS_DIR, f"{package_name}{ext}")
-                if os.path.exists(cached_path):
-                    file_size = os.path.getsize(cached_path)
-                    if file_size > 100000:
-                        print(f"[Cache] Serving cached file: {package_name}", file=sys.stderr)
-                        stats["cache_hits"] += 1
-                        file_type = ext[1:]
-                        return FileResponse(
-                            path=cached_path,
-                            filename=f"{package_name}{ext}",
-                            media_type="application/octet-stream",
-                            headers={
-                                "X-Source": "cache",
-                                "X-File-Type": file_type,
-                                "X-File-Size": str(file_size),
-                                "Cache-Control": "no-cache"
-                            }
-                        )
-        
-        file_path = None
-        source = None
-        
-        if use_apkeep_only:
-            print(f"[Download] Force using apkeep for {package_name}...", file=sys.stderr)
-            loop = asyncio.get_event_loop()
-            file_path = await loop.run_in_executor(
-                None,
-                download_with_apkeep,
-                package_name,
-                DOWNLOADS_DIR
-            )
-            if file_path:
-                source = "apkeep"
-        else:
-            print(f"[Download] Trying APKPure+aria2 for {package_name}...", file=sys.stderr)
-            file_path = await download_from_apkpure(package_name, DOWNLOADS_DIR)
-            if file_path:
-                source = "aria2+apkpure"
-            
-            if not file_path:
-                print(f"[Download] Falling back to apkeep for {package_name}...", file=sys.stderr)
-                loop = asyncio.get_event_loop()
-                file_path = await loop.run_in_executor(
-                    None,
-                    download_with_apkeep,
-                    package_name,
-                    DOWNLOADS_DIR
+            cached_path = cache_lookup_artifact(package_name)
+            if cached_path:
+                file_size = os.path.getsize(cached_path)
+                print(f"[Cache] Serving cached file: {package_name}", file=sys.stderr)
+                stats["cache_hits"] += 1
+                return artifact_response(
+                    request, package_name, cached_path,
+                    {
+                        "X-Source": "cache",
+                        "X-File-Type": os.path.splitext(cached_path)[1][1:],
+                        "X-File-Size": str(file_size)
+                    }
                 )
-                if file_path:
-                    source = "apkeep"
         
-        if not file_path or not os.path.exists(file_path):
-            not_found_cache[package_name] = time.time()
-            stats["not_found"] += 1
-            print(f"[Not Found] {package_name} added to cache for 1 hour", file=sys.stderr)
+        if package_name in not_found_cache:
+            stats["cache_hits"] += 1
+            raise HTTPException(status_code=404, detail=f"App {package_name} not found (cached)")
+        
+        try:
+            file_path, source = await acquire_package(package_name, use_apkeep_only, race=race)
+        except ApkeepQueueFull as e:
+            print(f"[Download] {package_name}: {e}", file=sys.stderr)
+            raise retry_later("Download queue is full, retry later", 30)
+        except SourceUnavailable as e:
+            print(f"[Download] {package_name}: {e}", file=sys.stderr)
+            raise retry_later("Download sources are unavailable, retry later", e.retry_after)
+        
+        if not file_path:
             raise HTTPException(status_code=404, detail=f"App {package_name} not found")
         
         file_size = os.path.getsize(file_path)
         file_type = os.path.splitext(file_path)[1][1:]
-        stats["downloads"] += 1
         
-        deletion_task = asyncio.create_task(schedule_file_deletion(file_path, 60))
-        pending_deletions[package_name] = deletion_task
-        
-        print(f"[Success] {package_name} downloaded via {source}: {file_size/(1024*1024):.1f} MB", file=sys.stderr)
-        
-        return FileResponse(
-            path=file_path,
-            filename=os.path.basename(file_path),
-            media_type="application/octet-stream",
-            headers={
+        return artifact_response(
+            request, package_name, file_path,
+            {
                 "X-Source": source,
                 "X-File-Type": file_type,
-                "X-File-Size": str(file_size),
-                "Cache-Control": "no-cache"
+                "X-File-Size": str(file_size)
             }
         )
 
+@app.post("/jobs/download/{package_name}", status_code=202)
+async def create_download_job(package_name: str, force_apkeep: bool = False, background: bool = False):
+    """Start acquiring a package in the background; poll GET /jobs/{id}, then fetch /download/{package}"""
+    if package_name in not_found_cache:
+        raise HTTPException(status_code=404, detail=f"App {package_name} not found (cached)")
+    
+    if not background:
+        record_package_demand(package_name)
+    priority = APKEEP_PRIORITY_BACKGROUND if background else APKEEP_PRIORITY_INTERACTIVE
+    return describe_job(start_download_job(package_name, force_apkeep, priority))
+
+@app.get("/jobs")
+async def list_download_jobs():
+    return {
+        "stats": job_stats,
+        "active": len(active_jobs),
+        "jobs": [describe_job(job) for job in download_jobs.values()]
+    }
+
+@app.get("/jobs/{job_id}")
+async def get_download_job(job_id: str):
+    job = download_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return describe_job(job)
+
+@app.delete("/jobs/{job_id}")
+async def cancel_download_job(job_id: str):
+    job = download_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    if not job["finished_at"]:
+        job["task"].cancel()
+        try:
+            await job["task"]
+        except asyncio.CancelledError:
+            pass
+    return describe_job(job)
+
+@app.get("/prefetch")
+async def get_prefetch_status():
+    """Hot packages by decayed request count and what the next prefetch cycle would fetch"""
+    now = time.time()
+    return {
+        "enabled": PREFETCH_ENABLED,
+        "running": prefetch_state["running"],
+        "last_cycle": prefetch_state["last_cycle"],
+        "stats": prefetch_stats,
+        "hot": [
+            {
+                "package": name,
+                "score": round(score, 2),
+                "requests": package_demand[name]["requests"],
+                "cached": find_cached_artifact(name) is not None
+            }
+            for name, score in hot_packages(now)
+        ],
+        "pending": prefetch_targets(now)
+    }
+
+@app.post("/prefetch/run", status_code=202)
+async def trigger_prefetch():
+    if prefetch_state["running"]:
+        return {"status": "already_running"}
+    asyncio.create_task(run_prefetch_cycle())
+    return {"status": "started"}
+
 @app.get("/info/{package_name}")
 async def get_info(package_name: str):
     if package_name in not_found_cache:
-        now = time.time()
-        if now - not_found_cache[package_name] < NOT_FOUND_CACHE_TTL:
-            raise HTTPException(status_code=404, detail=f"App {package_name} not found (cached)")
+        raise HTTPException(status_code=404, detail=f"App {package_name} not found (cached)")
+    
+    entry = indexed_artifact(package_name)
+    if entry:
+        return {
+            "package_name": package_name,
+            "status": "cached",
+            "file": os.path.basename(entry["path"]),
+            "file_type": os.path.splitext(entry["path"])[1][1:],
+            "size": entry["size"],
+            "sha256": entry.get("sha256"),
+            "cached_at": datetime.fromtimestamp(entry["created_at"]).isoformat(),
+            "expires_in_minutes": round((entry["ttl"] - (time.time() - entry["created_at"])) / 60, 1),
+            "metadata": entry.get("meta")
+        }
     
     return {
         "package_name": package_name,
@@ -1145,88 +3281,352 @@ async def get_info(package_name: str):
 async def get_not_found_cache():
     now = time.time()
     result = {}
-    for pkg, timestamp in not_found_cache.items():
-        remaining = NOT_FOUND_CACHE_TTL - (now - timestamp)
-        if remaining > 0:
-            result[pkg] = {
-                "cached_at": datetime.fromtimestamp(timestamp).isoformat(),
-                "expires_in_minutes": round(remaining / 60, 1)
-            }
-    return {"not_found_apps": result, "count": len(result)}
+    for pkg, timestamp, expires_at in not_found_cache.items(now):
+        result[pkg] = {
+            "cached_at": datetime.fromtimestamp(timestamp).isoformat(),
+            "expires_in_minutes": round((expires_at - now) / 60, 1)
+        }
+    return {
+        "not_found_apps": result,
+        "count": len(result),
+        "max_entries": NOT_FOUND_CACHE_MAX_ENTRIES,
+        "persistent": not_found_cache.db is not None,
+        "stats": not_found_cache.stats
+    }
 
 @app.delete("/not-found-cache/{package_name}")
 async def remove_from_not_found_cache(package_name: str):
-    if package_name in not_found_cache:
-        del not_found_cache[package_name]
+    if not_found_cache.remove(package_name):
         return {"status": "removed", "package": package_name}
     return {"status": "not_in_cache", "package": package_name}
 
-@app.delete("/cache")
-async def clear_cache():
-    global not_found_cache, file_cache
-    
-    for task in pending_deletions.values():
-        task.cancel()
-    pending_deletions.clear()
-    
+def clear_downloads_dir():
     for filename in os.listdir(DOWNLOADS_DIR):
+        if filename.startswith(STATE_FILE_PREFIXES):
+            continue
         try:
             os.remove(os.path.join(DOWNLOADS_DIR, filename))
         except:
             pass
+
+def downloads_dir_size() -> int:
+    total = 0
+    for filename in os.listdir(DOWNLOADS_DIR):
+        file_path = os.path.join(DOWNLOADS_DIR, filename)
+        if os.path.isfile(file_path):
+            total += os.path.getsize(file_path)
+    return total
+
+@app.delete("/cache")
+async def clear_cache():
+    await asyncio.get_event_loop().run_in_executor(None, clear_downloads_dir)
     
-    not_found_cache = {}
-    file_cache = {}
+    not_found_cache.clear()
+    search_cache.clear()
+    artifact_cache.clear()
+    await save_artifact_index()
     
     return {"status": "cache_cleared"}
 
+@app.get("/cache")
+async def list_artifact_cache():
+    now = time.time()
+    return {
+        "policy": ARTIFACT_CACHE_POLICY,
+        "budget_mb": round(ARTIFACT_CACHE_MAX_BYTES / (1024 * 1024), 1),
+        "used_mb": round(artifact_cache_bytes() / (1024 * 1024), 1),
+        "count": len(artifact_cache),
+        "artifacts": [
+            {
+                "package": entry["package"],
+                "file": os.path.basename(entry["path"]),
+                "size_mb": round(entry["size"] / (1024 * 1024), 1),
+                "hits": entry["hits"],
+                "pinned": entry["pinned"],
+                "version_name": (entry.get("meta") or {}).get("version_name"),
+                "last_access": datetime.fromtimestamp(entry["last_access"]).isoformat(),
+                "expires_in_minutes": round((entry["ttl"] - (now - entry["created_at"])) / 60, 1)
+            }
+            for entry in reversed(artifact_cache.values())
+        ]
+    }
+
+@app.post("/cache/pin/{package_name}")
+async def pin_artifact(package_name: str, ttl: Optional[int] = None):
+    """Pin a package so it is never evicted for space (TTL still applies)"""
+    if package_name not in ARTIFACT_CACHE_PINNED:
+        ARTIFACT_CACHE_PINNED.append(package_name)
+    entry = artifact_cache.get(package_name)
+    if entry:
+        entry["pinned"] = True
+        if ttl:
+            entry["ttl"] = ttl
+        save_artifact_index()
+    return {"status": "pinned", "package": package_name, "cached": entry is not None}
+
+@app.delete("/cache/pin/{package_name}")
+async def unpin_artifact(package_name: str):
+    if package_name in ARTIFACT_CACHE_PINNED:
+        ARTIFACT_CACHE_PINNED.remove(package_name)
+    entry = artifact_cache.get(package_name)
+    if entry:
+        entry["pinned"] = False
+        save_artifact_index()
+    return {"status": "unpinned", "package": package_name}
+
+@app.get("/sources")
+async def get_source_health():
+    return source_health_status()
+
+@app.post("/sources/{name}/reset")
+async def reset_source_health(name: str):
+    health = source_health.get(name)
+    if not health:
+        raise HTTPException(status_code=404, detail=f"Unknown source {name}")
+    health.reset()
+    return {"status": "reset", "source": name}
+
 @app.get("/stats")
 async def get_stats():
+    lookups = artifact_cache_stats["hits"] + artifact_cache_stats["misses"]
     return {
         "stats": stats,
         "cached_not_found": len(not_found_cache),
-        "downloads_dir_size": sum(
-            os.path.getsize(os.path.join(DOWNLOADS_DIR, f))
-            for f in os.listdir(DOWNLOADS_DIR)
-            if os.path.isfile(os.path.join(DOWNLOADS_DIR, f))
-        ) / (1024 * 1024)
+        "fetch_strategy_wins": fetch_host_wins,
+        "search_cache": {
+            **search_cache_stats,
+            "entries": len(search_cache)
+        },
+        "single_flight": {
+            **single_flight_stats,
+            "in_flight": len(inflight_calls)
+        },
+        "apkeep": apkeep_queue_status(),
+        "sources": source_health_status(),
+        "race": {
+            **race_stats,
+            "enabled": DOWNLOAD_RACE_DEFAULT,
+            "bandwidth_in_use_mbps": round(download_bandwidth_in_use() / (1024 * 1024), 2),
+            "bandwidth_budget_mbps": round(DOWNLOAD_BANDWIDTH_BUDGET / (1024 * 1024), 2)
+        },
+        "app_index": {
+            **app_index_stats,
+            **(app_index.stats if app_index is not None else {}),
+            "enabled": app_index is not None,
+            "entries": await app_index_call(len, app_index) if app_index is not None else 0
+        },
+        "extract": {
+            **extract_stats,
+            "entries": len(extract_cache)
+        },
+        "batch": {
+            **batch_stats,
+            "concurrency": BATCH_CONCURRENCY,
+            "max_items": BATCH_MAX_ITEMS
+        },
+        "prefetch": {
+            **prefetch_stats,
+            "tracked_packages": len(package_demand)
+        },
+        "jobs": {
+            **job_stats,
+            "active": len(active_jobs),
+            "retained": len(download_jobs)
+        },
+        "artifact_cache": {
+            **artifact_cache_stats,
+            "hit_ratio": round(artifact_cache_stats["hits"] / lookups, 3) if lookups else 0.0,
+            "entries": len(artifact_cache),
+            "used_mb": round(artifact_cache_bytes() / (1024 * 1024), 1),
+            "budget_mb": round(ARTIFACT_CACHE_MAX_BYTES / (1024 * 1024), 1)
+        },
+        "downloads_dir_size": (await asyncio.get_event_loop().run_in_executor(None, downloads_dir_size)) / (1024 * 1024),
+        "workers": worker_summary()
+    }
+
+def worker_summary() -> Dict[str, Any]:
+    if not worker_board:
+        return {"count": 1, "pids": [os.getpid()]}
+    snapshots = collect_worker_stats()
+    return {
+        "count": len(snapshots),
+        "configured": API_WORKERS,
+        "pids": sorted(snapshots),
+        "totals": worker_totals
     }
 
+SEARCH_STREAM_FORMATS = ("ndjson", "sse")
+
+def tag_apkpure_results(results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    for app in results:
+        app["isMod"] = False
+        app["source"] = "APKPure"
+    return results
+
+def stream_search(query: str, searches: Dict[str, Awaitable[List[Dict[str, Any]]]], fmt: str,
+                  extra: Optional[Dict[str, Any]] = None) -> StreamingResponse:
+    """Send each source's results as soon as that source answers, then a summary record.
+    
+    ``fmt`` is "ndjson" (one JSON object per line) or "sse" (``event: source``
+    per source and ``event: done`` for the summary).
+    """
+    if fmt not in SEARCH_STREAM_FORMATS:
+        for pending in searches.values():
+            pending.close()
+        raise HTTPException(status_code=400, detail=f"stream must be one of: {', '.join(SEARCH_STREAM_FORMATS)}")
+    start = time.perf_counter()
+    
+    def encode(event: str, record: Dict[str, Any]) -> bytes:
+        data = json.dumps(record, ensure_ascii=False)
+        if fmt == "sse":
+            return f"event: {event}\ndata: {data}\n\n".encode()
+        return (data + "\n").encode()
+    
+    async def timed(source: str, search: Awaitable[List[Dict[str, Any]]]) -> Dict[str, Any]:
+        record: Dict[str, Any] = {"source": source}
+        try:
+            results = await search
+            record.update({"count": len(results), "results": results})
+        except SourceUnavailable as e:
+            record.update({"count": 0, "results": [], "error": str(e)})
+        except Exception as e:
+            print(f"[Search] {source} failed while streaming: {e}", file=sys.stderr)
+            record.update({"count": 0, "results": [], "error": str(e)})
+        record["elapsed"] = round(time.perf_counter() - start, 3)
+        return record
+    
+    async def events() -> AsyncIterator[bytes]:
+        tasks = [asyncio.create_task(timed(source, search)) for source, search in searches.items()]
+        timings: Dict[str, Dict[str, Any]] = {}
+        count = 0
+        try:
+            for finished in asyncio.as_completed(tasks):
+                record = await finished
+                count += record["count"]
+                timings[record["source"]] = {"count": record["count"], "elapsed": record["elapsed"]}
+                if "error" in record:
+                    timings[record["source"]]["error"] = record["error"]
+                yield encode("source", record)
+            yield encode("done", {
+                "done": True,
+                "query": query,
+                "count": count,
+                "elapsed": round(time.perf_counter() - start, 3),
+                "sources": timings,
+                **(extra or {})
+            })
+        finally:
+            for task in tasks:
+                task.cancel()
+    
+    media_type = "text/event-stream" if fmt == "sse" else "application/x-ndjson"
+    return StreamingResponse(events(), media_type=media_type, headers={"Cache-Control": "no-cache"})
+
+async def index_fallback(source: str, query: str, num: int, results: List[Dict[str, Any]],
+                         fallbacks: List[str]) -> List[Dict[str, Any]]:
+    """Live results, or what the app index last saw for the query when the source came back empty"""
+    if results or app_index is None:
+        return results
+    indexed = await app_index_call(app_index.search, query, num, sources=[source])
+    if indexed:
+        app_index_stats["fallbacks"] += 1
+        fallbacks.append(source)
+    return indexed
+
+def schedule_index_refresh(query: str, searches: Dict[str, Callable[[], Awaitable[Any]]]):
+    """Run the live searches in the background so the index (and search cache) catch up"""
+    key = normalize_query(query) + ":" + ",".join(sorted(searches))
+    if key in app_index_refreshing:
+        return
+    
+    async def refresh():
+        try:
+            app_index_stats["refreshes"] += 1
+            await asyncio.gather(*(search() for search in searches.values()))
+        except Exception as e:
+            print(f"[AppIndex] Refresh failed for {query!r}: {e}", file=sys.stderr)
+        finally:
+            app_index_refreshing.pop(key, None)
+    
+    app_index_refreshing[key] = asyncio.create_task(refresh())
+
 @app.get("/search")
-async def search_apps(q: str, num: int = 10, combined: bool = True):
-    """Combined search: APKPure (normal) + MODYOLO (مهكرة mods)"""
+async def search_apps(q: str, num: int = 10, combined: bool = True, stream: Optional[str] = None,
+                      local: bool = False, refresh: bool = True, rank: bool = True):
+    """Combined search: APKPure (normal) + MODYOLO (مهكرة mods)
+    
+    Combined results are interleaved by relevance; ``rank=false`` keeps each source's order.
+    With ``stream=ndjson`` or ``stream=sse`` each source is sent as it finishes.
+    With ``local=true`` the answer comes from the app index when it has any
+    match, and unless ``refresh=false`` the live search runs in the background
+    to update it. Sources that return nothing live are filled from the index.
+    """
     if not q or len(q.strip()) == 0:
         raise HTTPException(status_code=400, detail="Search query is required")
     
     query = q.strip()
     
+    if stream:
+        async def tagged_apkpure(limit: int) -> List[Dict[str, Any]]:
+            return tag_apkpure_results(await search_apkpure(query, limit))
+        
+        if not combined:
+            return stream_search(query, {"APKPure": search_apkpure(query, min(num, 20))}, stream)
+        return stream_search(query, {"APKPure": tagged_apkpure(num), "MODYOLO": search_modyolo(query, num)}, stream)
+    
+    normal_num = num if combined else min(num, 20)
+    searches: Dict[str, Callable[[], Awaitable[List[Dict[str, Any]]]]] = {
+        "APKPure": functools.partial(search_apkpure, query, normal_num)
+    }
     if combined:
-        normal_task = asyncio.create_task(search_apkpure(query, num))
-        mod_task = asyncio.create_task(search_modyolo(query, num))
+        searches["MODYOLO"] = functools.partial(search_modyolo, query, num)
+    
+    from_index = False
+    fallbacks: List[str] = []
+    if local and app_index is not None:
+        normal_results = await app_index_call(app_index.search, query, normal_num, sources=["APKPure"])
+        mod_results = await app_index_call(app_index.search, query, num, sources=["MODYOLO"]) if combined else []
+        from_index = bool(normal_results or mod_results)
+    if from_index:
+        app_index_stats["local_answers"] += 1
+        if refresh:
+            schedule_index_refresh(query, searches)
+    elif combined:
+        normal_task = asyncio.create_task(searches["APKPure"]())
+        mod_task = asyncio.create_task(searches["MODYOLO"]())
         
         normal_results, mod_results = await asyncio.gather(normal_task, mod_task)
-        
-        all_results = []
-        for app in normal_results:
-            app["isMod"] = False
-            app["source"] = "APKPure"
-            all_results.append(app)
-        
-        all_results.extend(mod_results)
+        normal_results = await index_fallback("APKPure", query, normal_num, normal_results, fallbacks)
+        mod_results = await index_fallback("MODYOLO", query, num, mod_results, fallbacks)
+    else:
+        normal_results = await index_fallback("APKPure", query, normal_num, await searches["APKPure"](), fallbacks)
+    
+    extra: Dict[str, Any] = {}
+    if from_index:
+        extra["from_index"] = True
+    if fallbacks:
+        extra["index_fallback"] = fallbacks
+    
+    if combined:
+        if rank:
+            all_results = ranking.rank_merged(query, [tag_apkpure_results(normal_results), mod_results])
+        else:
+            all_results = tag_apkpure_results(normal_results) + mod_results
         
         return {
             "query": query,
             "count": len(all_results),
             "normal_count": len(normal_results),
             "mod_count": len(mod_results),
-            "results": all_results
+            "results": all_results,
+            **extra
         }
     else:
-        results = await search_apkpure(query, min(num, 20))
         return {
             "query": query,
-            "count": len(results),
-            "results": results
+            "count": len(normal_results),
+            "results": normal_results,
+            **extra
         }
 
 @app.get("/search-normal")
@@ -1243,60 +3643,82 @@ async def search_normal_apps(q: str, num: int = 10):
         "results": results
     }
 
+async def lookup_app_details(package_name: str) -> Optional[Dict[str, Any]]:
+    """APKPure search result for a package id, preferring an exact appId match"""
+    results = await search_apkpure(package_name, 1)
+    for app in results:
+        if app.get('appId') == package_name:
+            return app
+    return results[0] if results else None
+
 @app.get("/app/{package_name}")
 async def get_app_details(package_name: str):
     """Get app details by package name - search if exact match"""
-    results = await search_apkpure(package_name, 1)
+    details = await lookup_app_details(package_name)
     
-    if not results:
+    if not details:
         raise HTTPException(status_code=404, detail=f"App {package_name} not found")
     
-    exact_match = None
-    for app in results:
-        if app.get('appId') == package_name:
-            exact_match = app
-            break
-    
-    if exact_match:
-        return exact_match
-    
-    return results[0] if results else None
+    return details
+
+def capped_extract(extracted: Dict[str, Any], max_chars: Optional[int]) -> Dict[str, Any]:
+    """Apply the per-request output cap; never more than EXTRACT_MAX_CHARS"""
+    limit = min(max_chars, EXTRACT_MAX_CHARS) if max_chars and max_chars > 0 else EXTRACT_MAX_CHARS
+    content = extracted["content"]
+    return {
+        "content": content[:limit],
+        "length": len(content),
+        "truncated": len(content) > limit,
+        "cache": extracted["cache"]
+    }
 
 @app.get("/extract")
-async def extract_url_content(url: str):
-    """Extract main content from a URL using trafilatura"""
+async def extract_url_content(url: str, max_chars: Optional[int] = None):
+    """Extract main content from a URL using trafilatura (at most ``max_chars`` characters)"""
     if not url:
         raise HTTPException(status_code=400, detail="URL is required")
     
-    content = await extract_content_with_trafilatura(url)
+    extracted = await extract_content_with_trafilatura(url)
     
-    if not content:
+    if not extracted:
         raise HTTPException(status_code=404, detail="Could not extract content from URL")
     
     return {
         "url": url,
-        "content": content
+        **capped_extract(extracted, max_chars)
     }
 
 @app.get("/search-mod")
-async def search_mod_apps(q: str, num: int = 10, source: str = "all"):
-    """Search for modded APKs from MODYOLO + AN1 (مهكرة)"""
+async def search_mod_apps(q: str, num: int = 10, source: str = "all", stream: Optional[str] = None,
+                          rank: bool = True):
+    """Search for modded APKs from MODYOLO + AN1 (مهكرة)
+    
+    Results from both sites are interleaved by relevance; ``rank=false`` keeps each site's order.
+    With ``stream=ndjson`` or ``stream=sse`` each source is sent as it finishes.
+    """
     if not q or len(q.strip()) == 0:
         raise HTTPException(status_code=400, detail="Search query is required")
     
     query = q.strip()
     
+    if stream:
+        return stream_search(query, {"MODYOLO": search_modyolo(query, num), "AN1": search_an1(query, num)}, stream,
+                             {"warning": "⚠️ Modded APKs may contain security risks. Download at your own risk."})
+    
     modyolo_task = asyncio.create_task(search_modyolo(query, num))
     an1_task = asyncio.create_task(search_an1(query, num))
     
     modyolo_results, an1_results = await asyncio.gather(modyolo_task, an1_task)
     
-    all_results = modyolo_results + an1_results
+    if rank:
+        all_results = ranking.rank_merged(query, [modyolo_results, an1_results], limit=num*2)
+    else:
+        all_results = (modyolo_results + an1_results)[:num*2]
     
     return {
         "query": q,
-        "count": len(all_results),
-        "results": all_results[:num*2],
+        "count": len(modyolo_results) + len(an1_results),
+        "results": all_results,
         "sources": ["MODYOLO", "AN1"],
         "warning": "⚠️ Modded APKs may contain security risks. Download at your own risk."
     }
@@ -1381,5 +3803,172 @@ async def get_mod_download_info(url: str, source: str = ""):
         "warning": "⚠️ Modded APKs may contain malware. Install at your own risk."
     }
 
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", "50"))
+# Shared by every batch request so one large batch cannot flood the sources
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", "8"))
+BATCH_SEARCH_SOURCES = {
+    "apkpure": search_apkpure,
+    "modyolo": search_modyolo,
+    "an1": search_an1,
+}
+
+batch_semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+batch_stats = {
+    "requests": 0,
+    "items": 0,
+    "deduplicated": 0,
+    "failed": 0
+}
+
+class BatchSearchRequest(BaseModel):
+    queries: List[str]
+    sources: List[str] = Field(default_factory=lambda: ["apkpure", "modyolo", "an1"])
+    num: int = 10
+    stream: bool = False
+
+class BatchExtractRequest(BaseModel):
+    urls: List[str]
+    max_chars: Optional[int] = None
+    stream: bool = False
+
+class BatchResolveRequest(BaseModel):
+    packages: List[str] = Field(default_factory=list)
+    urls: List[str] = Field(default_factory=list)
+    stream: bool = False
+
+async def _run_batch_item(fn: Callable[[], Awaitable[Any]]) -> Dict[str, Any]:
+    """Run one batch item under the shared budget; failures become per-item statuses"""
+    async with batch_semaphore:
+        start = time.perf_counter()
+        item: Dict[str, Any] = {"status": 200}
+        try:
+            result = await fn()
+            if result is None:
+                item.update({"status": 404, "error": "Not found"})
+            else:
+                item["result"] = result
+        except HTTPException as e:
+            item.update({"status": e.status_code, "error": e.detail})
+        except SourceUnavailable as e:
+            item.update({"status": 503, "error": str(e), "retry_after": round(e.retry_after, 1)})
+        except Exception as e:
+            print(f"[Batch] Item failed: {e}", file=sys.stderr)
+            item.update({"status": 500, "error": str(e)})
+        if item["status"] != 200:
+            batch_stats["failed"] += 1
+        item["elapsed"] = round(time.perf_counter() - start, 3)
+        return item
+
+def run_batch(items: List[Tuple[Dict[str, Any], Any, Callable[[], Awaitable[Any]]]], stream: bool):
+    """Run (description, dedup key, call) items once per distinct key.
+    
+    Returns every item in request order, or with ``stream`` an NDJSON line
+    per item as it completes followed by a summary line.
+    """
+    if len(items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_ITEMS} items per batch")
+    batch_stats["requests"] += 1
+    batch_stats["items"] += len(items)
+    
+    positions: "OrderedDict[Any, List[int]]" = OrderedDict()
+    calls: Dict[Any, Callable[[], Awaitable[Any]]] = {}
+    for index, (_, key, fn) in enumerate(items):
+        positions.setdefault(key, []).append(index)
+        calls.setdefault(key, fn)
+    batch_stats["deduplicated"] += len(items) - len(positions)
+    start = time.perf_counter()
+    
+    def summary() -> Dict[str, Any]:
+        return {"count": len(items), "unique": len(positions), "elapsed": round(time.perf_counter() - start, 3)}
+    
+    def expand(key: Any, outcome: Dict[str, Any]) -> List[Dict[str, Any]]:
+        return [{"index": index, **items[index][0], **outcome} for index in positions[key]]
+    
+    if not stream:
+        async def collect() -> Dict[str, Any]:
+            outcomes = await asyncio.gather(*(_run_batch_item(calls[key]) for key in positions))
+            results: List[Optional[Dict[str, Any]]] = [None] * len(items)
+            for key, outcome in zip(positions, outcomes):
+                for entry in expand(key, outcome):
+                    results[entry["index"]] = entry
+            return {**summary(), "items": results}
+        return collect()
+    
+    async def keyed(key: Any) -> Tuple[Any, Dict[str, Any]]:
+        return key, await _run_batch_item(calls[key])
+    
+    async def lines() -> AsyncIterator[bytes]:
+        tasks = [asyncio.create_task(keyed(key)) for key in positions]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                key, outcome = await finished
+                for entry in expand(key, outcome):
+                    yield (json.dumps(entry, ensure_ascii=False) + "\n").encode()
+            yield (json.dumps({"done": True, **summary()}) + "\n").encode()
+        finally:
+            for task in tasks:
+                task.cancel()
+    
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+@app.post("/batch/search")
+async def batch_search(body: BatchSearchRequest):
+    """Search many queries across several sources in one request"""
+    unknown = [source for source in body.sources if source not in BATCH_SEARCH_SOURCES]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown sources: {', '.join(unknown)}")
+    num = min(body.num, 20)
+    items = []
+    for query in body.queries:
+        if not query.strip():
+            raise HTTPException(status_code=400, detail="Search queries must not be empty")
+        for source in body.sources:
+            items.append((
+                {"query": query, "source": source},
+                (source, normalize_query(query)),
+                functools.partial(BATCH_SEARCH_SOURCES[source], query.strip(), num)
+            ))
+    result = run_batch(items, body.stream)
+    return result if body.stream else await result
+
+async def resolve_mod_url(url: str) -> Optional[Dict[str, Any]]:
+    """Download link for a mod page, dispatched on the site it belongs to"""
+    if url.startswith(AN1_BASE + "/"):
+        info = await get_an1_download_link(url)
+    elif url.startswith(MODYOLO_BASE + "/"):
+        info = await get_modyolo_download_link(url)
+    else:
+        info = await get_mod_download_link(url, urlparse(url).netloc)
+    return info if info and info.get("download_url") else None
+
+@app.post("/batch/resolve")
+async def batch_resolve(body: BatchResolveRequest):
+    """Resolve many package ids (as /app/{id}) and mod page URLs (as /an1-download etc.) in one request"""
+    items = [
+        ({"package": package_name}, ("package", package_name), functools.partial(lookup_app_details, package_name))
+        for package_name in body.packages
+    ] + [
+        ({"url": url}, ("url", url), functools.partial(resolve_mod_url, url))
+        for url in body.urls
+    ]
+    result = run_batch(items, body.stream)
+    return result if body.stream else await result
+
+@app.post("/batch/extract")
+async def batch_extract(body: BatchExtractRequest):
+    """Extract main content from many URLs (as /extract) in one request"""
+    async def extract(url: str) -> Optional[Dict[str, Any]]:
+        extracted = await extract_content_with_trafilatura(url)
+        return capped_extract(extracted, body.max_chars) if extracted else None
+    
+    items = [({"url": url}, url, functools.partial(extract, url)) for url in body.urls]
+    result = run_batch(items, body.stream)
+    return result if body.stream else await result
+
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    if MULTI_WORKER:
+        # Workers re-import this module; a fixed secret lets them all attach to one aria2 daemon
+        os.environ["ARIA2_RPC_SECRET"] = ARIA2_RPC_SECRET
+        uvicorn.run("api_server:app", host="0.0.0.0", port=8000, workers=API_WORKERS)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8000)
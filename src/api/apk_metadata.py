@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""Metadata extraction for downloaded APK/XAPK artifacts.
+
+read_artifact_metadata() opens the ZIP once and returns the file type plus
+what the bot and the cache need to know about the artifact: package id,
+versionName/versionCode, SDK levels, split APKs, OBB files and sizes, and
+native ABIs. XAPKs are described by their manifest.json; plain APKs by
+their binary AndroidManifest.xml. It does blocking I/O, so call it from an
+executor.
+"""
+import json
+import re
+import struct
+import sys
+import zipfile
+from typing import Any, Dict, List, Optional
+
+KNOWN_ABIS = ('arm64-v8a', 'armeabi-v7a', 'armeabi', 'x86_64', 'x86', 'mips64', 'mips')
+LIB_ABI_RE = re.compile(r'^lib/([^/]+)/')
+SPLIT_ABI_RE = re.compile(r'config\.(arm64_v8a|armeabi_v7a|armeabi|x86_64|x86|mips64|mips)$')
+
+# AXML chunk types and the framework resource ids of the attributes we read
+AXML_STRING_POOL = 0x0001
+AXML_RESOURCE_MAP = 0x0180
+AXML_START_ELEMENT = 0x0102
+AXML_UTF8_FLAG = 0x100
+AXML_NO_INDEX = 0xFFFFFFFF
+ATTR_RESOURCE_IDS = {
+    0x0101021b: 'versionCode',
+    0x0101021c: 'versionName',
+    0x0101020c: 'minSdkVersion',
+    0x01010270: 'targetSdkVersion',
+}
+
+def detect_file_type(names: List[str]) -> str:
+    """'xapk' for bundles (manifest.json, nested APKs or OBBs), otherwise 'apk'"""
+    names_lower = [n.lower() for n in names]
+    if 'manifest.json' in names_lower:
+        return 'xapk'
+    if any(n.endswith('.apk') or '.obb' in n for n in names_lower):
+        return 'xapk'
+    return 'apk'
+
+def _read_pool_string(data: bytes, offset: int, utf8: bool) -> str:
+    if utf8:
+        # Character length, then byte length; either may take two bytes
+        offset += 2 if data[offset] & 0x80 else 1
+        length = data[offset]
+        if length & 0x80:
+            length = ((length & 0x7F) << 8) | data[offset + 1]
+            offset += 2
+        else:
+            offset += 1
+        return data[offset:offset + length].decode('utf-8', errors='replace')
+    length = struct.unpack_from('<H', data, offset)[0]
+    offset += 2
+    if length & 0x8000:
+        length = ((length & 0x7FFF) << 16) | struct.unpack_from('<H', data, offset)[0]
+        offset += 2
+    return data[offset:offset + length * 2].decode('utf-16-le', errors='replace')
+
+def _parse_string_pool(data: bytes, offset: int) -> List[str]:
+    header_size, _ = struct.unpack_from('<HI', data, offset + 2)
+    string_count, _, flags, strings_start = struct.unpack_from('<IIII', data, offset + 8)
+    utf8 = bool(flags & AXML_UTF8_FLAG)
+    offsets = struct.unpack_from(f'<{string_count}I', data, offset + header_size)
+    base = offset + strings_start
+    return [_read_pool_string(data, base + string_offset, utf8) for string_offset in offsets]
+
+def parse_binary_manifest(data: bytes) -> Dict[str, Any]:
+    """Package id, version and SDK levels from a compiled AndroidManifest.xml"""
+    info: Dict[str, Any] = {}
+    if len(data) < 8 or struct.unpack_from('<H', data, 0)[0] != 0x0003:
+        return info
+
+    strings: List[str] = []
+    resource_ids: List[int] = []
+    offset = struct.unpack_from('<H', data, 2)[0]
+    while offset + 8 <= len(data):
+        chunk_type, header_size, chunk_size = struct.unpack_from('<HHI', data, offset)
+        if chunk_size < 8:
+            break
+        if chunk_type == AXML_STRING_POOL:
+            strings = _parse_string_pool(data, offset)
+        elif chunk_type == AXML_RESOURCE_MAP:
+            count = (chunk_size - header_size) // 4
+            resource_ids = list(struct.unpack_from(f'<{count}I', data, offset + header_size))
+        elif chunk_type == AXML_START_ELEMENT:
+            name_index = struct.unpack_from('<I', data, offset + 20)[0]
+            element = strings[name_index] if name_index < len(strings) else ''
+            if element in ('manifest', 'uses-sdk'):
+                attr_start, attr_size, attr_count = struct.unpack_from('<HHH', data, offset + 24)
+                for i in range(attr_count):
+                    attr_offset = offset + 16 + attr_start + i * attr_size
+                    _, attr_name, raw_value, _, _, data_type, value = struct.unpack_from('<IIIHBBI', data, attr_offset)
+                    name = ATTR_RESOURCE_IDS.get(resource_ids[attr_name]) if attr_name < len(resource_ids) else None
+                    if not name and attr_name < len(strings):
+                        name = strings[attr_name]
+                    if raw_value != AXML_NO_INDEX and raw_value < len(strings):
+                        info[name] = strings[raw_value]
+                    elif data_type == 0x03 and value < len(strings):
+                        info[name] = strings[value]
+                    elif data_type in (0x10, 0x11):
+                        info[name] = value
+            if element == 'application':
+                break
+        offset += chunk_size
+    return info
+
+def _abis_from_names(names: List[str]) -> List[str]:
+    found = {match.group(1) for match in map(LIB_ABI_RE.match, names) if match}
+    return [abi for abi in KNOWN_ABIS if abi in found]
+
+def _int_or_none(value: Any) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def _describe_xapk(zf: zipfile.ZipFile, meta: Dict[str, Any]):
+    infos = {info.filename: info for info in zf.infolist()}
+    manifest: Dict[str, Any] = {}
+    if 'manifest.json' in infos:
+        try:
+            manifest = json.loads(zf.read('manifest.json'))
+        except ValueError:
+            manifest = {}
+
+    meta.update({
+        "package": manifest.get("package_name"),
+        "label": manifest.get("name"),
+        "version_name": manifest.get("version_name"),
+        "version_code": _int_or_none(manifest.get("version_code")),
+        "min_sdk": _int_or_none(manifest.get("min_sdk_version")),
+        "target_sdk": _int_or_none(manifest.get("target_sdk_version")),
+    })
+
+    splits = manifest.get("split_apks") or [
+        {"file": name, "id": name[:-4]} for name in infos if name.lower().endswith('.apk')
+    ]
+    meta["splits"] = [
+        {
+            "id": split.get("id"),
+            "file": split.get("file"),
+            "size": infos[split["file"]].file_size if split.get("file") in infos else None
+        }
+        for split in splits
+    ]
+    meta["obb"] = [
+        {"file": name, "size": info.file_size}
+        for name, info in infos.items() if name.lower().endswith('.obb')
+    ]
+
+    abis = set()
+    for split in meta["splits"]:
+        match = SPLIT_ABI_RE.search(split["id"] or '')
+        if match:
+            abis.add(match.group(1).replace('_', '-'))
+    # Universal bundles carry native code in the base APK; only peek inside when it is stored uncompressed
+    base = next((s["file"] for s in meta["splits"] if s["id"] == "base" and s["file"] in infos), None)
+    if not abis and base and infos[base].compress_type == zipfile.ZIP_STORED:
+        try:
+            with zf.open(base) as f, zipfile.ZipFile(f) as inner:
+                abis.update(_abis_from_names(inner.namelist()))
+        except (zipfile.BadZipFile, OSError):
+            pass
+    meta["abis"] = [abi for abi in KNOWN_ABIS if abi in abis]
+
+def _describe_apk(zf: zipfile.ZipFile, meta: Dict[str, Any]):
+    names = zf.namelist()
+    manifest: Dict[str, Any] = {}
+    if 'AndroidManifest.xml' in names:
+        try:
+            manifest = parse_binary_manifest(zf.read('AndroidManifest.xml'))
+        except (struct.error, IndexError, UnicodeDecodeError):
+            manifest = {}
+
+    meta.update({
+        "package": manifest.get("package"),
+        "label": None,
+        "version_name": manifest.get("versionName"),
+        "version_code": _int_or_none(manifest.get("versionCode")),
+        "min_sdk": _int_or_none(manifest.get("minSdkVersion")),
+        "target_sdk": _int_or_none(manifest.get("targetSdkVersion")),
+        "splits": [],
+        "obb": [],
+        "abis": _abis_from_names(names)
+    })
+
+def read_artifact_metadata(file_path: str) -> Dict[str, Any]:
+    """Describe an APK/XAPK; unreadable files are reported as an 'apk' with no details"""
+    meta: Dict[str, Any] = {"file_type": "apk"}
+    try:
+        with zipfile.ZipFile(file_path, 'r') as zf:
+            meta["file_type"] = detect_file_type(zf.namelist())
+            if meta["file_type"] == 'xapk':
+                _describe_xapk(zf, meta)
+            else:
+                _describe_apk(zf, meta)
+    except zipfile.BadZipFile:
+        print(f"[Metadata] Not a valid ZIP file: {file_path}", file=sys.stderr)
+    except Exception as e:
+        print(f"[Metadata] Error reading {file_path}: {e}", file=sys.stderr)
+    return meta
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""On-disk full-text index of every app the search scrapers have returned.
+
+AppIndex keeps one row per (source, app) in SQLite with the fields the API
+serves (title, appId, url, icon, version, size) plus the full result record
+and the last time it was seen. Titles and app ids are mirrored into an FTS5
+table with the trigram tokenizer, so substring queries in any script
+(Latin or Arabic) are answered from the index without a tokenizer per
+language. Terms shorter than three characters cannot use trigrams and
+fall back to LIKE filters.
+
+The file uses WAL mode, so several worker processes can share one index.
+"""
+import json
+import sqlite3
+import sys
+import time
+import unicodedata
+from typing import Any, Dict, List, Optional, Sequence
+
+TRIGRAM = 3
+
+SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS apps (
+        id INTEGER PRIMARY KEY,
+        key TEXT UNIQUE NOT NULL,
+        source TEXT NOT NULL,
+        title TEXT NOT NULL,
+        app_id TEXT,
+        url TEXT,
+        icon TEXT,
+        version TEXT,
+        size TEXT,
+        record TEXT NOT NULL,
+        last_seen REAL NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS apps_last_seen ON apps (last_seen)",
+    """CREATE VIRTUAL TABLE IF NOT EXISTS apps_fts USING fts5(
+        title, app_id, content='apps', content_rowid='id', tokenize='trigram'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS apps_ai AFTER INSERT ON apps BEGIN
+        INSERT INTO apps_fts (rowid, title, app_id) VALUES (new.id, new.title, new.app_id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS apps_ad AFTER DELETE ON apps BEGIN
+        INSERT INTO apps_fts (apps_fts, rowid, title, app_id) VALUES ('delete', old.id, old.title, old.app_id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS apps_au AFTER UPDATE ON apps BEGIN
+        INSERT INTO apps_fts (apps_fts, rowid, title, app_id) VALUES ('delete', old.id, old.title, old.app_id);
+        INSERT INTO apps_fts (rowid, title, app_id) VALUES (new.id, new.title, new.app_id);
+    END""",
+)
+
+def _normalize(text: str) -> str:
+    return ' '.join(unicodedata.normalize('NFKC', text).casefold().split())
+
+def _app_key(source: str, record: Dict[str, Any]) -> Optional[str]:
+    identity = record.get('appId') or record.get('url') or record.get('title')
+    return f"{source}:{identity}" if identity else None
+
+def _phrase(term: str) -> str:
+    return '"' + term.replace('"', '""') + '"'
+
+def _like(term: str) -> str:
+    return '%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+class AppIndex:
+    def __init__(self, db_path: str, max_entries: int = 200000):
+        self.max_entries = max_entries
+        self.stats = {"recorded": 0, "queries": 0, "matches": 0, "pruned": 0}
+        self.db: Optional[sqlite3.Connection] = None
+        try:
+            self.db = sqlite3.connect(db_path, isolation_level=None, check_same_thread=False, timeout=5)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            for statement in SCHEMA:
+                self.db.execute(statement)
+        except sqlite3.Error as e:
+            print(f"[AppIndex] Index disabled for {db_path}: {e}", file=sys.stderr)
+            self.db = None
+
+    def record(self, source: str, results: Sequence[Dict[str, Any]], now: Optional[float] = None) -> int:
+        """Upsert search results from one source; returns how many were stored"""
+        if not self.db or not results:
+            return 0
+        now = now or time.time()
+        rows = []
+        for record in results:
+            key = _app_key(source, record)
+            if not key:
+                continue
+            rows.append((
+                key, source, record.get('originalTitle') or record.get('title') or '', record.get('appId'),
+                record.get('url'), record.get('icon'), record.get('version'), record.get('size'),
+                json.dumps(record, ensure_ascii=False), now
+            ))
+        try:
+            self.db.execute("BEGIN")
+            self.db.executemany(
+                "INSERT INTO apps (key, source, title, app_id, url, icon, version, size, record, last_seen) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET title = excluded.title, app_id = excluded.app_id, "
+                "url = excluded.url, icon = excluded.icon, version = excluded.version, size = excluded.size, "
+                "record = excluded.record, last_seen = excluded.last_seen",
+                rows
+            )
+            self.db.execute("COMMIT")
+        except sqlite3.Error as e:
+            print(f"[AppIndex] Write failed: {e}", file=sys.stderr)
+            try:
+                self.db.execute("ROLLBACK")
+            except sqlite3.Error:
+                pass
+            return 0
+        self.stats["recorded"] += len(rows)
+        return len(rows)
+
+    def search(self, query: str, limit: int = 10, sources: Optional[Sequence[str]] = None,
+               max_age: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Best matches for every term of the query, most relevant first.
+
+        Each record is the stored search result plus ``indexedAt`` (when it
+        was last seen). ``max_age`` skips records not seen for that long.
+        """
+        if not self.db:
+            return []
+        terms = _normalize(query).split()
+        if not terms:
+            return []
+        self.stats["queries"] += 1
+        long_terms = [term for term in terms if len(term) >= TRIGRAM]
+        short_terms = [term for term in terms if len(term) < TRIGRAM]
+
+        where: List[str] = []
+        params: List[Any] = []
+        for term in short_terms:
+            where.append("(apps.title LIKE ? ESCAPE '\\' OR apps.app_id LIKE ? ESCAPE '\\')")
+            params.extend([_like(term), _like(term)])
+        if sources:
+            where.append(f"apps.source IN ({', '.join('?' * len(sources))})")
+            params.extend(sources)
+        if max_age:
+            where.append("apps.last_seen >= ?")
+            params.append(time.time() - max_age)
+
+        if long_terms:
+            sql = ("SELECT apps.record, apps.last_seen FROM apps_fts JOIN apps ON apps.id = apps_fts.rowid "
+                   "WHERE apps_fts MATCH ?")
+            params.insert(0, ' AND '.join(_phrase(term) for term in long_terms))
+            order = "bm25(apps_fts), apps.last_seen DESC"
+        else:
+            sql = "SELECT apps.record, apps.last_seen FROM apps WHERE 1"
+            order = "length(apps.title), apps.last_seen DESC"
+        if where:
+            sql += " AND " + " AND ".join(where)
+        sql += f" ORDER BY {order} LIMIT ?"
+        params.append(limit)
+
+        try:
+            rows = self.db.execute(sql, params).fetchall()
+        except sqlite3.Error as e:
+            print(f"[AppIndex] Query failed for {query!r}: {e}", file=sys.stderr)
+            return []
+        results = []
+        for record, last_seen in rows:
+            app = json.loads(record)
+            app["indexedAt"] = last_seen
+            results.append(app)
+        self.stats["matches"] += len(results)
+        return results
+
+    def prune(self) -> int:
+        """Drop the least recently seen apps beyond max_entries"""
+        if not self.db:
+            return 0
+        try:
+            excess = len(self) - self.max_entries
+            if excess <= 0:
+                return 0
+            self.db.execute(
+                "DELETE FROM apps WHERE id IN (SELECT id FROM apps ORDER BY last_seen LIMIT ?)", (excess,)
+            )
+        except sqlite3.Error as e:
+            print(f"[AppIndex] Prune failed: {e}", file=sys.stderr)
+            return 0
+        self.stats["pruned"] += excess
+        return excess
+
+    def __len__(self) -> int:
+        if not self.db:
+            return 0
+        try:
+            return self.db.execute("SELECT COUNT(*) FROM apps").fetchone()[0]
+        except sqlite3.Error:
+            return 0
+
+    def close(self):
+        if self.db:
+            self.db.close()
+            self.db = None
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""Local stand-ins for APKPure, MODYOLO and AN1.
+
+Serves recorded search pages (fixtures/*.html, filled in per query) and
+synthetic APK/XAPK downloads, with configurable latency and bandwidth, so
+api_server can be benchmarked without touching the real sites. Point the
+server at it with:
+
+    APKPURE_SEARCH_BASE=http://127.0.0.1:PORT/apkpure
+    APKPURE_DOWNLOAD_BASE=http://127.0.0.1:PORT/apkpure-d
+    MODYOLO_BASE=http://127.0.0.1:PORT/modyolo
+    AN1_BASE=http://127.0.0.1:PORT/an1
+
+Packages whose name starts with "missing." return 404, like unknown apps.
+"""
+import argparse
+import io
+import os
+import random
+import re
+import sys
+import threading
+import time
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+RANGE_RE = re.compile(r'bytes=(\d*)-(\d*)')
+
+def load_fixture(name: str) -> str:
+    with open(os.path.join(FIXTURES_DIR, name), encoding='utf-8') as f:
+        return f.read()
+
+def render(template: str, **values) -> str:
+    for key, value in values.items():
+        template = template.replace('{' + key + '}', str(value))
+    return template
+
+class FixtureConfig:
+    def __init__(self, latency: float = 0.05, jitter: float = 0.02, results: int = 10,
+                 artifact_size: int = 5 * 1024 * 1024, bandwidth: int = 0, error_rate: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.results = results
+        self.artifact_size = artifact_size
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.templates = {name[:-5]: load_fixture(name) for name in os.listdir(FIXTURES_DIR) if name.endswith('.html')}
+        self.artifacts = {}
+        self.artifacts_lock = threading.Lock()
+        self.hits = {}
+
+    def artifact(self, package_name: str, kind: str) -> bytes:
+        """Deterministic ZIP payload shaped like an XAPK bundle or a plain APK"""
+        key = (package_name, kind)
+        with self.artifacts_lock:
+            if key not in self.artifacts:
+                rng = random.Random(f"{package_name}:{kind}")
+                payload = rng.randbytes(self.artifact_size)
+                buf = io.BytesIO()
+                with zipfile.ZipFile(buf, 'w', zipfile.ZIP_STORED) as zf:
+                    if kind == 'XAPK':
+                        zf.writestr('manifest.json', f'{{"package_name": "{package_name}", "version_name": "1.0.0", "version_code": 1, "split_apks": [{{"file": "{package_name}.apk", "id": "base"}}]}}')
+                        zf.writestr(f'{package_name}.apk', payload)
+                    else:
+                        zf.writestr('AndroidManifest.xml', b'\x03\x00\x08\x00' + package_name.encode())
+                        zf.writestr('classes.dex', payload)
+                self.artifacts[key] = buf.getvalue()
+            return self.artifacts[key]
+
+def make_handler(config: FixtureConfig):
+    class FixtureHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def _delay(self):
+            if config.latency:
+                time.sleep(max(0.0, config.latency + random.uniform(-config.jitter, config.jitter)))
+
+        def _count(self, name: str):
+            config.hits[name] = config.hits.get(name, 0) + 1
+
+        def _send_html(self, body: str):
+            data = body.encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _send_error(self, status: int):
+            self.send_response(status)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def _search_page(self, source: str, query: str) -> str:
+            slug = re.sub(r'[^a-z0-9]+', '-', query.lower()).strip('-') or 'app'
+            title = query.strip().title() or 'App'
+            items = ''.join(
+                render(config.templates[f'{source}_search_item'], slug=slug, title=title, n=n)
+                for n in range(1, config.results + 1)
+            )
+            return render(config.templates[f'{source}_search'], query=query, slug=slug, title=title, items=items)
+
+        def _send_artifact(self, package_name: str, kind: str, head: bool):
+            data = config.artifact(package_name, kind)
+            start, end = 0, len(data) - 1
+            status = 200
+            match = RANGE_RE.match(self.headers.get('Range', ''))
+            if match and (match.group(1) or match.group(2)):
+                if match.group(1):
+                    start = int(match.group(1))
+                    end = int(match.group(2)) if match.group(2) else end
+                else:
+                    start = max(0, len(data) - int(match.group(2)))
+                end = min(end, len(data) - 1)
+                status = 206
+
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Disposition', f'attachment; filename="{package_name}.{kind.lower()}"')
+            self.send_header('Accept-Ranges', 'bytes')
+            self.send_header('Content-Length', str(end - start + 1))
+            if status == 206:
+                self.send_header('Content-Range', f'bytes {start}-{end}/{len(data)}')
+            self.end_headers()
+            if head:
+                return
+
+            chunk_size = 64 * 1024
+            pos = start
+            while pos <= end:
+                chunk = data[pos:min(pos + chunk_size, end + 1)]
+                try:
+                    self.wfile.write(chunk)
+                except (BrokenPipeError, ConnectionResetError):
+                    return
+                pos += len(chunk)
+                if config.bandwidth:
+                    time.sleep(len(chunk) / config.bandwidth)
+
+        def _route(self, head: bool = False):
+            parsed = urlparse(self.path)
+            params = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+            parts = [p for p in parsed.path.split('/') if p]
+            prefix = parts[0] if parts else ''
+            self._count(prefix)
+
+            if config.error_rate and random.random() < config.error_rate:
+                self._delay()
+                return self._send_error(503)
+
+            if prefix == 'apkpure-d' and len(parts) == 4 and parts[1] == 'b':
+                package_name, kind = parts[3], parts[2].upper()
+                if package_name.startswith('missing.') or kind not in ('XAPK', 'APK'):
+                    return self._send_error(404)
+                self._delay()
+                return self._send_artifact(package_name, kind, head)
+
+            self._delay()
+            if prefix == 'apkpure' and parts[1:] == ['search']:
+                return self._send_html(self._search_page('apkpure', params.get('q', '')))
+            if prefix == 'modyolo' and 's' in params:
+                return self._send_html(self._search_page('modyolo', params['s']))
+            if prefix == 'an1' and params.get('do') == 'search':
+                return self._send_html(self._search_page('an1', params.get('story', '')))
+            if prefix == 'hits':
+                return self._send_html(repr(config.hits))
+            return self._send_error(404)
+
+        def do_GET(self):
+            self._route()
+
+        def do_HEAD(self):
+            self._route(head=True)
+
+    return FixtureHandler
+
+def start_fixture_server(config: FixtureConfig, host: str = '127.0.0.1', port: int = 0) -> ThreadingHTTPServer:
+    """Start the fixture server on a background thread; port 0 picks a free port"""
+    server = ThreadingHTTPServer((host, port), make_handler(config))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='fixture-server', daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds added to every page')
+    parser.add_argument('--results', type=int, default=10, help='results per search page')
+    parser.add_argument('--artifact-mb', type=float, default=5, help='size of generated downloads')
+    parser.add_argument('--bandwidth-mbps', type=float, default=0, help='per-connection download cap in MB/s (0 = unlimited)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with 503')
+    args = parser.parse_args()
+
+    config = FixtureConfig(
+        latency=args.latency,
+        results=args.results,
+        artifact_size=int(args.artifact_mb * 1024 * 1024),
+        bandwidth=int(args.bandwidth_mbps * 1024 * 1024),
+        error_rate=args.error_rate
+    )
+    server = start_fixture_server(config, port=args.port)
+    print(f"[Fixtures] Serving on http://127.0.0.1:{server.server_address[1]}", file=sys.stderr)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""Offline benchmark for the APK download API.
+
+Starts the fixture sources (fixture_server.py), puts the fake aria2c/apkeep
+from bin/ on PATH, launches api_server under uvicorn against them with a
+throwaway app_cache, and reports latency percentiles and throughput for:
+
+    search-*    GET /search?q=...
+    mod-*       GET /search-mod?q=...
+    head-*      HEAD /download/{package}
+    download-*  GET /download/{package}
+
+Each endpoint runs in three shapes: cold (every request is a new query or
+package), warm (one primed key requested repeatedly) and herd (a burst of
+identical requests for a new key at the same moment).
+
+    python src/api/benchmark/run_benchmark.py --requests 200 --concurrency 20
+    python src/api/benchmark/run_benchmark.py --only search,download --json bench.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+from fixture_server import FixtureConfig, start_fixture_server
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+API_DIR = os.path.dirname(BENCH_DIR)
+FAKE_BIN_DIR = os.path.join(BENCH_DIR, 'bin')
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+def summarize(name: str, latencies: List[float], errors: int, wall: float) -> Dict[str, Any]:
+    ordered = sorted(latencies)
+    count = len(latencies) + errors
+    return {
+        "scenario": name,
+        "requests": count,
+        "errors": errors,
+        "p50_ms": round(percentile(ordered, 50) * 1000, 1),
+        "p95_ms": round(percentile(ordered, 95) * 1000, 1),
+        "p99_ms": round(percentile(ordered, 99) * 1000, 1),
+        "max_ms": round((ordered[-1] if ordered else 0) * 1000, 1),
+        "throughput_rps": round(count / wall, 1) if wall else 0.0
+    }
+
+async def run_load(client: httpx.AsyncClient, make_request: Callable[[int], Awaitable[httpx.Response]],
+                   total: int, concurrency: int) -> Dict[str, Any]:
+    latencies: List[float] = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i: int):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                response = await make_request(i)
+                if response.status_code >= 400:
+                    errors += 1
+                    return
+            except Exception:
+                errors += 1
+                return
+            latencies.append(time.perf_counter() - start)
+
+    wall_start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    return {"latencies": latencies, "errors": errors, "wall": time.perf_counter() - wall_start}
+
+class Benchmark:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.results: List[Dict[str, Any]] = []
+        self.run_id = int(time.time())
+
+    def key(self, kind: str, i: Any) -> str:
+        return f"{kind}{self.run_id}x{i}"
+
+    async def scenario(self, client: httpx.AsyncClient, name: str, make_request, total: int,
+                       concurrency: int, prime: Optional[Callable[[], Awaitable[Any]]] = None):
+        if prime:
+            await prime()
+        outcome = await run_load(client, make_request, total, concurrency)
+        summary = summarize(name, outcome["latencies"], outcome["errors"], outcome["wall"])
+        self.results.append(summary)
+        print(f"  {name:<22} p50={summary['p50_ms']:>8.1f}ms  p95={summary['p95_ms']:>8.1f}ms  "
+              f"p99={summary['p99_ms']:>8.1f}ms  {summary['throughput_rps']:>7.1f} req/s  errors={summary['errors']}",
+              file=sys.stderr)
+
+    async def run_search(self, client: httpx.AsyncClient, path: str, label: str):
+        n, c = self.args.requests, self.args.concurrency
+        await self.scenario(client, f"{label}-cold",
+                            lambda i: client.get(path, params={"q": self.key(f"{label} cold ", i)}), n, c)
+        warm_query = self.key(f"{label} warm ", 0)
+        await self.scenario(client, f"{label}-warm",
+                            lambda i: client.get(path, params={"q": warm_query}), n, c,
+                            prime=lambda: client.get(path, params={"q": warm_query}))
+        herd_query = self.key(f"{label} herd ", 0)
+        await self.scenario(client, f"{label}-herd",
+                            lambda i: client.get(path, params={"q": herd_query}), c, c)
+
+    async def run_downloads(self, client: httpx.AsyncClient):
+        n, c = self.args.download_requests, self.args.concurrency
+        warm_pkg = f"com.bench.warm{self.run_id}"
+
+        async def prime():
+            await client.get(f"/download/{warm_pkg}")
+
+        if 'head' in self.args.only:
+            await self.scenario(client, "head-cold",
+                                lambda i: client.head(f"/download/com.bench.headcold{self.run_id}x{i}"), n, c)
+            await self.scenario(client, "head-warm",
+                                lambda i: client.head(f"/download/{warm_pkg}"), n, c, prime=prime)
+            herd_pkg = f"com.bench.headherd{self.run_id}"
+            await self.scenario(client, "head-herd",
+                                lambda i: client.head(f"/download/{herd_pkg}"), c, c)
+
+        if 'download' in self.args.only:
+            await self.scenario(client, "download-cold",
+                                lambda i: client.get(f"/download/com.bench.cold{self.run_id}x{i}"), n, c)
+            await self.scenario(client, "download-warm",
+                                lambda i: client.get(f"/download/{warm_pkg}"), n, c, prime=prime)
+            herd_pkg = f"com.bench.herd{self.run_id}"
+            await self.scenario(client, "download-herd",
+                                lambda i: client.get(f"/download/{herd_pkg}"), c, c)
+
+    async def run(self, base_url: str):
+        limits = httpx.Limits(max_connections=self.args.concurrency * 2, max_keepalive_connections=self.args.concurrency)
+        async with httpx.AsyncClient(base_url=base_url, timeout=self.args.timeout, limits=limits) as client:
+            if 'search' in self.args.only:
+                await self.run_search(client, "/search", "search")
+            if 'mod' in self.args.only:
+                await self.run_search(client, "/search-mod", "mod")
+            if 'head' in self.args.only or 'download' in self.args.only:
+                await self.run_downloads(client)
+
+def server_env(args: argparse.Namespace, fixtures_url: str, cache_dir: str) -> Dict[str, str]:
+    env = dict(os.environ)
+    env.update({
+        "PATH": FAKE_BIN_DIR + os.pathsep + env.get("PATH", ""),
+        "APKEEP_PATH": os.path.join(FAKE_BIN_DIR, 'apkeep'),
+        "APP_CACHE_DIR": cache_dir,
+        "APKPURE_SEARCH_BASE": f"{fixtures_url}/apkpure",
+        "APKPURE_DOWNLOAD_BASE": f"{fixtures_url}/apkpure-d",
+        "MODYOLO_BASE": f"{fixtures_url}/modyolo",
+        "AN1_BASE": f"{fixtures_url}/an1",
+        "ARIA2_RPC_PORT": str(free_port()),
+        "FAKE_ARIA2_SPEED": str(int(args.aria2_mbps * 1024 * 1024)),
+        "FAKE_ARIA2_FAIL_RATE": str(args.aria2_fail_rate),
+        "FAKE_APKEEP_SPEED": str(int(args.apkeep_mbps * 1024 * 1024)),
+        "FAKE_APKEEP_FAIL_RATE": str(args.apkeep_fail_rate),
+        "FAKE_APKEEP_SIZE": str(int(args.artifact_mb * 1024 * 1024)),
+        "PYTHONUNBUFFERED": "1",
+    })
+    return env
+
+async def wait_for_server(base_url: str, proc: subprocess.Popen, timeout: float = 60):
+    deadline = time.time() + timeout
+    async with httpx.AsyncClient(base_url=base_url, timeout=2) as client:
+        while time.time() < deadline:
+            if proc.poll() is not None:
+                raise RuntimeError(f"api_server exited with code {proc.returncode}")
+            try:
+                if (await client.get("/")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError("api_server did not start in time")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=100, help='requests per search scenario')
+    parser.add_argument('--download-requests', type=int, default=20, help='requests per download scenario')
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--only', default='search,mod,head,download', help='comma-separated subset of search,mod,head,download')
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--fixture-latency', type=float, default=0.15, help='seconds per fixture page')
+    parser.add_argument('--fixture-error-rate', type=float, default=0.0)
+    parser.add_argument('--artifact-mb', type=float, default=5)
+    parser.add_argument('--aria2-mbps', type=float, default=50, help='fake aria2c speed cap')
+    parser.add_argument('--aria2-fail-rate', type=float, default=0.0)
+    parser.add_argument('--apkeep-mbps', type=float, default=20, help='fake apkeep speed cap')
+    parser.add_argument('--apkeep-fail-rate', type=float, default=0.0)
+    parser.add_argument('--server-arg', action='append', default=[], help='extra uvicorn argument (repeatable)')
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--keep-logs', action='store_true', help='keep the server log and cache dir')
+    args = parser.parse_args()
+    args.only = set(args.only.split(','))
+
+    fixtures = start_fixture_server(FixtureConfig(
+        latency=args.fixture_latency,
+        artifact_size=int(args.artifact_mb * 1024 * 1024),
+        error_rate=args.fixture_error_rate
+    ))
+    fixtures_url = f"http://127.0.0.1:{fixtures.server_address[1]}"
+
+    work_dir = tempfile.mkdtemp(prefix='apkapi-bench-')
+    cache_dir = os.path.join(work_dir, 'app_cache')
+    os.makedirs(cache_dir)
+    log_path = os.path.join(work_dir, 'server.log')
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+
+    print(f"[Bench] Fixtures at {fixtures_url}, server at {base_url}, log {log_path}", file=sys.stderr)
+    with open(log_path, 'w') as log:
+        proc = subprocess.Popen(
+            [sys.executable, '-m', 'uvicorn', 'api_server:app', '--host', '127.0.0.1', '--port', str(port),
+             '--log-level', 'warning', *args.server_arg],
+            cwd=API_DIR, env=server_env(args, fixtures_url, cache_dir), stdout=log, stderr=subprocess.STDOUT
+        )
+        bench = Benchmark(args)
+        try:
+            asyncio.run(wait_for_server(base_url, proc))
+            asyncio.run(bench.run(base_url))
+        finally:
+            proc.terminate()
+            try:
+                proc.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+            fixtures.shutdown()
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({"config": {k: (sorted(v) if isinstance(v, set) else v) for k, v in vars(args).items()},
+                       "results": bench.results}, f, indent=2)
+        print(f"[Bench] Results written to {args.json}", file=sys.stderr)
+    if not args.keep_logs:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
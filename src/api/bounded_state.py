@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""Bounded in-memory state for the download path.
+
+ExpiringSet holds keys with a per-key expiry (the not-found cache). Expiry
+is driven by a min-heap so purging touches only expired keys, the set is
+capped at max_entries by dropping the keys closest to expiry, and it can be
+mirrored to a SQLite file so known misses survive restarts.
+
+With shared=True the SQLite file is the only copy, so several worker
+processes see each other's entries. Lookups are remembered for lookup_ttl
+seconds, so hot keys do not hit SQLite on every membership test and
+another worker's additions show up within that delay.
+
+KeyedLockTable hands out one asyncio.Lock per key and forgets the lock once
+nobody holds or waits for it, so scanning random package names does not
+leave a lock behind for each of them. Given a lock_dir (which the caller
+creates) it also takes a per-key file lock, serialising the key across
+processes.
+"""
+import asyncio
+import heapq
+import os
+import sqlite3
+import sys
+import time
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import coordination
+
+class ExpiringSet:
+    def __init__(self, ttl: float, max_entries: int, db_path: Optional[str] = None, shared: bool = False,
+                 lookup_ttl: float = 5.0):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.shared = shared
+        self.lookup_ttl = lookup_ttl
+        self.entries: Dict[str, Tuple[float, float]] = {}
+        self.heap: List[Tuple[float, str]] = []
+        # Shared mode: key -> (entry or None, when it was read)
+        self.lookups: "OrderedDict[str, Tuple[Optional[Tuple[float, float]], float]]" = OrderedDict()
+        self.stats = {"added": 0, "expired": 0, "evicted": 0}
+        self.db: Optional[sqlite3.Connection] = None
+        if db_path:
+            self.open(db_path)
+
+    def open(self, db_path: str, shared: Optional[bool] = None):
+        """Persist to db_path, loading entries saved by earlier runs unless shared"""
+        if shared is not None:
+            self.shared = shared
+        try:
+            self.db = sqlite3.connect(db_path, isolation_level=None, check_same_thread=False, timeout=5)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, cached_at REAL NOT NULL, expires_at REAL NOT NULL)"
+            )
+            now = time.time()
+            self.db.execute("DELETE FROM entries WHERE expires_at <= ?", (now,))
+            if self.shared:
+                return
+            rows = self.db.execute(
+                "SELECT key, cached_at, expires_at FROM entries ORDER BY expires_at DESC LIMIT ?", (self.max_entries,)
+            ).fetchall()
+            for key, cached_at, expires_at in rows:
+                self.entries[key] = (cached_at, expires_at)
+                self.heap.append((expires_at, key))
+            heapq.heapify(self.heap)
+        except sqlite3.Error as e:
+            print(f"[ExpiringSet] Persistence disabled for {db_path}: {e}", file=sys.stderr)
+            self.db = None
+            self.shared = False
+
+    def _persist(self, sql: str, params: tuple = ()):
+        if not self.db:
+            return
+        try:
+            self.db.execute(sql, params)
+        except sqlite3.Error as e:
+            print(f"[ExpiringSet] Write failed: {e}", file=sys.stderr)
+
+    def _query(self, sql: str, params: tuple = ()) -> list:
+        try:
+            return self.db.execute(sql, params).fetchall()
+        except sqlite3.Error as e:
+            print(f"[ExpiringSet] Read failed: {e}", file=sys.stderr)
+            return []
+
+    def _remember(self, key: str, entry: Optional[Tuple[float, float]], now: float):
+        self.lookups[key] = (entry, now)
+        self.lookups.move_to_end(key)
+        while len(self.lookups) > self.max_entries:
+            self.lookups.popitem(last=False)
+
+    def add(self, key: str, ttl: Optional[float] = None, now: Optional[float] = None):
+        now = now or time.time()
+        expires_at = now + (ttl or self.ttl)
+        if self.shared:
+            self.stats["added"] += 1
+            self._remember(key, (now, expires_at), now)
+            self._persist("INSERT OR REPLACE INTO entries VALUES (?, ?, ?)", (key, now, expires_at))
+            return
+        self.entries[key] = (now, expires_at)
+        heapq.heappush(self.heap, (expires_at, key))
+        self.stats["added"] += 1
+        self._persist("INSERT OR REPLACE INTO entries VALUES (?, ?, ?)", (key, now, expires_at))
+
+        self.purge(now)
+        while len(self.entries) > self.max_entries:
+            self._pop_soonest(evicted=True)
+        # Lazy deletion leaves stale heap nodes behind re-added keys; rebuild when they dominate
+        if len(self.heap) > 2 * len(self.entries) + 64:
+            self.heap = [(expires, k) for k, (_, expires) in self.entries.items()]
+            heapq.heapify(self.heap)
+
+    def _pop_soonest(self, evicted: bool = False) -> Optional[str]:
+        while self.heap:
+            expires_at, key = heapq.heappop(self.heap)
+            entry = self.entries.get(key)
+            if entry and entry[1] == expires_at:
+                del self.entries[key]
+                self.stats["evicted" if evicted else "expired"] += 1
+                self._persist("DELETE FROM entries WHERE key = ? AND expires_at = ?", (key, expires_at))
+                return key
+        return None
+
+    def purge(self, now: Optional[float] = None) -> int:
+        """Drop expired keys; costs O(log n) per expired key"""
+        now = now or time.time()
+        if self.shared:
+            return self._purge_shared(now)
+        removed = 0
+        while self.heap and self.heap[0][0] <= now:
+            expires_at, key = self.heap[0]
+            entry = self.entries.get(key)
+            if entry and entry[1] == expires_at:
+                self._pop_soonest()
+                removed += 1
+            else:
+                heapq.heappop(self.heap)
+        return removed
+
+    def _purge_shared(self, now: float) -> int:
+        """Expire and trim the shared table; run periodically rather than per add"""
+        expired = self._query("SELECT COUNT(*) FROM entries WHERE expires_at <= ?", (now,))
+        self._persist("DELETE FROM entries WHERE expires_at <= ?", (now,))
+        excess = len(self) - self.max_entries
+        if excess > 0:
+            self._persist(
+                "DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY expires_at LIMIT ?)", (excess,)
+            )
+            self.stats["evicted"] += excess
+        removed = expired[0][0] if expired else 0
+        self.stats["expired"] += removed
+        return removed
+
+    def get(self, key: str, now: Optional[float] = None) -> Optional[float]:
+        """Time the key was added, or None if absent or expired"""
+        now = now or time.time()
+        if self.shared:
+            remembered = self.lookups.get(key)
+            if remembered and now - remembered[1] < self.lookup_ttl:
+                entry = remembered[0]
+            else:
+                rows = self._query("SELECT cached_at, expires_at FROM entries WHERE key = ?", (key,))
+                entry = tuple(rows[0]) if rows else None
+                self._remember(key, entry, now)
+        else:
+            entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] <= now:
+            self.remove(key)
+            self.stats["expired"] += 1
+            return None
+        return entry[0]
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key) is not None
+
+    def remove(self, key: str) -> bool:
+        if self.shared:
+            self._remember(key, None, time.time())
+            if not self._query("SELECT 1 FROM entries WHERE key = ?", (key,)):
+                return False
+        elif self.entries.pop(key, None) is None:
+            return False
+        self._persist("DELETE FROM entries WHERE key = ?", (key,))
+        return True
+
+    def clear(self):
+        self.entries.clear()
+        self.heap.clear()
+        self.lookups.clear()
+        self._persist("DELETE FROM entries")
+
+    def items(self, now: Optional[float] = None) -> Iterator[Tuple[str, float, float]]:
+        """Live (key, cached_at, expires_at) tuples"""
+        now = now or time.time()
+        if self.shared:
+            yield from self._query("SELECT key, cached_at, expires_at FROM entries WHERE expires_at > ?", (now,))
+            return
+        for key, (cached_at, expires_at) in list(self.entries.items()):
+            if expires_at > now:
+                yield key, cached_at, expires_at
+
+    def __len__(self) -> int:
+        if self.shared:
+            rows = self._query("SELECT COUNT(*) FROM entries")
+            return rows[0][0] if rows else 0
+        return len(self.entries)
+
+    def close(self):
+        if self.db:
+            self.db.close()
+            self.db = None
+
+class _KeyedLock:
+    def __init__(self, table: "KeyedLockTable", key: str):
+        self.table = table
+        self.key = key
+
+    async def __aenter__(self):
+        entry = self.table.locks.get(self.key)
+        if entry is None:
+            entry = self.table.locks[self.key] = [asyncio.Lock(), 0, None]
+        entry[1] += 1
+        try:
+            await entry[0].acquire()
+        except BaseException:
+            self.table._release_ref(self.key, entry)
+            raise
+        if self.table.lock_dir:
+            try:
+                entry[2] = await coordination.acquire_file_lock(self.table.lock_path(self.key))
+            except BaseException:
+                entry[0].release()
+                self.table._release_ref(self.key, entry)
+                raise
+        return self
+
+    async def __aexit__(self, *exc_info):
+        entry = self.table.locks[self.key]
+        if entry[2] is not None:
+            coordination.release_file_lock(self.table.lock_path(self.key), entry[2])
+            entry[2] = None
+        entry[0].release()
+        self.table._release_ref(self.key, entry)
+
+class KeyedLockTable:
+    """One asyncio.Lock per key, dropped when its last holder or waiter leaves"""
+    def __init__(self, lock_dir: Optional[str] = None):
+        self.locks: Dict[str, list] = {}
+        self.lock_dir = lock_dir
+
+    def lock_path(self, key: str) -> str:
+        return os.path.join(self.lock_dir, key.replace(os.sep, '_') + '.lock')
+
+    def __call__(self, key: str) -> _KeyedLock:
+        return _KeyedLock(self, key)
+
+    def _release_ref(self, key: str, entry: list):
+        entry[1] -= 1
+        if entry[1] == 0 and self.locks.get(key) is entry:
+            del self.locks[key]
+
+    def locked(self, key: str) -> bool:
+        """Held by this process, or by another process when file locks are in use"""
+        entry = self.locks.get(key)
+        if entry and entry[0].locked():
+            return True
+        return bool(self.lock_dir) and coordination.file_lock_held(self.lock_path(key))
+
+    def locked_count(self) -> int:
+        return sum(1 for lock, _, _ in self.locks.values() if lock.locked())
+
+    def __len__(self) -> int:
+        return len(self.locks)
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""Coordination between uvicorn worker processes sharing one app_cache.
+
+File locks (flock) serialise downloads of a package across processes and
+elect a single worker for background duties; WorkerStatsBoard lets every
+worker publish its counters to a SQLite file so any worker can report the
+totals. On platforms without fcntl the locks degrade to process-local.
+"""
+import asyncio
+import contextlib
+import json
+import os
+import sqlite3
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+FILE_LOCK_POLL_MIN = 0.05
+FILE_LOCK_POLL_MAX = 0.5
+
+def _try_flock(path: str) -> Optional[int]:
+    """Open and exclusively lock path without blocking; None if another process holds it"""
+    while True:
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        # The previous holder unlinks the file on release; a lock on the orphaned inode guards nothing
+        try:
+            if os.fstat(fd).st_ino == os.stat(path).st_ino:
+                return fd
+        except FileNotFoundError:
+            pass
+        os.close(fd)
+
+async def acquire_file_lock(path: str) -> Optional[int]:
+    """Exclusive cross-process lock on path, polled with backoff so the event loop never blocks"""
+    if fcntl is None:
+        return None
+    delay = FILE_LOCK_POLL_MIN
+    while True:
+        fd = _try_flock(path)
+        if fd is not None:
+            return fd
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, FILE_LOCK_POLL_MAX)
+
+def release_file_lock(path: str, fd: Optional[int]):
+    if fd is None:
+        return
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+    fcntl.flock(fd, fcntl.LOCK_UN)
+    os.close(fd)
+
+def file_lock_held(path: str) -> bool:
+    """Whether some process currently holds the lock at path"""
+    if fcntl is None or not os.path.exists(path):
+        return False
+    try:
+        fd = os.open(path, os.O_RDWR)
+    except FileNotFoundError:
+        return False
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return True
+    finally:
+        os.close(fd)
+    return False
+
+@contextlib.contextmanager
+def locked_file(path: str):
+    """Blocking cross-process lock for short critical sections such as rewriting a shared file"""
+    if fcntl is None:
+        yield
+        return
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+def claim_leadership(path: str) -> Optional[int]:
+    """Hold a lock for the life of the process; returns the fd if this worker is the leader.
+
+    Without fcntl every worker is its own leader.
+    """
+    if fcntl is None:
+        return -1
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return fd
+    except BlockingIOError:
+        os.close(fd)
+        return None
+
+class WorkerStatsBoard:
+    """Per-worker counter snapshots in SQLite, summed on read"""
+    def __init__(self, db_path: str):
+        self.db = sqlite3.connect(db_path, isolation_level=None, check_same_thread=False, timeout=5)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS worker_stats (pid INTEGER PRIMARY KEY, updated_at REAL NOT NULL, payload TEXT NOT NULL)"
+        )
+
+    def publish(self, snapshot: Dict[str, Dict[str, Any]]):
+        try:
+            self.db.execute(
+                "INSERT OR REPLACE INTO worker_stats VALUES (?, ?, ?)",
+                (os.getpid(), time.time(), json.dumps(snapshot))
+            )
+        except sqlite3.Error as e:
+            print(f"[Workers] Failed to publish stats: {e}", file=sys.stderr)
+
+    def collect(self, max_age: float) -> Dict[int, Dict[str, Dict[str, Any]]]:
+        """Snapshots of workers that published within max_age seconds"""
+        try:
+            rows = self.db.execute(
+                "SELECT pid, payload FROM worker_stats WHERE updated_at >= ?", (time.time() - max_age,)
+            ).fetchall()
+        except sqlite3.Error as e:
+            print(f"[Workers] Failed to read stats: {e}", file=sys.stderr)
+            return {}
+        return {pid: json.loads(payload) for pid, payload in rows}
+
+    def retire(self):
+        try:
+            self.db.execute("DELETE FROM worker_stats WHERE pid = ?", (os.getpid(),))
+        except sqlite3.Error:
+            pass
+        self.db.close()
+
+    @staticmethod
+    def aggregate(snapshots: List[Dict[str, Dict[str, Any]]]) -> Dict[str, Dict[str, float]]:
+        totals: Dict[str, Dict[str, float]] = {}
+        for snapshot in snapshots:
+            for group, values in snapshot.items():
+                group_totals = totals.setdefault(group, {})
+                for name, value in values.items():
+                    if isinstance(value, (int, float)) and not isinstance(value, bool):
+                        group_totals[name] = group_totals.get(name, 0) + value
+        return totals
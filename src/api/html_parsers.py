@@ -0,0 +1,417 @@
+#!/usr/bin/env python3
+"""HTML parsers for the scraped sources.
+
+These are plain functions of an HTML string that return compact dicts, so
+api_server can run them in its parse worker pool (threads or processes)
+instead of on the event loop. Keep this module free of server state: worker
+processes import it on their own.
+"""
+import re
+from typing import Optional, Dict, Any, List
+from bs4 import BeautifulSoup, SoupStrainer
+import trafilatura
+
+PARSER = 'lxml'
+
+MODYOLO_APP_LINK_RE = re.compile(r'modyolo\.com/[^/]+\.html')
+MODYOLO_DOWNLOAD_PAGE_RE = re.compile(r'/download/[^/]+-\d+')
+MODYOLO_FINAL_LINK_RE = re.compile(r'/download/[^/]+-\d+/\d+')
+AN1_APP_LINK_RE = re.compile(r'an1\.com/\d+-[^/]+\.html')
+AN1_APP_ID_RE = re.compile(r'/(\d+)-([^/]+)\.html')
+AN1_FILE_LINK_RE = re.compile(r'(https://files\.an1\.(?:co|net)/[^"\'<>\s]+\.apk)')
+AN1_FILE_HREF_RE = re.compile(r'href=["\']([^"\']*files\.an1\.co[^"\']+\.apk)["\']')
+AN1_VERSION_RE = re.compile(r'[\d.]+(?=\.apk|[_-]an1)')
+AN1_SIZE_RE = re.compile(r'([\d.]+)\s*(?:Mb|MB|Gb|GB)')
+DEVELOPER_TEXT_RE = re.compile(r'^[A-Z][\w\s]+$')
+RATING_CLASS_RE = re.compile(r'rating|score')
+NUMBER_RE = re.compile(r'[\d.]+')
+VERSION_RE = re.compile(r'(\d+\.\d+(?:\.\d+)*)')
+SIZE_RE = re.compile(r'(\d+(?:\.\d+)?\s*(?:MB|GB|M|G))', re.IGNORECASE)
+MOD_INFO_RE = re.compile(r'(Unlimited|Premium|Unlocked|Mega Menu|VIP|Pro|Full|Mod|Menu)[^\n]*', re.IGNORECASE)
+TITLE_VERSION_RE = re.compile(r'\s*v?\d+\.\d+[^\s]*')
+TITLE_SUFFIX_RE = re.compile(r'\s*\+\s*\d+.*$')
+WHITESPACE_RE = re.compile(r'\s+')
+
+MODYOLO_DOWNLOAD_PAGE_STRAINER = SoupStrainer('a', href=MODYOLO_DOWNLOAD_PAGE_RE)
+MODYOLO_FINAL_LINK_STRAINER = SoupStrainer('a', href=MODYOLO_FINAL_LINK_RE)
+APKPURE_SEARCH_STRAINER = SoupStrainer(['div', 'ul'], class_=re.compile(r'(^|\s)(first|search-res)(\s|$)'))
+
+def parse_modyolo_search(html: str) -> List[Dict[str, Any]]:
+    """App cards from a MODYOLO search page, with a lowercase title for matching"""
+    soup = BeautifulSoup(html, PARSER)
+    all_apps = []
+    seen_urls = set()
+
+    for a in soup.find_all('a', href=MODYOLO_APP_LINK_RE):
+        href = str(a.get('href', '') or '')
+        if not href or href in seen_urls:
+            continue
+        if '/download/' in href or '/?s=' in href:
+            continue
+        seen_urls.add(href)
+
+        title = str(a.get_text(strip=True) or '')
+        if not title or len(title) < 2:
+            continue
+
+        parent = a.find_parent(['div', 'li', 'article'])
+        img = a.find('img') or (parent.find('img') if parent else None)
+        icon = ''
+        if img:
+            icon = str(img.get('src') or img.get('data-src') or '')
+
+        version = ''
+        size = ''
+        mod_info = ''
+        if parent:
+            text = parent.get_text()
+            version_match = VERSION_RE.search(text)
+            if version_match:
+                version = version_match.group(1)
+            size_match = SIZE_RE.search(text)
+            if size_match:
+                size = size_match.group(1)
+            mod_match = MOD_INFO_RE.search(text)
+            if mod_match:
+                mod_info = mod_match.group(0).strip()
+
+        clean_title = TITLE_VERSION_RE.sub('', title)
+        clean_title = TITLE_SUFFIX_RE.sub('', clean_title)
+        clean_title = WHITESPACE_RE.sub(' ', clean_title).strip()
+
+        all_apps.append({
+            "title": clean_title,
+            "url": href,
+            "icon": icon,
+            "source": "MODYOLO",
+            "isMod": True,
+            "version": version,
+            "size": size,
+            "modInfo": mod_info,
+            "originalTitle": title,
+            "title_lower": clean_title.lower()
+        })
+
+    return all_apps
+
+def parse_modyolo_app_page(html: str) -> Optional[str]:
+    """Link to the download page from a MODYOLO app page"""
+    soup = BeautifulSoup(html, PARSER, parse_only=MODYOLO_DOWNLOAD_PAGE_STRAINER)
+    for link in soup.find_all('a'):
+        href = str(link.get('href', '') or '')
+        if href:
+            if not href.startswith('http'):
+                href = 'https://modyolo.com' + href
+            return href
+    return None
+
+def parse_modyolo_download_page(html: str) -> Optional[Dict[str, str]]:
+    """First final download link (and its size label) from a MODYOLO download page"""
+    soup = BeautifulSoup(html, PARSER, parse_only=MODYOLO_FINAL_LINK_STRAINER)
+    final_links = soup.find_all('a')
+    if not final_links:
+        return None
+
+    first_link = str(final_links[0].get('href', '') or '')
+    if first_link and not first_link.startswith('http'):
+        first_link = 'https://modyolo.com' + first_link
+
+    size_text = str(final_links[0].get_text() or '')
+    size_match = SIZE_RE.search(size_text)
+    return {
+        "download_url": first_link,
+        "size": size_match.group(1) if size_match else ''
+    }
+
+def parse_an1_search(html: str, num_results: int = 10) -> List[Dict[str, Any]]:
+    soup = BeautifulSoup(html, PARSER)
+    results = []
+    seen_urls = set()
+
+    for a in soup.find_all('a', href=AN1_APP_LINK_RE):
+        if len(results) >= num_results:
+            break
+
+        href = a.get('href', '')
+        if not href or href in seen_urls:
+            continue
+        seen_urls.add(href)
+
+        title = a.get('title') or a.get_text(strip=True)
+        if not title or len(title) < 3:
+            continue
+
+        id_match = AN1_APP_ID_RE.search(href)
+        if not id_match:
+            continue
+
+        app_id = id_match.group(1)
+
+        parent = a.find_parent(['div', 'li', 'article'])
+        img = a.find('img') or (parent.find('img') if parent else None)
+        icon = ''
+        if img:
+            icon = img.get('src') or img.get('data-src') or ''
+
+        developer = ''
+        if parent:
+            dev_el = parent.find(string=DEVELOPER_TEXT_RE)
+            if dev_el:
+                developer = str(dev_el).strip()
+
+        rating = 0.0
+        if parent:
+            rating_el = parent.find(class_=RATING_CLASS_RE)
+            if rating_el:
+                try:
+                    rating = float(NUMBER_RE.search(rating_el.get_text()).group())
+                except:
+                    pass
+
+        size_match = AN1_SIZE_RE.search(str(parent) if parent else '')
+        size = size_match.group(0) if size_match else ''
+
+        results.append({
+            "title": title + " (مهكرة)",
+            "originalTitle": title,
+            "url": href if href.startswith('http') else f"https://an1.com{href}",
+            "appId": app_id,
+            "icon": icon,
+            "developer": developer,
+            "rating": rating,
+            "size": size,
+            "source": "AN1",
+            "isMod": True
+        })
+
+    return results
+
+def parse_an1_download_page(html: str) -> Optional[Dict[str, str]]:
+    """Direct file link from an AN1 download page, skipping AN1 Store installers"""
+    for link in AN1_FILE_LINK_RE.findall(html):
+        if 'an1store' not in link.lower():
+            size_match = AN1_SIZE_RE.search(html)
+            version_match = AN1_VERSION_RE.search(link)
+            return {
+                "download_url": link,
+                "size": size_match.group(0) if size_match else '',
+                "version": version_match.group(0) if version_match else ''
+            }
+
+    dl_match = AN1_FILE_HREF_RE.search(html)
+    if dl_match and 'an1store' not in dl_match.group(1).lower():
+        return {"download_url": dl_match.group(1)}
+    return None
+
+def parse_mod_source_search(html: str, source_name: str, base_url: str, num_results: int = 10) -> List[Dict[str, Any]]:
+    soup = BeautifulSoup(html, PARSER)
+    results = []
+
+    if source_name == "APKMody":
+        items = soup.select('article.post, .search-result-item, .game-item')[:num_results]
+        for item in items:
+            title_el = item.select_one('h2 a, h3 a, .title a, a.title')
+            if title_el:
+                title = title_el.get_text(strip=True)
+                link = title_el.get('href', '')
+                if link and not link.startswith('http'):
+                    link = base_url + link
+
+                img_el = item.select_one('img')
+                icon = img_el.get('src', '') if img_el else ''
+
+                desc_el = item.select_one('.excerpt, .description, p')
+                desc = desc_el.get_text(strip=True)[:100] if desc_el else ''
+
+                results.append({
+                    "title": title,
+                    "source": source_name,
+                    "url": link,
+                    "icon": icon,
+                    "description": desc,
+                    "isMod": True
+                })
+
+    elif source_name == "MODDED1":
+        items = soup.select('article.post, .post-item, .game-card')[:num_results]
+        for item in items:
+            title_el = item.select_one('h2 a, h3 a, .entry-title a, a.title')
+            if title_el:
+                title = title_el.get_text(strip=True)
+                link = title_el.get('href', '')
+                if link and not link.startswith('http'):
+                    link = base_url + link
+
+                img_el = item.select_one('img')
+                icon = img_el.get('data-src', '') or img_el.get('src', '') if img_el else ''
+
+                if 'mod' in title.lower() or 'apk' in title.lower():
+                    results.append({
+                        "title": title,
+                        "source": source_name,
+                        "url": link,
+                        "icon": icon,
+                        "description": "",
+                        "isMod": True
+                    })
+
+    elif source_name == "HAPPYMOD":
+        items = soup.select('.pdt-app-box, .app-item, .search-item')[:num_results]
+        for item in items:
+            title_el = item.select_one('h3, .app-name, .title, a')
+            if title_el:
+                title = title_el.get_text(strip=True)
+                link_el = item.select_one('a[href]')
+                link = link_el.get('href', '') if link_el else ''
+                if link and not link.startswith('http'):
+                    link = base_url + link
+
+                img_el = item.select_one('img')
+                icon = img_el.get('data-src', '') or img_el.get('src', '') if img_el else ''
+
+                results.append({
+                    "title": title,
+                    "source": source_name,
+                    "url": link,
+                    "icon": icon,
+                    "description": "",
+                    "isMod": True
+                })
+
+    return results
+
+def parse_mod_download_page(html: str) -> Dict[str, Any]:
+    soup = BeautifulSoup(html, PARSER)
+
+    download_link = None
+    file_info = {}
+
+    download_buttons = soup.select('a[href*="download"], a.download-btn, .download-link a, a[class*="download"]')
+    for btn in download_buttons:
+        href = btn.get('href', '')
+        if href and ('.apk' in href.lower() or 'download' in href.lower()):
+            download_link = href
+            break
+
+    if not download_link:
+        download_containers = soup.select('.download-box, .download-area, #download')
+        for container in download_containers:
+            link = container.select_one('a[href]')
+            if link:
+                download_link = link.get('href')
+                break
+
+    size_el = soup.select_one('.file-size, .size, [class*="size"]')
+    if size_el:
+        file_info['size'] = size_el.get_text(strip=True)
+
+    version_el = soup.select_one('.version, [class*="version"]')
+    if version_el:
+        file_info['version'] = version_el.get_text(strip=True)
+
+    return {
+        "download_url": download_link,
+        "file_info": file_info
+    }
+
+def _extract_apkpure_app_id(href: str) -> Optional[str]:
+    if href.startswith('https://apkpure.com/'):
+        href = href.replace('https://apkpure.com', '')
+    elif href.startswith('https://m.apkpure.com/'):
+        href = href.replace('https://m.apkpure.com', '')
+    if not href.startswith('/'):
+        return None
+    parts = [p for p in href.strip('/').split('/') if p]
+    if len(parts) >= 2:
+        potential_id = parts[-1]
+        if 'download' in potential_id.lower():
+            return None
+        if '.' in potential_id and potential_id.count('.') >= 1:
+            return potential_id
+    return None
+
+def _apkpure_app_name(href: str, container) -> tuple:
+    p1 = container.find('p', class_='p1')
+    p2 = container.find('p', class_='p2')
+    app_name = p1.get_text(strip=True) if p1 else None
+    developer = p2.get_text(strip=True) if p2 else ''
+
+    if not app_name:
+        parts = [p for p in href.strip('/').split('/') if p]
+        app_slug = parts[0] if parts else ''
+        app_name = app_slug.replace('-', ' ').title()
+    return app_name, developer
+
+def parse_apkpure_search(html: str, num_results: int = 10) -> List[Dict[str, Any]]:
+    """Featured result plus the result list from the APKPure mobile search page"""
+    soup = BeautifulSoup(html, PARSER, parse_only=APKPURE_SEARCH_STRAINER)
+    apps = []
+    seen_ids = set()
+
+    first_app = soup.find('div', class_='first')
+    if first_app:
+        link = first_app.find('a', href=True)
+        if link:
+            href = link.get('href', '')
+            app_id = _extract_apkpure_app_id(href)
+            if app_id and app_id not in seen_ids:
+                seen_ids.add(app_id)
+                app_name, developer = _apkpure_app_name(href, first_app)
+
+                img = first_app.find('img')
+                icon = img.get('src') or img.get('data-src') if img else None
+
+                apps.append({
+                    'title': app_name,
+                    'appId': app_id,
+                    'developer': developer,
+                    'score': 0.0,
+                    'icon': icon
+                })
+
+    search_container = soup.find('ul', class_='search-res')
+
+    if search_container:
+        for li in search_container.find_all('li'):
+            if len(apps) >= num_results:
+                break
+
+            link = li.find('a', href=True)
+            if not link:
+                continue
+
+            href = link.get('href', '')
+            app_id = _extract_apkpure_app_id(href)
+
+            if not app_id or app_id in seen_ids:
+                continue
+            seen_ids.add(app_id)
+
+            app_name, developer = _apkpure_app_name(href, li)
+
+            img = li.find('img')
+            icon = None
+            if img:
+                icon = img.get('src') or img.get('data-src') or img.get('data-original')
+
+            score = 0.0
+            score_elem = li.find(class_='star')
+            if score_elem:
+                try:
+                    score = float(score_elem.get_text(strip=True))
+                except:
+                    pass
+
+            apps.append({
+                'title': app_name,
+                'appId': app_id,
+                'developer': developer,
+                'score': score,
+                'icon': icon
+            })
+
+    return apps[:num_results]
+
+def extract_main_text(html: str) -> Optional[str]:
+    """Main article text of a page (trafilatura); CPU-heavy, so it runs in the parse pool"""
+    return trafilatura.extract(html)
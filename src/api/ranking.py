@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""Relevance ranking for search results from every source.
+
+normalize_text folds case, compatibility forms, Latin accents and Arabic
+spelling variants (diacritics, tatweel, alef/yeh/teh marbuta forms,
+Arabic-Indic digits) so "WhatsApp", "whatsápp" and "واتساب" / "وٱتسآب"
+compare equal to their plain spellings.
+
+A Signature is computed once per text: its tokens and the set of padded
+character trigrams. Scoring a candidate against the query signature then
+costs set lookups proportional to the query size, so ranking n results is
+O(n) instead of comparing every query word with every title word. Only a
+query word that shares too few trigrams with the title falls back to a
+bounded edit distance (with transpositions) against title words of similar
+length, which catches typos like "pubj" or "telegarm" that break most
+trigrams of a short word.
+"""
+import heapq
+import unicodedata
+from typing import Any, Callable, Dict, FrozenSet, Iterable, List, Optional, Sequence, Tuple
+
+GRAM = 3
+# A query token counts as present when this share of its trigrams occur in the title
+TOKEN_MATCH_THRESHOLD = 0.6
+# Edits tolerated between a query word and a title word: one up to this length, two beyond it
+TYPO_SHORT_TOKEN = 5
+# Share of the score taken by a result's position in its own source's list
+POSITION_WEIGHT = 0.1
+
+ARABIC_FOLDS = str.maketrans({
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',
+    'ى': 'ي', 'ئ': 'ي', 'ی': 'ي',
+    'ؤ': 'و',
+    'ة': 'ه',
+    'ک': 'ك',
+    'ـ': None,
+})
+
+def normalize_text(text: str) -> str:
+    """Casefolded text with accents, Arabic variants and punctuation folded away"""
+    decomposed = unicodedata.normalize('NFKD', text or '')
+    chars = []
+    for char in decomposed:
+        category = unicodedata.category(char)
+        if category == 'Mn':
+            continue
+        if category == 'Nd':
+            chars.append(str(unicodedata.digit(char)))
+        elif category[0] in 'LN':
+            chars.append(char)
+        else:
+            chars.append(' ')
+    folded = unicodedata.normalize('NFC', ''.join(chars)).casefold().translate(ARABIC_FOLDS)
+    return ' '.join(folded.split())
+
+def _grams(token: str) -> FrozenSet[str]:
+    padded = f" {token} "
+    return frozenset(padded[i:i + GRAM] for i in range(len(padded) - GRAM + 1))
+
+class Signature:
+    __slots__ = ("text", "tokens", "token_set", "grams", "token_grams")
+
+    def __init__(self, text: str):
+        self.text = normalize_text(text)
+        self.tokens = tuple(self.text.split())
+        self.token_set = frozenset(self.tokens)
+        self.token_grams = tuple(_grams(token) for token in self.tokens)
+        self.grams = frozenset().union(*self.token_grams) if self.tokens else frozenset()
+
+def _edit_distance(a: str, b: str, limit: int) -> int:
+    """Optimal string alignment distance (adjacent transpositions count once), or limit + 1 past limit"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous2: List[int] = []
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+def _typo_score(token: str, candidate: Signature) -> float:
+    if len(token) < GRAM:
+        return 0.0
+    limit = 1 if len(token) <= TYPO_SHORT_TOKEN else 2
+    best = min((_edit_distance(token, word, limit) for word in candidate.tokens), default=limit + 1)
+    return 0.7 * (1 - best / len(token)) if best <= limit else 0.0
+
+def _token_score(index: int, query: Signature, candidate: Signature) -> float:
+    token = query.tokens[index]
+    if token in candidate.token_set:
+        return 1.0
+    if token in candidate.text:
+        return 0.9
+    grams = query.token_grams[index]
+    containment = len(grams & candidate.grams) / len(grams)
+    if containment >= TOKEN_MATCH_THRESHOLD:
+        return containment * 0.8
+    return _typo_score(token, candidate)
+
+def similarity(query: Signature, candidate: Signature) -> float:
+    """Relevance of a candidate to the query in [0, 1]; 0 means no query token matched"""
+    if not query.tokens or not candidate.tokens:
+        return 0.0
+    coverage = sum(_token_score(i, query, candidate) for i in range(len(query.tokens))) / len(query.tokens)
+    if not coverage:
+        # A title word wholly inside a query word ("tele" for "telegram") still counts as a weak match
+        if any(token in query.text for token in candidate.tokens if len(token) >= GRAM):
+            coverage = 0.3
+        else:
+            return 0.0
+    overlap = 2 * len(query.grams & candidate.grams) / (len(query.grams) + len(candidate.grams))
+    prefix = 1.0 if candidate.text.startswith(query.text) else 0.0
+    return 0.6 * coverage + 0.3 * overlap + 0.1 * prefix
+
+def rank(query: str, items: Iterable[Any], key: Callable[[Any], str], min_score: float = 0.0,
+         limit: Optional[int] = None) -> List[Tuple[float, Any]]:
+    """(score, item) pairs scoring above min_score, best first; ties keep input order"""
+    signature = Signature(query)
+    scored = []
+    for position, item in enumerate(items):
+        score = similarity(signature, Signature(key(item)))
+        if score > min_score:
+            scored.append((score, -position, item))
+    if limit is not None:
+        best = heapq.nlargest(limit, scored, key=lambda entry: entry[:2])
+    else:
+        best = sorted(scored, key=lambda entry: entry[:2], reverse=True)
+    return [(score, item) for score, _, item in best]
+
+def rank_merged(query: str, sources: Sequence[List[Dict[str, Any]]], limit: Optional[int] = None,
+                title_key: str = "title") -> List[Dict[str, Any]]:
+    """Interleave several sources' result lists by relevance to the query.
+
+    Each source's own ordering is kept as a small prior, so a site's best
+    hit is not overtaken by an equally similar title further down another
+    list. Every returned result gets a ``relevance`` field.
+    """
+    signature = Signature(query)
+    scored = []
+    sequence = 0
+    for results in sources:
+        for position, result in enumerate(results):
+            title = result.get("originalTitle") or result.get(title_key) or ""
+            relevance = similarity(signature, Signature(title))
+            prior = 1 - position / len(results)
+            result["relevance"] = round(relevance, 3)
+            scored.append(((1 - POSITION_WEIGHT) * relevance + POSITION_WEIGHT * prior, -sequence, result))
+            sequence += 1
+    if limit is not None:
+        best = heapq.nlargest(limit, scored, key=lambda entry: entry[:2])
+    else:
+        best = sorted(scored, key=lambda entry: entry[:2], reverse=True)
+    return [result for _, _, result in best]
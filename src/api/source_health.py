@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""Health tracking for upstream sources (APKPure, apkeep, MODYOLO, AN1).
+
+SourceHealth keeps a rolling window of call outcomes and latencies for one
+source. Its circuit breaker opens after a run of consecutive failures or
+when the failure ratio over the window crosses a threshold, rejects calls
+for a cool-off period, then lets a single probe through (half-open). A
+failed probe doubles the cool-off up to a ceiling; a successful one closes
+the breaker and drops the failures from the window. timeout() turns the
+observed latency percentile into a per-call timeout that never exceeds the
+caller's fixed default.
+"""
+import sys
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+class SourceUnavailable(Exception):
+    """Every source that could serve the request has an open circuit"""
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class SourceHealth:
+    def __init__(self, name: str, window: float = 300, min_samples: int = 5, failure_ratio: float = 0.5,
+                 consecutive_failures: int = 5, cool_off: float = 30, max_cool_off: float = 600,
+                 timeout_percentile: float = 95, timeout_multiplier: float = 3, timeout_floor: float = 2):
+        self.name = name
+        self.window = window
+        self.min_samples = min_samples
+        self.failure_ratio = failure_ratio
+        self.consecutive_failures = consecutive_failures
+        self.base_cool_off = cool_off
+        self.max_cool_off = max_cool_off
+        self.timeout_percentile = timeout_percentile
+        self.timeout_multiplier = timeout_multiplier
+        self.timeout_floor = timeout_floor
+
+        self.samples: Deque[Tuple[float, bool, float]] = deque()
+        self.state = CLOSED
+        self.failure_streak = 0
+        self.cool_off = cool_off
+        self.opened_until = 0.0
+        self.probe_started_at = 0.0
+        self.stats = {"successes": 0, "failures": 0, "rejected": 0, "opened": 0}
+
+    def _trim(self, now: float):
+        while self.samples and self.samples[0][0] < now - self.window:
+            self.samples.popleft()
+
+    def allow(self, now: Optional[float] = None) -> bool:
+        """Whether a call may go to the source now; in half-open state one probe per cool-off passes"""
+        now = now or time.time()
+        if self.state == CLOSED:
+            return True
+        if now >= self.opened_until and now - self.probe_started_at >= self.cool_off:
+            # A probe whose caller never reported back is retried after another cool-off
+            self.state = HALF_OPEN
+            self.probe_started_at = now
+            return True
+        self.stats["rejected"] += 1
+        return False
+
+    def retry_after(self, now: Optional[float] = None) -> float:
+        now = now or time.time()
+        if self.state == CLOSED:
+            return 0.0
+        return max(self.opened_until, self.probe_started_at + self.cool_off) - now
+
+    def record(self, ok: bool, latency: float, now: Optional[float] = None):
+        now = now or time.time()
+        self.samples.append((now, ok, latency))
+        self._trim(now)
+        if ok:
+            self.stats["successes"] += 1
+            self.failure_streak = 0
+            if self.state != CLOSED:
+                print(f"[Health] {self.name} recovered, closing circuit", file=sys.stderr)
+                self.state = CLOSED
+                self.cool_off = self.base_cool_off
+                # Failures from before the outage would otherwise reopen it on the next single failure
+                self.samples = deque(sample for sample in self.samples if sample[1])
+            return
+
+        self.stats["failures"] += 1
+        self.failure_streak += 1
+        if self.state == HALF_OPEN:
+            self._open(now, min(self.cool_off * 2, self.max_cool_off))
+        elif self.state == CLOSED and self._should_open():
+            self._open(now, self.base_cool_off)
+
+    def _should_open(self) -> bool:
+        if self.failure_streak >= self.consecutive_failures:
+            return True
+        if len(self.samples) < self.min_samples:
+            return False
+        failures = sum(1 for _, ok, _ in self.samples if not ok)
+        return failures / len(self.samples) >= self.failure_ratio
+
+    def _open(self, now: float, cool_off: float):
+        self.state = OPEN
+        self.cool_off = cool_off
+        self.opened_until = now + cool_off
+        self.stats["opened"] += 1
+        print(f"[Health] {self.name} circuit open for {cool_off:.0f}s "
+              f"({self.failure_streak} consecutive failures)", file=sys.stderr)
+
+    def reset(self):
+        """Close the circuit and forget the window, e.g. after fixing the source by hand"""
+        self.samples.clear()
+        self.state = CLOSED
+        self.failure_streak = 0
+        self.cool_off = self.base_cool_off
+        self.opened_until = self.probe_started_at = 0.0
+
+    def latency_percentile(self, pct: float, now: Optional[float] = None) -> Optional[float]:
+        """Latency percentile of successful calls in the window; None until min_samples exist"""
+        self._trim(now or time.time())
+        latencies = sorted(latency for _, ok, latency in self.samples if ok)
+        if len(latencies) < self.min_samples:
+            return None
+        index = min(len(latencies) - 1, max(0, int(round(pct / 100 * len(latencies))) - 1))
+        return latencies[index]
+
+    def timeout(self, default: float) -> float:
+        """A multiple of the latency percentile, clamped to [timeout_floor, default]"""
+        observed = self.latency_percentile(self.timeout_percentile)
+        if observed is None:
+            return default
+        return min(default, max(self.timeout_floor, observed * self.timeout_multiplier))
+
+    def snapshot(self, default_timeout: Optional[float] = None) -> Dict[str, Any]:
+        now = time.time()
+        self._trim(now)
+        failures = sum(1 for _, ok, _ in self.samples if not ok)
+        p50 = self.latency_percentile(50, now)
+        p95 = self.latency_percentile(95, now)
+        return {
+            **self.stats,
+            "state": self.state,
+            "window_calls": len(self.samples),
+            "failure_ratio": round(failures / len(self.samples), 3) if self.samples else 0.0,
+            "failure_streak": self.failure_streak,
+            "latency_p50": round(p50, 3) if p50 is not None else None,
+            "latency_p95": round(p95, 3) if p95 is not None else None,
+            "timeout": round(self.timeout(default_timeout), 2) if default_timeout else None,
+            "retry_after": round(max(0.0, self.retry_after(now)), 1)
+        }
@@ -0,0 +1,200 @@
+import json
+import random
+import struct
+import zipfile
+
+import pytest
+
+from apk_metadata import detect_file_type, parse_binary_manifest, read_artifact_metadata
+
+NO_INDEX = 0xFFFFFFFF
+TYPE_STRING = 0x03
+TYPE_INT_DEC = 0x10
+ANDROID_NS = "http://schemas.android.com/apk/res/android"
+# Attribute names backed by framework resource ids come first in the pool, as aapt lays them out
+RESOURCE_ATTRS = {"versionCode": 0x0101021b, "versionName": 0x0101021c, "minSdkVersion": 0x0101020c,
+                  "targetSdkVersion": 0x01010270}
+
+def _utf8_length(length):
+    return bytes([0x80 | length >> 8, length & 0xFF]) if length > 0x7F else bytes([length])
+
+def _pool_string(text, utf8):
+    if utf8:
+        encoded = text.encode("utf-8")
+        return _utf8_length(len(text)) + _utf8_length(len(encoded)) + encoded + b"\x00"
+    encoded = text.encode("utf-16-le")
+    length = len(encoded) // 2
+    prefix = struct.pack("<HH", 0x8000 | length >> 16, length & 0xFFFF) if length > 0x7FFF else struct.pack("<H", length)
+    return prefix + encoded + b"\x00\x00"
+
+def _chunk(chunk_type, header, body=b""):
+    header_size = 8 + len(header)
+    return struct.pack("<HHI", chunk_type, header_size, header_size + len(body)) + header + body
+
+def build_manifest(manifest_attrs, sdk_attrs, utf8=False):
+    """Compile a minimal AndroidManifest.xml the way aapt lays out the chunks.
+
+    Attributes are (name, value) pairs; int values become TYPE_INT_DEC, str
+    values TYPE_STRING with a raw value.
+    """
+    strings = list(RESOURCE_ATTRS)
+    def index(text):
+        if text not in strings:
+            strings.append(text)
+        return strings.index(text)
+
+    def element(name, attrs):
+        encoded = b""
+        for attr_name, value in attrs:
+            if isinstance(value, int):
+                raw, data_type, data = NO_INDEX, TYPE_INT_DEC, value
+            else:
+                raw = data = index(value)
+                data_type = TYPE_STRING
+            namespace = index(ANDROID_NS) if attr_name in RESOURCE_ATTRS else NO_INDEX
+            encoded += struct.pack("<IIIHBBI", namespace, index(attr_name), raw, 8, 0, data_type, data)
+        header = struct.pack("<II", 1, NO_INDEX)
+        body = struct.pack("<IIHHHHHH", NO_INDEX, index(name), 20, 20, len(attrs), 0, 0, 0) + encoded
+        return _chunk(0x0102, header, body)
+
+    namespace = _chunk(0x0100, struct.pack("<II", 1, NO_INDEX), struct.pack("<II", index("android"), index(ANDROID_NS)))
+    elements = element("manifest", manifest_attrs) + element("uses-sdk", sdk_attrs) + element("application", [])
+
+    data = b"".join(_pool_string(text, utf8) for text in strings)
+    data += b"\x00" * (-len(data) % 4)
+    offsets, position = [], 0
+    for text in strings:
+        offsets.append(position)
+        position += len(_pool_string(text, utf8))
+    header = struct.pack("<IIIII", len(strings), 0, 0x100 if utf8 else 0, 20 + 8 + 4 * len(strings), 0)
+    pool = _chunk(0x0001, header, struct.pack(f"<{len(strings)}I", *offsets) + data)
+    resource_map = _chunk(0x0180, b"", struct.pack("<4I", *RESOURCE_ATTRS.values()))
+
+    body = pool + resource_map + namespace + elements
+    return struct.pack("<HHI", 0x0003, 8, 8 + len(body)) + body
+
+MANIFEST_ATTRS = [("versionCode", 4021), ("versionName", "4.2.1"), ("package", "com.example.app")]
+SDK_ATTRS = [("minSdkVersion", 21), ("targetSdkVersion", 34)]
+EXPECTED = {"package": "com.example.app", "versionName": "4.2.1", "versionCode": 4021,
+            "minSdkVersion": 21, "targetSdkVersion": 34}
+
+@pytest.mark.parametrize("utf8", [False, True])
+def test_parse_binary_manifest(utf8):
+    assert parse_binary_manifest(build_manifest(MANIFEST_ATTRS, SDK_ATTRS, utf8=utf8)) == EXPECTED
+
+def test_string_valued_numbers_are_kept_as_strings():
+    manifest = build_manifest([("package", "com.example.app"), ("versionCode", "7")], [("minSdkVersion", "L")])
+    assert parse_binary_manifest(manifest) == {"package": "com.example.app", "versionCode": "7", "minSdkVersion": "L"}
+
+@pytest.mark.parametrize("utf8, package", [
+    (True, "com." + "a" * 200),
+    (True, "com.example.تطبيق"),
+    (False, "com." + "a" * 40000),
+])
+def test_long_and_non_ascii_strings(utf8, package):
+    # Lengths past 0x7F (UTF-8) or 0x7FFF (UTF-16) take the two-unit length form
+    assert parse_binary_manifest(build_manifest([("package", package)], [], utf8=utf8)) == {"package": package}
+
+@pytest.mark.parametrize("data", [b"", b"\x03\x00", b"\x01\x00\x08\x00\x10\x00\x00\x00", b"PK\x03\x04" + b"\x00" * 40])
+def test_non_axml_input_gives_nothing(data):
+    assert parse_binary_manifest(data) == {}
+
+def test_truncated_and_corrupt_manifests_fail_cleanly():
+    manifest = build_manifest(MANIFEST_ATTRS, SDK_ATTRS)
+    rng = random.Random(1234)
+    samples = [manifest[:cut] for cut in range(0, len(manifest), 3)]
+    for _ in range(300):
+        corrupt = bytearray(manifest)
+        for _ in range(rng.randint(1, 8)):
+            corrupt[rng.randrange(8, len(corrupt))] = rng.randrange(256)
+        samples.append(bytes(corrupt))
+    for sample in samples:
+        try:
+            info = parse_binary_manifest(sample)
+        except (struct.error, IndexError, UnicodeDecodeError):
+            continue
+        assert isinstance(info, dict)
+
+def write_zip(path, files, stored=()):
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+        for name, data in files.items():
+            zf.writestr(name, data, compress_type=zipfile.ZIP_STORED if name in stored else zipfile.ZIP_DEFLATED)
+    return str(path)
+
+def test_read_apk_metadata(tmp_path):
+    path = write_zip(tmp_path / "app.apk", {
+        "AndroidManifest.xml": build_manifest(MANIFEST_ATTRS, SDK_ATTRS),
+        "classes.dex": b"dex\n",
+        "lib/x86/libapp.so": b"\x7fELF",
+        "lib/arm64-v8a/libapp.so": b"\x7fELF",
+    })
+    assert read_artifact_metadata(path) == {
+        "file_type": "apk", "package": "com.example.app", "label": None, "version_name": "4.2.1",
+        "version_code": 4021, "min_sdk": 21, "target_sdk": 34, "splits": [], "obb": [],
+        "abis": ["arm64-v8a", "x86"],
+    }
+
+def test_read_xapk_metadata(tmp_path):
+    manifest = {
+        "package_name": "com.example.game", "name": "Example Game", "version_name": "2.0", "version_code": "200",
+        "min_sdk_version": "24", "target_sdk_version": "34",
+        "split_apks": [{"file": "base.apk", "id": "base"}, {"file": "config.arm64_v8a.apk", "id": "config.arm64_v8a"}],
+    }
+    path = write_zip(tmp_path / "game.xapk", {
+        "manifest.json": json.dumps(manifest),
+        "base.apk": b"base",
+        "config.arm64_v8a.apk": b"split",
+        "Android/obb/com.example.game/main.200.com.example.game.obb": b"obb" * 10,
+    })
+    meta = read_artifact_metadata(path)
+    assert meta["file_type"] == "xapk"
+    assert (meta["package"], meta["label"], meta["version_code"], meta["min_sdk"]) == ("com.example.game", "Example Game", 200, 24)
+    assert meta["splits"] == [{"id": "base", "file": "base.apk", "size": 4},
+                              {"id": "config.arm64_v8a", "file": "config.arm64_v8a.apk", "size": 5}]
+    assert meta["obb"] == [{"file": "Android/obb/com.example.game/main.200.com.example.game.obb", "size": 30}]
+    assert meta["abis"] == ["arm64-v8a"]
+
+def test_universal_xapk_reads_abis_from_a_stored_base(tmp_path):
+    base = write_zip(tmp_path / "base.apk", {"lib/armeabi-v7a/libgame.so": b"\x7fELF"})
+    with open(base, "rb") as f:
+        base_bytes = f.read()
+    manifest = {"package_name": "com.example.game", "split_apks": [{"file": "base.apk", "id": "base"}]}
+    path = write_zip(tmp_path / "game.xapk", {"manifest.json": json.dumps(manifest), "base.apk": base_bytes},
+                     stored=("base.apk",))
+    assert read_artifact_metadata(path)["abis"] == ["armeabi-v7a"]
+
+@pytest.mark.parametrize("files", [
+    {"AndroidManifest.xml": b"\x03\x00\x08\x00" + b"\xff" * 64},
+    {"AndroidManifest.xml": b"garbage"},
+    {"classes.dex": b"dex\n"},
+])
+def test_corrupt_apks_report_no_details(tmp_path, files):
+    meta = read_artifact_metadata(write_zip(tmp_path / "bad.apk", files))
+    assert meta["file_type"] == "apk"
+    assert meta["package"] is None and meta["version_code"] is None
+
+def test_truncated_manifest_inside_an_apk(tmp_path):
+    manifest = build_manifest(MANIFEST_ATTRS, SDK_ATTRS)
+    meta = read_artifact_metadata(write_zip(tmp_path / "cut.apk", {"AndroidManifest.xml": manifest[:len(manifest) // 2]}))
+    assert meta["file_type"] == "apk"
+    assert meta["version_code"] is None
+
+def test_broken_xapk_manifest_json(tmp_path):
+    meta = read_artifact_metadata(write_zip(tmp_path / "bad.xapk", {"manifest.json": "{not json", "base.apk": b"x"}))
+    assert meta["file_type"] == "xapk"
+    assert meta["package"] is None
+    assert meta["splits"] == [{"id": "base", "file": "base.apk", "size": 1}]
+
+def test_not_a_zip(tmp_path):
+    path = tmp_path / "truncated.apk"
+    path.write_bytes(b"PK\x03\x04" + b"\x00" * 10)
+    assert read_artifact_metadata(str(path)) == {"file_type": "apk"}
+
+@pytest.mark.parametrize("names, file_type", [
+    (["AndroidManifest.xml", "classes.dex"], "apk"),
+    (["manifest.json", "base.apk"], "xapk"),
+    (["base.apk", "config.en.apk"], "xapk"),
+    (["Android/obb/pkg/main.1.pkg.obb", "pkg.apk"], "xapk"),
+])
+def test_detect_file_type(names, file_type):
+    assert detect_file_type(names) == file_type
@@ -0,0 +1,57 @@
+import asyncio
+import os
+import stat
+
+import pytest
+
+api_server = pytest.importorskip("api_server")
+
+PACKAGE = "com.example.app"
+
+def fake_apkeep(tmp_path, body):
+    """A stand-in apkeep: `body` runs with $2 = package and $3 = output dir"""
+    script = tmp_path / "apkeep"
+    script.write_text("#!/bin/sh\n" + body + "\n")
+    script.chmod(script.stat().st_mode | stat.S_IXUSR)
+    return str(script)
+
+def run(monkeypatch, tmp_path, body):
+    output_dir = tmp_path / "out"
+    output_dir.mkdir(exist_ok=True)
+    monkeypatch.setattr(api_server, "APKEEP_PATH", fake_apkeep(tmp_path, body))
+    transfer = {}
+    path = asyncio.run(api_server.download_with_apkeep(PACKAGE, str(output_dir), transfer))
+    return path, transfer, output_dir
+
+def test_success_returns_the_written_file(monkeypatch, tmp_path):
+    path, transfer, output_dir = run(monkeypatch, tmp_path,
+                                     'printf apk > "$3/$2.apk"; echo "$2 downloaded successfully!"')
+    assert path == str(output_dir / f"{PACKAGE}.apk")
+    assert transfer["status"] == "complete"
+    assert transfer["total"] == 3
+
+@pytest.mark.parametrize("body", [
+    # Success reported without any file
+    'echo "$2 downloaded successfully!"',
+    # An empty (partial) file
+    ': > "$3/$2.xapk"; echo "$2 downloaded successfully!"',
+])
+def test_success_message_without_a_usable_file_is_a_failure(monkeypatch, tmp_path, body):
+    path, transfer, output_dir = run(monkeypatch, tmp_path, body)
+    assert path is None
+    assert transfer["status"] == "error"
+    assert os.listdir(output_dir) == []
+
+def test_file_from_an_earlier_run_is_not_taken_for_this_one(monkeypatch, tmp_path):
+    output_dir = tmp_path / "out"
+    output_dir.mkdir()
+    (output_dir / f"{PACKAGE}.apk").write_bytes(b"old")
+    path, transfer, _ = run(monkeypatch, tmp_path, 'echo "$2 downloaded successfully!"')
+    assert path is None
+    assert transfer["status"] == "error"
+    assert (output_dir / f"{PACKAGE}.apk").read_bytes() == b"old"
+
+def test_not_found(monkeypatch, tmp_path):
+    path, transfer, _ = run(monkeypatch, tmp_path, 'echo "Could not get download URL for $2. Skipping."')
+    assert path is None
+    assert transfer["status"] == "not_found"
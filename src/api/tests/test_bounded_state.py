@@ -0,0 +1,154 @@
+import asyncio
+import time
+
+import pytest
+
+from bounded_state import ExpiringSet, KeyedLockTable
+
+T0 = 1000.0
+
+def test_keys_expire_after_their_ttl():
+    cache = ExpiringSet(ttl=60, max_entries=10)
+    cache.add("a", now=T0)
+    cache.add("b", ttl=10, now=T0)
+    assert cache.get("a", now=T0 + 59) == T0
+    assert cache.get("b", now=T0 + 9) == T0
+    assert cache.get("b", now=T0 + 10) is None
+    assert cache.get("a", now=T0 + 60) is None
+    assert len(cache) == 0
+    assert cache.stats["expired"] == 2
+
+def test_purge_drops_only_expired_keys():
+    cache = ExpiringSet(ttl=60, max_entries=10)
+    for i in range(5):
+        cache.add(f"k{i}", ttl=10 * (i + 1), now=T0)
+    assert cache.purge(now=T0 + 25) == 2
+    assert sorted(key for key, _, _ in cache.items(now=T0 + 25)) == ["k2", "k3", "k4"]
+
+def test_readding_a_key_extends_it():
+    cache = ExpiringSet(ttl=60, max_entries=10)
+    cache.add("a", now=T0)
+    cache.add("a", now=T0 + 50)
+    assert cache.purge(now=T0 + 70) == 0
+    assert cache.get("a", now=T0 + 70) == T0 + 50
+
+def test_capacity_evicts_the_keys_closest_to_expiry():
+    cache = ExpiringSet(ttl=60, max_entries=3)
+    cache.add("short", ttl=10, now=T0)
+    cache.add("long", ttl=100, now=T0)
+    cache.add("medium", ttl=50, now=T0)
+    cache.add("newest", ttl=60, now=T0 + 1)
+    assert len(cache) == 3
+    assert "short" not in cache
+    assert {"long", "medium", "newest"} <= {key for key, _, _ in cache.items(now=T0 + 1)}
+    assert cache.stats["evicted"] == 1
+
+def test_heap_is_rebuilt_when_stale_nodes_pile_up():
+    cache = ExpiringSet(ttl=60, max_entries=10)
+    for i in range(500):
+        cache.add("same", now=T0 + i)
+    assert len(cache) == 1
+    assert len(cache.heap) <= 2 * len(cache) + 65
+
+def test_remove_and_clear():
+    cache = ExpiringSet(ttl=60, max_entries=10)
+    cache.add("a")
+    cache.add("b")
+    assert cache.remove("a")
+    assert not cache.remove("a")
+    cache.clear()
+    assert len(cache) == 0 and "b" not in cache
+
+def test_entries_survive_a_restart(tmp_path):
+    db = str(tmp_path / "entries.sqlite3")
+    cache = ExpiringSet(ttl=60, max_entries=10, db_path=db)
+    cache.add("kept")
+    # Added long enough ago that it has already expired when the set is reopened
+    cache.add("gone", ttl=10, now=time.time() - 60)
+    cache.close()
+    reopened = ExpiringSet(ttl=60, max_entries=10, db_path=db)
+    assert "kept" in reopened
+    assert "gone" not in reopened
+    reopened.close()
+
+def test_shared_sets_see_each_other_after_the_lookup_ttl(tmp_path):
+    db = str(tmp_path / "shared.sqlite3")
+    first = ExpiringSet(ttl=60, max_entries=10, db_path=db, shared=True, lookup_ttl=5)
+    second = ExpiringSet(ttl=60, max_entries=10, db_path=db, shared=True, lookup_ttl=5)
+    now = T0 * 1000
+    assert second.get("pkg", now=now) is None
+    first.add("pkg", now=now)
+    # The miss is remembered, so the other worker's entry shows up only once it is re-read
+    assert second.get("pkg", now=now + 1) is None
+    assert second.get("pkg", now=now + 6) == now
+    assert first.get("pkg", now=now + 1) == now
+    first.remove("pkg")
+    assert first.get("pkg", now=now + 2) is None
+    first.close()
+    second.close()
+
+def test_shared_lookup_memory_is_bounded(tmp_path):
+    shared = ExpiringSet(ttl=60, max_entries=5, db_path=str(tmp_path / "shared.sqlite3"), shared=True)
+    for i in range(20):
+        assert f"pkg{i}" not in shared
+    assert len(shared.lookups) == 5
+    shared.close()
+
+def test_lock_table_serialises_a_key_and_forgets_it():
+    table = KeyedLockTable()
+    order = []
+
+    async def worker(name, key):
+        async with table(key):
+            order.append(f"{name} in")
+            await asyncio.sleep(0.01)
+            order.append(f"{name} out")
+
+    async def main():
+        await asyncio.gather(worker("a", "pkg"), worker("b", "pkg"), worker("c", "other"))
+        return len(table)
+
+    assert asyncio.run(main()) == 0
+    assert order.index("a out") < order.index("b in")
+    assert order.index("c in") < order.index("a out")
+
+def test_lock_table_drops_a_cancelled_waiter():
+    table = KeyedLockTable()
+
+    async def main():
+        async with table("pkg"):
+            waiter = asyncio.create_task(table("pkg").__aenter__())
+            await asyncio.sleep(0)
+            assert table.locks["pkg"][1] == 2
+            waiter.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await waiter
+            assert table.locks["pkg"][1] == 1
+            assert table.locked("pkg")
+        return len(table), table.locked("pkg")
+
+    assert asyncio.run(main()) == (0, False)
+
+def test_lock_table_releases_on_error():
+    table = KeyedLockTable()
+
+    async def main():
+        with pytest.raises(RuntimeError):
+            async with table("pkg"):
+                raise RuntimeError("download failed")
+        return len(table), table.locked_count()
+
+    assert asyncio.run(main()) == (0, 0)
+
+def test_lock_table_file_locks_cover_other_processes(tmp_path):
+    table = KeyedLockTable(str(tmp_path))
+
+    async def main():
+        async with table("com.example/app"):
+            held = table.locked("com.example/app"), (tmp_path / "com.example_app.lock").exists()
+        return held, table.locked("com.example/app"), len(table)
+
+    held, after, remaining = asyncio.run(main())
+    assert held == (True, True)
+    assert not after
+    assert remaining == 0
@@ -0,0 +1,158 @@
+import asyncio
+import os
+
+import pytest
+
+api_server = pytest.importorskip("api_server")
+from starlette.requests import Request
+
+SIZE = 1000
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-99", (0, 99)),
+    ("bytes=0-0", (0, 0)),
+    ("BYTES = 10-19", (10, 19)),
+    # Suffix ranges
+    ("bytes=-100", (900, 999)),
+    ("bytes=-2000", (0, 999)),
+    # Open-ended ranges
+    ("bytes=900-", (900, 999)),
+    ("bytes=0-", (0, 999)),
+    ("bytes=500-5000", (500, 999)),
+    # Unsatisfiable: nothing overlaps the file
+    ("bytes=1000-", (SIZE, SIZE)),
+    ("bytes=1000-2000", (SIZE, SIZE)),
+    ("bytes=-0", (SIZE, SIZE)),
+    # Multiple ranges fall back to the single span covering them
+    ("bytes=0-10,20-30", (0, 30)),
+    ("bytes=0-10, -100", (0, 999)),
+    ("bytes=500-599,100-199", (100, 599)),
+    ("bytes=1000-1100, 0-9", (0, 9)),
+    # Malformed headers are ignored
+    ("bytes=10-5", None),
+    ("items=0-5", None),
+    ("bytes=abc", None),
+    ("bytes=-", None),
+    ("bytes=5", None),
+    ("bytes=0-5,x-", None),
+])
+def test_parse_byte_range(header, expected):
+    assert api_server.parse_byte_range(header, SIZE) == expected
+
+ETAG = '"abc123"'
+LAST_MODIFIED = "Wed, 14 Oct 2026 10:00:00 GMT"
+
+@pytest.mark.parametrize("header, matches", [
+    ('"abc123"', True),
+    ('W/"abc123"', True),
+    ('"other", W/"abc123"', True),
+    ("*", True),
+    ('"abc124"', False),
+    ('W/"other"', False),
+])
+def test_etag_matches_uses_weak_comparison(header, matches):
+    assert api_server.etag_matches(header, ETAG) is matches
+
+@pytest.mark.parametrize("header, matches", [
+    (None, True),
+    ('"abc123"', True),
+    (' "abc123" ', True),
+    ('"abc124"', False),
+    # If-Range requires a strong validator
+    ('W/"abc123"', False),
+    (LAST_MODIFIED, True),
+    ("Wed, 14 Oct 2026 09:59:59 GMT", False),
+])
+def test_if_range_matches_etag_or_date(header, matches):
+    assert api_server.if_range_matches(header, ETAG, LAST_MODIFIED) is matches
+
+def make_request(headers):
+    return Request({
+        "type": "http",
+        "method": "GET",
+        "path": "/download",
+        "headers": [(name.lower().encode(), value.encode()) for name, value in headers.items()],
+    })
+
+def run_response(response):
+    """Send a response through a bare ASGI exchange; returns (status, headers, body)"""
+    messages = []
+
+    async def receive():
+        # The client never disconnects; responses stop listening once the body is sent
+        await asyncio.Event().wait()
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {"type": "http", "method": "GET", "path": "/download", "headers": []}
+    asyncio.run(response(scope, receive, send))
+    start = messages[0]
+    headers = {name.decode().lower(): value.decode() for name, value in start["headers"]}
+    body = b"".join(message.get("body", b"") for message in messages[1:])
+    return start["status"], headers, body
+
+@pytest.fixture
+def artifact(tmp_path):
+    path = tmp_path / "com.example.apk"
+    path.write_bytes(bytes(range(256)) * 4)
+    return str(path)
+
+def serve(artifact, headers=None):
+    return run_response(api_server.artifact_response(make_request(headers or {}), "com.example", artifact, {}))
+
+def test_full_response_carries_validators(artifact):
+    status, headers, body = serve(artifact)
+    assert status == 200
+    assert body == bytes(range(256)) * 4
+    assert headers["content-length"] == "1024"
+    assert headers["accept-ranges"] == "bytes"
+    assert headers["etag"] and headers["last-modified"]
+
+@pytest.mark.parametrize("range_header, content_range, span", [
+    ("bytes=0-9", "bytes 0-9/1024", (0, 10)),
+    ("bytes=-24", "bytes 1000-1023/1024", (1000, 1024)),
+    ("bytes=1020-", "bytes 1020-1023/1024", (1020, 1024)),
+    ("bytes=0-1,10-11", "bytes 0-11/1024", (0, 12)),
+])
+def test_range_requests_get_partial_content(artifact, range_header, content_range, span):
+    status, headers, body = serve(artifact, {"Range": range_header})
+    assert status == 206
+    assert headers["content-range"] == content_range
+    assert body == (bytes(range(256)) * 4)[span[0]:span[1]]
+    assert headers["content-length"] == str(len(body))
+
+def test_unsatisfiable_range_is_416(artifact):
+    status, headers, _ = serve(artifact, {"Range": "bytes=5000-"})
+    assert status == 416
+    assert headers["content-range"] == "bytes */1024"
+
+def test_if_range_mismatch_sends_the_whole_file(artifact):
+    status, _, body = serve(artifact, {"Range": "bytes=0-9", "If-Range": '"stale"'})
+    assert status == 200
+    assert len(body) == 1024
+
+@pytest.mark.parametrize("validator", ["etag", "last-modified"])
+def test_if_range_with_current_validator_honours_the_range(artifact, validator):
+    _, headers, _ = serve(artifact)
+    status, _, body = serve(artifact, {"Range": "bytes=0-9", "If-Range": headers[validator]})
+    assert status == 206
+    assert len(body) == 10
+
+def test_if_none_match_returns_304(artifact):
+    _, headers, _ = serve(artifact)
+    status, _, body = serve(artifact, {"If-None-Match": f'W/{headers["etag"]}'})
+    assert status == 304
+    assert body == b""
+
+@pytest.mark.parametrize("range_header", [None, "bytes=0-"])
+def test_replaced_file_keeps_length_and_bytes_consistent(artifact, tmp_path, range_header):
+    # A prefetch refresh swaps the file after the response was built but before its body is sent
+    response = api_server.artifact_response(make_request({"Range": range_header} if range_header else {}),
+                                            "com.example", artifact, {})
+    replacement = tmp_path / "refreshed.apk"
+    replacement.write_bytes(b"new" * 1000)
+    os.replace(replacement, artifact)
+    _, headers, body = run_response(response)
+    assert body == bytes(range(256)) * 4
+    assert headers["content-length"] == str(len(body))
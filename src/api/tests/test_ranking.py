@@ -0,0 +1,129 @@
+import asyncio
+
+import pytest
+
+import ranking
+from ranking import Signature, normalize_text, rank, rank_merged, similarity
+
+@pytest.mark.parametrize("text, normalized", [
+    ("WhatsApp—Messenger!", "whatsapp messenger"),
+    ("whatsápp", "whatsapp"),
+    ("Ｗｈａｔｓ", "whats"),
+    ("٣٤", "34"),
+    ("وٱتسآب", "واتساب"),
+    ("مـدرسة", "مدرسه"),
+    ("", ""),
+])
+def test_normalize_text(text, normalized):
+    assert normalize_text(text) == normalized
+
+@pytest.mark.parametrize("query, title", [
+    ("whatsapp", "WhatsApp Messenger"),
+    ("whatsápp", "WhatsApp"),
+    ("واتساب", "وٱتسآب"),
+    ("tele", "Telegram"),
+    ("minecraft", "Minecraft PE"),
+    # Typos that break most trigrams of a short word
+    ("pubj", "PUBG Mobile"),
+    ("telegarm", "Telegram"),
+    ("spotfy", "Spotify Music"),
+    ("mincraft", "Minecraft"),
+])
+def test_similar_titles_match(query, title):
+    assert similarity(Signature(query), Signature(title)) > 0
+
+@pytest.mark.parametrize("query, title", [
+    ("xyzq", "PUBG Mobile"),
+    ("pubg", "Subway Surfers"),
+    ("fb", "Facebook"),
+    ("", "Telegram"),
+    ("telegram", ""),
+])
+def test_unrelated_titles_do_not_match(query, title):
+    assert similarity(Signature(query), Signature(title)) == 0
+
+@pytest.mark.parametrize("query, better, worse", [
+    ("whatsapp", "WhatsApp", "WhatsApp Business Tools"),
+    ("telegram", "Telegram", "Telegarm"),
+    ("pubj", "PUBG Mobile", "Pub Quiz Mobile Edition"),
+    ("minecraft", "Minecraft PE", "Craft World"),
+])
+def test_closer_titles_score_higher(query, better, worse):
+    signature = Signature(query)
+    assert similarity(signature, Signature(better)) > similarity(signature, Signature(worse))
+
+@pytest.mark.parametrize("a, b, limit, distance", [
+    ("pubj", "pubg", 1, 1),
+    ("telegarm", "telegram", 2, 1),
+    ("abc", "abc", 1, 0),
+    ("abc", "xyz", 1, 2),
+    ("spotfy", "spotify", 2, 1),
+    ("ab", "abcdef", 2, 3),
+])
+def test_edit_distance_is_bounded(a, b, limit, distance):
+    assert ranking._edit_distance(a, b, limit) == distance
+
+def test_rank_orders_by_score_and_keeps_input_order_on_ties():
+    titles = ["Subway Surfers", "Telegram X", "Telegram", "Telegram", "Plus Messenger"]
+    ranked = rank("telegram", titles, key=lambda title: title)
+    assert [title for _, title in ranked] == ["Telegram", "Telegram", "Telegram X"]
+    # Equal titles keep their input positions
+    assert ranked[0][1] is titles[2] and ranked[1][1] is titles[3]
+    scores = [score for score, _ in ranked]
+    assert scores == sorted(scores, reverse=True)
+
+def test_rank_limit_and_min_score():
+    titles = ["Telegram", "Telegram X", "Telegram Lite", "Subway Surfers"]
+    assert [title for _, title in rank("telegram", titles, key=str, limit=2)] == ["Telegram", "Telegram X"]
+    assert all(score > 0.95 for score, _ in rank("telegram", titles, key=str, min_score=0.95))
+
+def test_rank_merged_interleaves_sources_by_relevance():
+    apkpure = [{"title": "Subway Surfers"}, {"title": "Telegram"}]
+    mods = [{"title": "Telegram Premium (مهكرة)", "originalTitle": "Telegram"}, {"title": "Plus Messenger"}]
+    merged = rank_merged("telegram", [apkpure, mods])
+    assert [result["title"] for result in merged] == [
+        "Telegram Premium (مهكرة)", "Telegram", "Subway Surfers", "Plus Messenger"
+    ]
+    assert merged[0]["relevance"] == 1.0
+    assert merged[-1]["relevance"] == 0.0
+
+def test_rank_merged_prefers_earlier_positions_between_equal_titles():
+    first = [{"title": "Telegram", "id": 1}, {"title": "Other"}]
+    second = [{"title": "Filler"}, {"title": "Telegram", "id": 2}]
+    merged = rank_merged("telegram", [second, first], limit=2)
+    assert [result.get("id") for result in merged] == [1, 2]
+
+def test_rank_merged_lets_a_source_keep_its_top_hit_over_a_slightly_closer_title():
+    merged = rank_merged("telegram", [[{"title": "Telegram X"}, {"title": "Filler"}, {"title": "Telegram"}]])
+    assert [result["title"] for result in merged] == ["Telegram X", "Telegram", "Filler"]
+
+SEARCH_RESULTS = {
+    "APKPure": [{"title": "Subway Surfers"}, {"title": "Telegram"}],
+    "MODYOLO": [{"title": "Plus Messenger"}, {"title": "Telegram (مهكرة)", "originalTitle": "Telegram"}],
+}
+RANKED = ["Telegram", "Telegram (مهكرة)", "Subway Surfers", "Plus Messenger"]
+UPSTREAM = ["Subway Surfers", "Telegram", "Plus Messenger", "Telegram (مهكرة)"]
+
+@pytest.mark.parametrize("params, titles", [
+    ({}, RANKED),
+    ({"rank": "true"}, RANKED),
+    ({"rank": "false"}, UPSTREAM),
+])
+def test_search_ranks_by_default_and_keeps_upstream_order_on_request(monkeypatch, params, titles):
+    httpx = pytest.importorskip("httpx")
+    api_server = pytest.importorskip("api_server")
+
+    async def fake_search(source, query, num):
+        return [dict(result) for result in SEARCH_RESULTS[source]]
+
+    monkeypatch.setattr(api_server, "search_apkpure", lambda query, num: fake_search("APKPure", query, num))
+    monkeypatch.setattr(api_server, "search_modyolo", lambda query, num: fake_search("MODYOLO", query, num))
+
+    async def search():
+        transport = httpx.ASGITransport(app=api_server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.get("/search", params={"q": "telegram", **params})
+
+    response = asyncio.run(search())
+    assert response.status_code == 200
+    assert [result["title"] for result in response.json()["results"]] == titles
@@ -0,0 +1,122 @@
+import pytest
+
+from source_health import CLOSED, HALF_OPEN, OPEN, SourceHealth
+
+T0 = 1000.0
+
+def make_health(**kwargs) -> SourceHealth:
+    options = dict(window=300, min_samples=5, failure_ratio=0.5, consecutive_failures=3,
+                   cool_off=30, max_cool_off=100)
+    options.update(kwargs)
+    return SourceHealth("test", **options)
+
+def open_circuit(health: SourceHealth, now: float = T0) -> float:
+    for i in range(health.consecutive_failures):
+        health.record(False, 1.0, now=now + i)
+    assert health.state == OPEN
+    return now + health.consecutive_failures - 1
+
+def test_consecutive_failures_open_the_circuit():
+    health = make_health()
+    health.record(False, 1.0, now=T0)
+    health.record(False, 1.0, now=T0 + 1)
+    assert health.state == CLOSED
+    health.record(False, 1.0, now=T0 + 2)
+    assert health.state == OPEN
+    assert not health.allow(now=T0 + 3)
+    assert health.stats["rejected"] == 1
+
+def test_a_success_resets_the_failure_streak():
+    health = make_health(consecutive_failures=3, min_samples=100)
+    for i, ok in enumerate([False, False, True, False, False]):
+        health.record(ok, 1.0, now=T0 + i)
+    assert health.state == CLOSED
+    assert health.failure_streak == 2
+
+@pytest.mark.parametrize("outcomes, state", [
+    ([True, False, True, False], CLOSED),               # ratio reached, but under min_samples
+    ([True, True, True, False, False], CLOSED),         # 2/5 is under the ratio
+    ([True, False, True, False, True, False], OPEN),    # 3/6 reaches the ratio
+])
+def test_failure_ratio_needs_min_samples(outcomes, state):
+    health = make_health(consecutive_failures=100)
+    for i, ok in enumerate(outcomes):
+        health.record(ok, 1.0, now=T0 + i)
+    assert health.state == state
+
+def test_samples_outside_the_window_do_not_count():
+    health = make_health(consecutive_failures=100, window=10)
+    for i in range(4):
+        health.record(False, 1.0, now=T0 + i)
+    for i in range(4):
+        health.record(True, 1.0, now=T0 + 20 + i)
+    health.record(False, 1.0, now=T0 + 24)
+    assert health.state == CLOSED
+
+def test_half_open_lets_one_probe_through_per_cool_off():
+    health = make_health()
+    opened_at = open_circuit(health)
+    assert not health.allow(now=opened_at + 29)
+    assert health.retry_after(now=opened_at + 29) == pytest.approx(1)
+    assert health.allow(now=opened_at + 30)
+    assert health.state == HALF_OPEN
+    assert not health.allow(now=opened_at + 31)
+    # A probe that never reports back is replaced after another cool-off
+    assert health.allow(now=opened_at + 60)
+
+def test_failed_probes_double_the_cool_off_up_to_the_ceiling():
+    health = make_health(cool_off=30, max_cool_off=100)
+    now = open_circuit(health)
+    for expected in (60, 100, 100):
+        now += health.cool_off
+        assert health.allow(now=now)
+        health.record(False, 1.0, now=now)
+        assert health.state == OPEN
+        assert health.cool_off == expected
+        assert not health.allow(now=now + expected - 1)
+
+def test_successful_probe_closes_and_restores_the_base_cool_off():
+    health = make_health()
+    now = open_circuit(health) + 30
+    assert health.allow(now=now)
+    health.record(False, 1.0, now=now)
+    now += 60
+    assert health.allow(now=now)
+    health.record(True, 1.0, now=now)
+    assert health.state == CLOSED
+    assert health.cool_off == 30
+    assert health.allow(now=now + 1)
+
+def test_single_failure_after_recovery_does_not_reopen():
+    health = make_health(consecutive_failures=5)
+    for i in range(5):
+        health.record(False, 1.0, now=T0 + i)
+    assert health.state == OPEN
+    probe_at = T0 + 4 + 30
+    assert health.allow(now=probe_at)
+    health.record(True, 1.0, now=probe_at)
+    assert health.state == CLOSED
+
+    health.record(False, 1.0, now=probe_at + 1)
+    assert health.state == CLOSED
+    assert health.allow(now=probe_at + 2)
+
+def test_reset_closes_and_forgets_the_window():
+    health = make_health()
+    open_circuit(health)
+    health.reset()
+    assert health.state == CLOSED
+    assert not health.samples
+    assert health.retry_after() == 0.0
+
+def test_timeout_follows_latency_within_floor_and_default():
+    health = make_health(timeout_percentile=95, timeout_multiplier=3, timeout_floor=2)
+    assert health.timeout(20) == 20
+    # timeout() reads the window as of now, so these are recorded at the current time
+    for latency in [0.1, 0.2, 0.3, 0.4, 1.0]:
+        health.record(True, latency)
+    assert health.timeout(20) == pytest.approx(3.0)
+    assert health.timeout(2.5) == 2.5
+    for _ in range(20):
+        health.record(True, 0.1)
+    assert health.timeout(20) == 2